@@ -9,6 +9,8 @@ from sqlalchemy.orm import Session
 from database_saas import get_db, SystemAdmin, Employee, Store, Organization, UserRole
 import json
 import ipaddress
+import threading
+import time
 
 # パスワードハッシュ化の設定
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -332,8 +334,11 @@ def log_user_action(
     changes: Optional[dict] = None,
     request: Optional[Request] = None
 ):
-    """ユーザーアクションを監査ログに記録"""
-    from database_saas import AuditLog
+    """
+    ユーザーアクションを監査ログに記録
+    既定ではキューに積んでバックグラウンドで一括書き込み（AUDIT_LOG_MODE=sync で即時コミット）
+    """
+    from services.audit_log_writer import write_audit_log
     
     if isinstance(user, SystemAdmin):
         user_id = user.id
@@ -347,7 +352,7 @@ def log_user_action(
     ip_address = get_client_ip(request) if request else None
     
     # ★★★ 修正箇所: AuditLogの正しいカラム名を使用 ★★★
-    audit_log = AuditLog(
+    write_audit_log(db, dict(
         user_id=user_id,
         user_type=user_type,
         user_email=user_email,
@@ -356,18 +361,56 @@ def log_user_action(
         entity_id=resource_id if resource_id else 0,  # ← resource_id → entity_id (0をデフォルト値に)
         details=json.dumps(changes, ensure_ascii=False) if changes else None,  # ← changes → details
         ip_address=ip_address,
-    )
-    
-    db.add(audit_log)
-    db.commit()
+    ))
 
 # ====== テナント分離関数 ======
 
-def get_user_accessible_stores(user: Union[SystemAdmin, Employee], db: Session) -> list:
-    """ユーザーがアクセス可能な店舗IDリストを取得"""
+# スコープキャッシュ設定（プリンシパル単位でアクセス可能ID集合を保持）
+TENANT_SCOPE_CACHE_TTL = 300  # 5分
+
+_tenant_scope_cache: dict = {}
+_tenant_scope_lock = threading.Lock()
+
+
+def _tenant_scope_key(kind: str, user: Union[SystemAdmin, Employee]) -> tuple:
+    """スコープキャッシュのキーを生成（役割・所属店舗が変われば別キー）"""
     if isinstance(user, SystemAdmin):
-        stores = db.query(Store).filter(Store.is_active == True).all()
-        return [store.id for store in stores]
+        return (kind, "admin", user.id)
+    role = user.role.value if hasattr(user.role, "value") else user.role
+    return (kind, "employee", user.id, user.store_id, role)
+
+
+def _get_cached_scope(key: tuple) -> Optional[frozenset]:
+    with _tenant_scope_lock:
+        entry = _tenant_scope_cache.get(key)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+        _tenant_scope_cache.pop(key, None)
+    return None
+
+
+def _set_cached_scope(key: tuple, scope: frozenset) -> frozenset:
+    with _tenant_scope_lock:
+        _tenant_scope_cache[key] = (scope, time.monotonic() + TENANT_SCOPE_CACHE_TTL)
+    return scope
+
+
+def invalidate_tenant_scope_cache():
+    """店舗・組織の作成や有効/無効切り替え時にスコープキャッシュを破棄"""
+    with _tenant_scope_lock:
+        _tenant_scope_cache.clear()
+
+
+def get_user_accessible_stores(user: Union[SystemAdmin, Employee], db: Session) -> frozenset:
+    """ユーザーがアクセス可能な店舗ID集合を取得（IN句にそのまま渡せる）"""
+    key = _tenant_scope_key("stores", user)
+    cached = _get_cached_scope(key)
+    if cached is not None:
+        return cached
+    
+    if isinstance(user, SystemAdmin):
+        rows = db.query(Store.id).filter(Store.is_active == True).all()
+        return _set_cached_scope(key, frozenset(row[0] for row in rows))
     
     current_role = user.role
     if isinstance(current_role, str):
@@ -377,24 +420,36 @@ def get_user_accessible_stores(user: Union[SystemAdmin, Employee], db: Session)
             current_role = UserRole.STAFF
     
     if current_role == UserRole.OWNER:
-        store = db.query(Store).filter(Store.id == user.store_id).first()
-        if store:
-            org_stores = db.query(Store).filter(
-                Store.organization_id == store.organization_id,
-                Store.is_active == True
-            ).all()
-            return [s.id for s in org_stores]
-    
-    return [user.store_id]
-
-def get_user_accessible_organizations(user: Union[SystemAdmin, Employee], db: Session) -> list:
-    """ユーザーがアクセス可能な組織IDリストを取得"""
-    if isinstance(user, SystemAdmin):
-        orgs = db.query(Organization).filter(Organization.is_active == True).all()
-        return [org.id for org in orgs]
+        # 所属店舗の組織IDをサブクエリで解決し、1クエリでIDのみ取得
+        org_id_subquery = db.query(Store.organization_id).filter(
+            Store.id == user.store_id
+        ).scalar_subquery()
+        rows = db.query(Store.id).filter(
+            Store.organization_id == org_id_subquery,
+            Store.is_active == True
+        ).all()
+        if rows:
+            return _set_cached_scope(key, frozenset(row[0] for row in rows))
+    
+    return _set_cached_scope(key, frozenset([user.store_id]))
+
+def get_user_accessible_organizations(user: Union[SystemAdmin, Employee], db: Session) -> frozenset:
+    """ユーザーがアクセス可能な組織ID集合を取得（IN句にそのまま渡せる）"""
+    key = _tenant_scope_key("organizations", user)
+    cached = _get_cached_scope(key)
+    if cached is not None:
+        return cached
     
-    store = db.query(Store).filter(Store.id == user.store_id).first()
-    return [store.organization_id] if store else []
+    if isinstance(user, SystemAdmin):
+        rows = db.query(Organization.id).filter(Organization.is_active == True).all()
+        return _set_cached_scope(key, frozenset(row[0] for row in rows))
+    
+    organization_id = db.query(Store.organization_id).filter(
+        Store.id == user.store_id
+    ).scalar()
+    return _set_cached_scope(
+        key, frozenset([organization_id]) if organization_id is not None else frozenset()
+    )
 
 # ====== セキュリティミドルウェア用関数 ======
 
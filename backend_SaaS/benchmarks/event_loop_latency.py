@@ -0,0 +1,226 @@
+# event_loop_latency.py - 伝票スキャン中の他リクエストのレイテンシ計測
+"""
+伝票スキャンを同時に送りながら、別のエンドポイント（/ping）の応答時間を計測する
+- 現行ルート（Base64 + JSON / multipart）と、イベントループ上で同じ処理を行う
+  async ルート（変更前の構成）を比較
+- サーバーは子プロセスの uvicorn（実際と同じく本文はチャンク単位で受信される）
+- 一時ディレクトリのSQLiteを使用（DATABASE_URL は上書きする）
+- OCRは LocalReplayOCRBackend（コーパスのテキストを --ocr-latency-ms かけて返す。外部APIは呼ばない）
+- 計測前に各ルートへ1件ずつ送り、前処理のプロセスプール起動などの初回コストを除く
+  （除かないと最初に計測するルートだけ p99 が 100ms 以上悪くなる）
+- /ping は別プロセスから5ms間隔で送り、予定時刻からの遅れを計測（--rounds 回分をまとめて集計）。
+  p99 が 10ms 未満であれば、スキャン中もイベントループは止まっていない
+  （サーバー・送信側・pingが同じCPUを取り合うため、コア数の少ない環境では値が大きくなる。
+  Base64 + JSON が multipart より遅いのは、JSON解析とBase64デコードの分のCPUを取り合うため）
+- --max-p99-ms を指定すると、現行ルートの p99 がそれを超えた場合に終了コード 1
+
+実行:
+    python -m benchmarks.event_loop_latency --scans 16 --size-mb 4
+    python -m benchmarks.event_loop_latency --scans 8 --size-mb 2 --max-p99-ms 50
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import asyncio
+import argparse
+import tempfile
+import statistics
+from types import SimpleNamespace
+
+_tmpdir = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmpdir.name}/bench.db"
+
+import httpx
+import uvicorn
+import multiprocessing
+from fastapi import FastAPI
+
+from database_saas import create_tables, get_db
+from auth_saas import get_current_employee
+from schemas_saas import ReceiptScanRequest
+from routes.receipt_scan import router, _submit_scan
+from services import receipt_scanner
+from services.receipt_scanner import ReceiptScanner
+from services.ocr_backends import LocalReplayOCRBackend
+from services.image_preprocessing import get_image_preprocess_executor
+from benchmarks.receipt_extraction import CORPUS_PATH
+
+
+PING_INTERVAL = 0.005
+ROUTES = [
+    ("Base64 + JSON", "/api/receipts/scan"),
+    ("multipart", "/api/receipts/scan/upload"),
+    ("変更前（ループ上）", "/blocking-scan"),
+]
+# 変更前の構成（比較用）は --max-p99-ms の判定に含めない
+CURRENT_ROUTES = {"/api/receipts/scan", "/api/receipts/scan/upload"}
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_current_employee] = lambda: SimpleNamespace(id=1, store_id=1, name="bench")
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    @app.post("/blocking-scan")
+    async def blocking_scan(request: ReceiptScanRequest):
+        # 変更前と同じく、同期処理をイベントループ上で直接実行
+        db = next(get_db())
+        try:
+            image_data = ReceiptScanner.decode_image(request.image_data)
+            return _submit_scan(db, SimpleNamespace(id=1, store_id=1, name="bench"),
+                                image_data, request.daily_report_id)
+        finally:
+            db.close()
+
+    return app
+
+
+def build_requests(path: str, scans: int, size_mb: float) -> list:
+    """送信するリクエスト（画像はすべて異なる内容にして結果キャッシュを効かせない）"""
+    images = [os.urandom(int(size_mb * 1024 * 1024)) for _ in range(scans)]
+    if path.endswith("/upload"):
+        return [{"files": {"file": ("receipt.jpg", image, "image/jpeg")}} for image in images]
+    # JSONは事前にエンコードし、クライアント側の処理がループを止めないようにする
+    return [
+        {
+            "content": json.dumps({"image_data": base64.b64encode(image).decode("ascii")}),
+            "headers": {"Content-Type": "application/json"},
+        }
+        for image in images
+    ]
+
+
+def serve(port: int, ocr_latency_ms: float):
+    """子プロセスで uvicorn を起動（クライアントの処理がサーバーのループに影響しないように）"""
+    create_tables()
+    receipt_scanner._scanner_instance = ReceiptScanner(
+        LocalReplayOCRBackend.from_jsonl(str(CORPUS_PATH), latency_ms=ocr_latency_ms)
+    )
+    get_image_preprocess_executor().submit(int).result()  # ワーカープロセスを起動しておく
+    uvicorn.run(build_app(), host="127.0.0.1", port=port, log_level="warning")
+    # 終了処理と競合しないよう、ワーカープロセスの終了まで待つ
+    get_image_preprocess_executor().shutdown(wait=True)
+
+
+def ping_loop(base_url: str, done, results):
+    """
+    別プロセスで /ping を送り続ける（スキャン送信側の処理の影響を受けないように）
+    予定時刻からの遅れで計測し、ループが止まっている間に送れなかった分も遅延として数える
+    """
+    latencies = []
+    with httpx.Client(base_url=base_url, timeout=60) as client:
+        scheduled = time.perf_counter()
+        while not done.is_set():
+            wait = scheduled - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            client.get("/ping")
+            latencies.append((time.perf_counter() - scheduled) * 1000)
+            scheduled += PING_INTERVAL
+    results.put(latencies)
+
+
+async def send_scans(base_url: str, path: str, requests: list) -> float:
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(client.post(path, **kwargs) for kwargs in requests))
+        assert all(r.status_code in (200, 202) for r in responses), responses[0].text
+        return time.perf_counter() - started
+
+
+def run_round(base_url: str, path: str, scans: int, size_mb: float) -> tuple:
+    """スキャン scans 件を同時に送り、その間の /ping の遅れを返す"""
+    requests = build_requests(path, scans, size_mb)
+    done = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    pinger = multiprocessing.Process(target=ping_loop, args=(base_url, done, results))
+    pinger.start()
+    time.sleep(0.2)
+    try:
+        elapsed = asyncio.run(send_scans(base_url, path, requests))
+    finally:
+        done.set()
+    latencies = results.get()
+    pinger.join()
+    return elapsed, latencies
+
+
+def run(base_url: str, path: str, scans: int, size_mb: float, rounds: int) -> dict:
+    # 初回コスト（依存関係の初期化など）を計測に含めない
+    asyncio.run(send_scans(base_url, path, build_requests(path, 1, size_mb)))
+    elapsed, latencies = 0.0, []
+    for _ in range(rounds):
+        round_elapsed, round_latencies = run_round(base_url, path, scans, size_mb)
+        elapsed += round_elapsed
+        latencies.extend(round_latencies)
+    latencies.sort()
+
+    return {
+        "scan_seconds": elapsed / rounds,
+        "pings": len(latencies),
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "max_ms": latencies[-1],
+    }
+
+
+def wait_until_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(base_url + "/ping", timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError("ベンチマーク用サーバーが起動しませんでした")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="スキャン中のイベントループ遅延の計測")
+    parser.add_argument("--scans", type=int, default=16, help="同時に送るスキャン数")
+    parser.add_argument("--size-mb", type=float, default=4.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rounds", type=int, default=3, help="ルートごとの計測回数")
+    parser.add_argument("--ocr-latency-ms", type=float, default=300)
+    parser.add_argument("--max-p99-ms", type=float, default=None,
+                        help="現行ルートの /ping p99 の上限（超えたら終了コード 1）")
+    args = parser.parse_args()
+
+    # daemon にすると前処理のプロセスプールを起動できない（終了は finally で行う）
+    server = multiprocessing.Process(target=serve, args=(args.port, args.ocr_latency_ms))
+    server.start()
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_until_ready(base_url)
+        results = {
+            path: run(base_url, path, args.scans, args.size_mb, args.rounds)
+            for _, path in ROUTES
+        }
+    finally:
+        server.terminate()
+        server.join()
+
+    print(f"スキャン {args.scans}件（{args.size_mb}MB）を同時送信中の /ping 応答時間（{args.rounds}回）")
+    print(f"{'ルート':<20}{'ping数':>8}{'p50(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}{'スキャン(秒)':>14}")
+    for name, path in ROUTES:
+        r = results[path]
+        print(f"{name:<20}{r['pings']:>8}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+              f"{r['max_ms']:>10.1f}{r['scan_seconds']:>14.2f}")
+
+    if args.max_p99_ms is not None:
+        failed = [path for path in CURRENT_ROUTES if results[path]["p99_ms"] > args.max_p99_ms]
+        if failed:
+            print(f"❌ /ping p99 が {args.max_p99_ms}ms を超えました: {', '.join(sorted(failed))}")
+            sys.exit(1)
+        print(f"✅ /ping p99 は {args.max_p99_ms}ms 以内")
+
+
+if __name__ == "__main__":
+    main()
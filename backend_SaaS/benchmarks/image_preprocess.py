@@ -0,0 +1,174 @@
+# image_preprocess.py - 伝票画像の前処理の計測
+"""
+変更前の前処理（フル解像度デコード + ImageEnhance 3回）と services/image_preprocessing.py を比較
+- CPU時間: 1枚あたりの process_time（同じプロセスで繰り返し実行した最速値）
+- ピークRSS: 1枚を処理する子プロセスの最大常駐メモリの増加分（本番のプールと同じ起動方式）
+- 画質: 変更前の出力との平均画素差（0〜255）
+- GIL: OCRワーカーと同じくスレッドから前処理を実行し、別スレッドの1ms周期の処理が
+  どれだけ待たされたか（前処理をスレッドで実行 / プロセスプールで実行）
+- 画像は白地に文字を描いた合成写真（スマートフォンの写真と同じ 4:3）
+
+実行:
+    python -m benchmarks.image_preprocess --sizes 4032x3024 8064x6048
+"""
+
+import time
+import argparse
+import threading
+import multiprocessing
+from io import BytesIO
+
+from PIL import Image, ImageChops, ImageDraw, ImageEnhance, ImageStat
+
+from services.image_preprocessing import (
+    preprocess_image, preprocess_image_bytes, get_image_preprocess_executor, IMAGE_PREPROCESS_START_METHOD,
+)
+
+
+def make_receipt_photo(width: int, height: int) -> bytes:
+    """伝票を撮影したような合成写真（JPEG）"""
+    base = Image.new("L", (width // 4, height // 4), 235)
+    draw = ImageDraw.Draw(base)
+    for row in range(8, base.size[1] - 16, 14):
+        draw.text((base.size[0] // 5, row), f"ITEM {row:04d}  x{row % 7 + 1}   {row * 37:,} YEN", fill=30)
+    noise = Image.effect_noise(base.size, 12)
+    base = ImageChops.multiply(base, ImageEnhance.Brightness(noise).enhance(1.9))
+    photo = base.resize((width, height), Image.Resampling.BICUBIC).convert("RGB")
+    output = BytesIO()
+    photo.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+def legacy_preprocess(image_data: bytes) -> bytes:
+    """変更前の ReceiptScanner.preprocess_image"""
+    image = Image.open(BytesIO(image_data))
+    if image.mode in ('RGBA', 'P'):
+        image = image.convert('RGB')
+    max_size = 2048
+    if max(image.size) > max_size:
+        ratio = max_size / max(image.size)
+        new_size = (int(image.size[0] * ratio), int(image.size[1] * ratio))
+        image = image.resize(new_size, Image.Resampling.LANCZOS)
+    image = ImageEnhance.Contrast(image).enhance(1.5)
+    image = ImageEnhance.Sharpness(image).enhance(1.2)
+    image = ImageEnhance.Brightness(image).enhance(1.1)
+    output = BytesIO()
+    image.save(output, format='JPEG', quality=85)
+    return output.getvalue()
+
+
+PIPELINES = {"変更前": legacy_preprocess, "変更後": preprocess_image_bytes}
+
+
+def cpu_ms(func, image_data: bytes, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.process_time()
+        func(image_data)
+        timings.append((time.process_time() - started) * 1000)
+    return min(timings)
+
+
+def _peak_rss_kb() -> int:
+    """
+    このプロセスの最大常駐メモリ（KB）
+    ru_maxrss は fork 元のプロセスの値を引き継ぐため、/proc の VmHWM を使う（Linuxのみ）
+    """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    raise RuntimeError("VmHWM を取得できません")
+
+
+def _peak_rss_child(name: str, image_data: bytes, results):
+    before = _peak_rss_kb()
+    PIPELINES[name](image_data)
+    results.put((_peak_rss_kb() - before) / 1024)
+
+
+def peak_rss_mb(name: str, image_data: bytes) -> float:
+    """新しいプロセスで1枚処理したときの最大常駐メモリの増加分（MB）"""
+    context = multiprocessing.get_context(IMAGE_PREPROCESS_START_METHOD)
+    results = context.Queue()
+    child = context.Process(target=_peak_rss_child, args=(name, image_data, results))
+    child.start()
+    value = results.get()
+    child.join()
+    return value
+
+
+def mean_pixel_diff(a: bytes, b: bytes) -> float:
+    image_a, image_b = Image.open(BytesIO(a)), Image.open(BytesIO(b))
+    if image_a.size != image_b.size:
+        image_b = image_b.resize(image_a.size, Image.Resampling.LANCZOS)
+    return sum(ImageStat.Stat(ImageChops.difference(image_a, image_b)).mean) / 3
+
+
+def gil_stall_ms(func, image_data: bytes, threads: int, per_thread: int) -> tuple:
+    """前処理中に別スレッドの1ms周期の処理が受けた遅れ（最大・合計ms）と全体の所要時間"""
+    done = threading.Event()
+    gaps = []
+
+    def ticker():
+        last = time.perf_counter()
+        while not done.is_set():
+            time.sleep(0.001)
+            now = time.perf_counter()
+            gaps.append(max(0.0, (now - last) * 1000 - 1))
+            last = now
+
+    def worker():
+        for _ in range(per_thread):
+            func(image_data)
+
+    tick = threading.Thread(target=ticker)
+    tick.start()
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    tick.join()
+    return max(gaps), sum(gaps), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="伝票画像の前処理の計測")
+    parser.add_argument("--sizes", nargs="+", default=["4032x3024", "8064x6048"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=4, help="GIL計測で同時に前処理するスレッド数")
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        width, height = (int(v) for v in size.split("x"))
+        image_data = make_receipt_photo(width, height)
+        outputs = {name: func(image_data) for name, func in PIPELINES.items()}
+        print(f"\n{size}（{len(image_data) / 1024 / 1024:.1f}MB）")
+        print(f"{'':<10}{'CPU(ms/枚)':>12}{'ピークRSS(MB)':>16}{'出力サイズ':>14}")
+        for name, func in PIPELINES.items():
+            out_size = Image.open(BytesIO(outputs[name])).size
+            print(f"{name:<10}{cpu_ms(func, image_data, args.repeat):>12.0f}"
+                  f"{peak_rss_mb(name, image_data):>16.0f}{f'{out_size[0]}x{out_size[1]}':>14}")
+        print(f"変更前との平均画素差: {mean_pixel_diff(outputs['変更前'], outputs['変更後']):.2f} / 255")
+
+        get_image_preprocess_executor().submit(int).result()  # ワーカープロセスを起動しておく
+        print(f"{args.threads}スレッドが各2枚を前処理する間の、別スレッドの遅れ")
+        print(f"{'':<24}{'最大(ms)':>10}{'合計(ms)':>10}{'所要(秒)':>10}")
+        for name, func in [
+            ("変更前（スレッド）", legacy_preprocess),
+            ("変更後（スレッド）", preprocess_image_bytes),
+            ("変更後（プロセスプール）", preprocess_image),
+        ]:
+            worst, total, elapsed = gil_stall_ms(func, image_data, args.threads, 2)
+            print(f"{name:<24}{worst:>10.1f}{total:>10.0f}{elapsed:>10.2f}")
+
+    # 終了処理と競合しないよう、ワーカープロセスの終了まで待つ
+    get_image_preprocess_executor().shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    main()
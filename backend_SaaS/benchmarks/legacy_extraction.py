@@ -0,0 +1,238 @@
+# legacy_extraction.py - 変更前の伝票データ抽出（比較用）
+"""
+ReceiptScanner.extract_data の抽出エンジン化（services/receipt_extraction.py）以前の実装
+ベンチマーク（benchmarks.receipt_extraction）で速度・精度を比較するために残している
+"""
+
+import re
+from datetime import date
+from typing import Optional, Dict, Any, Tuple
+
+
+class LegacyReceiptExtractor:
+    """項目ごとにパターンを順番に re.search する変更前の抽出処理"""
+
+    def __init__(self):
+        # 金額認識のパターン
+        self.amount_patterns = [
+            r'合計[:\s]*[¥￥]?\s*([0-9,]+)',
+            r'(?:お会計|会計|計|TOTAL|total)[:\s]*[¥￥]?\s*([0-9,]+)',
+            r'[¥￥]\s*([0-9,]+)\s*(?:円)?',
+            r'([0-9,]+)\s*円',
+            r'(?:売上|売り上げ)[:\s]*[¥￥]?\s*([0-9,]+)',
+        ]
+        
+        # 日付認識のパターン
+        self.date_patterns = [
+            r'(\d{4})[/\-年](\d{1,2})[/\-月](\d{1,2})',  # 2024/11/28, 2024年11月28日
+            r'(\d{1,2})[/\-月](\d{1,2})[日]?',  # 11/28, 11月28日
+            r'R?(\d{1,2})[/\.\-](\d{1,2})[/\.\-](\d{1,2})',  # R6.11.28
+        ]
+        
+        # 顧客名認識のパターン
+        self.customer_patterns = [
+            r'(?:お客様|顧客|名前|Name|name)[:\s]*([^\n\r]+)',
+            r'([^\n\r]+)\s*(?:様|さん|さま)',
+            r'(?:指名|担当|キャスト)[:\s]*([^\n\r]+)',
+        ]
+        
+        # ドリンク数認識のパターン
+        self.drink_patterns = [
+            r'(?:ドリンク|drink|drinks)[:\s]*(\d+)',
+            r'(\d+)\s*(?:杯|はい|ドリンク)',
+            r'(?:ドリンク|飲み物)[^\d]*(\d+)',
+        ]
+        
+        # シャンパン認識のパターン
+        self.champagne_patterns = [
+            r'(?:シャンパン|champagne|ボトル|bottle)[:\s]*([^\n\r¥￥0-9]+)',
+            r'(モエ|ドンペリ|ヴーヴクリコ|アルマンド|クリュッグ|ペリエ|ace)[^\n\r]*',
+        ]
+        
+        # 支払い方法認識のパターン
+        self.payment_patterns = [
+            r'(?:支払|決済|payment)[:\s]*(現金|カード|CASH|CARD|クレジット)',
+            r'(現金|カード|CASH|CARD|クレジット)',
+        ]
+
+    def extract_data(self, ocr_text: str) -> Dict[str, Any]:
+        """
+        OCRテキストから構造化データを抽出
+        """
+        extracted = {
+            'total_amount': None,
+            'customer_name': None,
+            'employee_name': None,
+            'date': None,
+            'drink_count': None,
+            'champagne_type': None,
+            'champagne_price': None,
+            'is_card': None,
+            'raw_text': ocr_text,
+            'extraction_details': {}
+        }
+        
+        # 金額抽出
+        extracted['total_amount'], details = self._extract_amount(ocr_text)
+        extracted['extraction_details']['amount'] = details
+        
+        # 日付抽出
+        extracted['date'], details = self._extract_date(ocr_text)
+        extracted['extraction_details']['date'] = details
+        
+        # 顧客名抽出
+        extracted['customer_name'], details = self._extract_customer_name(ocr_text)
+        extracted['extraction_details']['customer'] = details
+        
+        # ドリンク数抽出
+        extracted['drink_count'], details = self._extract_drink_count(ocr_text)
+        extracted['extraction_details']['drinks'] = details
+        
+        # シャンパン抽出
+        extracted['champagne_type'], details = self._extract_champagne(ocr_text)
+        extracted['extraction_details']['champagne'] = details
+        
+        # 支払い方法抽出
+        extracted['is_card'], details = self._extract_payment_method(ocr_text)
+        extracted['extraction_details']['payment'] = details
+        
+        return extracted
+    
+    def _extract_amount(self, text: str) -> Tuple[Optional[int], Dict]:
+        """金額を抽出"""
+        details = {'matched_pattern': None, 'raw_match': None}
+        
+        for pattern in self.amount_patterns:
+            match = re.search(pattern, text, re.IGNORECASE)
+            if match:
+                amount_str = match.group(1).replace(',', '')
+                try:
+                    amount = int(amount_str)
+                    details['matched_pattern'] = pattern
+                    details['raw_match'] = match.group(0)
+                    return amount, details
+                except ValueError:
+                    continue
+        
+        return None, details
+    
+    def _extract_date(self, text: str) -> Tuple[Optional[str], Dict]:
+        """日付を抽出"""
+        details = {'matched_pattern': None, 'raw_match': None}
+        today = date.today()
+        
+        for pattern in self.date_patterns:
+            match = re.search(pattern, text)
+            if match:
+                groups = match.groups()
+                details['matched_pattern'] = pattern
+                details['raw_match'] = match.group(0)
+                
+                try:
+                    if len(groups) == 3:
+                        year, month, day = int(groups[0]), int(groups[1]), int(groups[2])
+                        # 2桁年の場合は2000年代として処理
+                        if year < 100:
+                            year = 2000 + year
+                    else:
+                        # 年なしの場合は今年
+                        year = today.year
+                        month, day = int(groups[0]), int(groups[1])
+                    
+                    # 日付検証
+                    result_date = date(year, month, day)
+                    return result_date.isoformat(), details
+                    
+                except (ValueError, IndexError):
+                    continue
+        
+        # 見つからない場合は今日の日付
+        return today.isoformat(), details
+    
+    def _extract_customer_name(self, text: str) -> Tuple[Optional[str], Dict]:
+        """顧客名を抽出"""
+        details = {'matched_pattern': None, 'raw_match': None}
+        
+        for pattern in self.customer_patterns:
+            match = re.search(pattern, text)
+            if match:
+                name = match.group(1).strip()
+                # 短すぎる名前は除外
+                if len(name) >= 1 and len(name) <= 20:
+                    details['matched_pattern'] = pattern
+                    details['raw_match'] = match.group(0)
+                    # 「様」「さん」を正規化
+                    name = re.sub(r'(様|さん|さま)$', '', name).strip()
+                    if name:
+                        return name + '様', details
+        
+        return None, details
+    
+    def _extract_drink_count(self, text: str) -> Tuple[Optional[int], Dict]:
+        """ドリンク数を抽出"""
+        details = {'matched_pattern': None, 'raw_match': None}
+        
+        for pattern in self.drink_patterns:
+            match = re.search(pattern, text, re.IGNORECASE)
+            if match:
+                try:
+                    count = int(match.group(1))
+                    if 0 < count < 100:  # 妥当な範囲
+                        details['matched_pattern'] = pattern
+                        details['raw_match'] = match.group(0)
+                        return count, details
+                except ValueError:
+                    continue
+        
+        return None, details
+    
+    def _extract_champagne(self, text: str) -> Tuple[Optional[str], Dict]:
+        """シャンパン情報を抽出"""
+        details = {'matched_pattern': None, 'raw_match': None}
+        
+        # 有名シャンパンブランドのリスト
+        champagne_brands = [
+            'モエ', 'ドンペリ', 'ヴーヴクリコ', 'アルマンド', 'クリュッグ',
+            'ペリエジュエ', 'ベルエポック', 'ACE', 'エース', 'アンジェロ',
+            'ドンペリニヨン', 'モエ・エ・シャンドン', 'Dom Perignon',
+        ]
+        
+        text_lower = text.lower()
+        for brand in champagne_brands:
+            if brand.lower() in text_lower:
+                details['matched_pattern'] = f'ブランド検出: {brand}'
+                return brand, details
+        
+        # パターンマッチング
+        for pattern in self.champagne_patterns:
+            match = re.search(pattern, text, re.IGNORECASE)
+            if match:
+                champagne = match.group(1).strip() if match.lastindex else match.group(0).strip()
+                if len(champagne) <= 30:
+                    details['matched_pattern'] = pattern
+                    details['raw_match'] = match.group(0)
+                    return champagne, details
+        
+        return None, details
+    
+    def _extract_payment_method(self, text: str) -> Tuple[Optional[bool], Dict]:
+        """支払い方法を抽出（True=カード, False=現金）"""
+        details = {'matched_pattern': None, 'raw_match': None}
+        
+        text_lower = text.lower()
+        
+        # カード払いのキーワード
+        card_keywords = ['カード', 'card', 'クレジット', 'credit', 'visa', 'master']
+        for keyword in card_keywords:
+            if keyword in text_lower:
+                details['matched_pattern'] = f'キーワード検出: {keyword}'
+                return True, details
+        
+        # 現金払いのキーワード
+        cash_keywords = ['現金', 'cash', 'キャッシュ']
+        for keyword in cash_keywords:
+            if keyword in text_lower:
+                details['matched_pattern'] = f'キーワード検出: {keyword}'
+                return False, details
+        
+        return None, details
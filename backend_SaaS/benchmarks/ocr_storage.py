@@ -0,0 +1,210 @@
+# ocr_storage.py - OCR結果の保存サイズ・スキャン履歴の取得時間の計測
+"""
+receipt_images に OCR結果をテキストで持つ変更前の構成と、receipt_ocr_payloads に圧縮して
+分けた構成（services/ocr_payloads.py）を比較する
+- OCRレスポンスは benchmarks/data/receipt_ocr_corpus.jsonl のテキスト（実際の伝票に近い長さとして
+  明細行を加えたもの）から作った
+  Vision の AnnotateImageResponse（単語ごとの text_annotations と、文字ごとの座標を持つ
+  full_text_annotation。text_detection の応答と同じ構成）
+- 抽出データは抽出エンジンの結果（変更前は raw_text・raw_match を含むそのままの形、
+  変更後は compact_extracted_data で保存する形）
+- 保存サイズ: 1件あたりのバイト数（repr / シリアライズ / zlib）
+- 履歴の取得: 一時ディレクトリのSQLiteに --rows 件入れ、スキャン履歴と同じ
+  SELECT * ... ORDER BY created_at DESC LIMIT の所要時間（最速値）
+  変更前は「OCRテキストのみ」（現状の保存内容）と「repr も保存」（raw_response を残した場合）
+
+実行:
+    python -m benchmarks.ocr_storage --rows 5000
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+
+_tmpdir = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmpdir.name}/bench.db"
+
+from google.cloud import vision
+
+from benchmarks.receipt_extraction import ITEM_LINES, load_corpus
+from services.receipt_extraction import get_receipt_extractor
+from services.ocr_payloads import OCR_PAYLOAD_COMPRESSION_LEVEL, compact_extracted_data
+
+
+LEGACY_SCHEMA = """
+CREATE TABLE receipt_images (
+    id INTEGER PRIMARY KEY, store_id INTEGER, employee_id INTEGER, daily_report_id INTEGER,
+    receipt_id INTEGER, image_url VARCHAR(500), image_hash VARCHAR(64), file_size INTEGER,
+    mime_type VARCHAR(50), ocr_raw_response TEXT, ocr_extracted_data TEXT,
+    processing_status VARCHAR(10), error_message TEXT, is_verified BOOLEAN, confidence_score FLOAT,
+    uploaded_at DATETIME, processed_at DATETIME, created_at DATETIME, updated_at DATETIME
+);
+CREATE INDEX idx_store ON receipt_images(store_id, created_at);
+"""
+COMPACT_SCHEMA = LEGACY_SCHEMA.replace("ocr_raw_response TEXT, ", "") + """
+CREATE TABLE receipt_ocr_payloads (
+    receipt_image_id INTEGER PRIMARY KEY, encoding VARCHAR(10), ocr_text BLOB, raw_response BLOB,
+    created_at DATETIME
+);
+"""
+HISTORY_QUERY = "SELECT * FROM receipt_images WHERE store_id = 1 ORDER BY created_at DESC LIMIT ?"
+
+
+def _box(x: int, y: int, w: int, h: int) -> "vision.BoundingPoly":
+    return vision.BoundingPoly(vertices=[
+        vision.Vertex(x=x, y=y), vision.Vertex(x=x + w, y=y),
+        vision.Vertex(x=x + w, y=y + h), vision.Vertex(x=x, y=y + h),
+    ])
+
+
+def make_vision_response(text: str) -> "vision.AnnotateImageResponse":
+    """OCRテキストから text_detection と同じ構成のレスポンスを作る（座標は行・文字位置から）"""
+    annotations = [vision.EntityAnnotation(locale="ja", description=text, bounding_poly=_box(0, 0, 2000, 1500))]
+    paragraphs = []
+    for row, line in enumerate(line for line in text.splitlines() if line.strip()):
+        words = []
+        column = 0
+        for word in line.split():
+            annotations.append(vision.EntityAnnotation(
+                description=word, bounding_poly=_box(40 + column * 24, 40 + row * 48, len(word) * 24, 40)
+            ))
+            words.append(vision.Word(
+                bounding_box=_box(40 + column * 24, 40 + row * 48, len(word) * 24, 40),
+                confidence=0.97,
+                symbols=[
+                    vision.Symbol(text=char, confidence=0.97,
+                                  bounding_box=_box(40 + (column + i) * 24, 40 + row * 48, 24, 40))
+                    for i, char in enumerate(word)
+                ],
+            ))
+            column += len(word) + 1
+        paragraphs.append(vision.Paragraph(bounding_box=_box(40, 40 + row * 48, column * 24, 40),
+                                           confidence=0.97, words=words))
+    page = vision.Page(width=2016, height=1512, confidence=0.97,
+                       blocks=[vision.Block(bounding_box=_box(0, 0, 2016, 1512), paragraphs=paragraphs)])
+    return vision.AnnotateImageResponse(
+        text_annotations=annotations,
+        full_text_annotation=vision.TextAnnotation(text=text, pages=[page]),
+    )
+
+
+def fill(path: Path, schema: str, rows: int, samples: list, layout: str):
+    """rows 件のスキャン画像（処理済み）を作成"""
+    conn = sqlite3.connect(path)
+    conn.executescript(schema)
+    for i in range(rows):
+        text, raw, legacy_extracted, compact_extracted = samples[i % len(samples)]
+        extracted = compact_extracted if layout == "compact" else legacy_extracted
+        common = (i + 1, 1, 1, f"https://example.com/receipts/{i:016x}.jpg", f"{i:064x}", 2_500_000,
+                  "image/jpeg", extracted, "completed", 0.9,
+                  "2024-11-28 21:00:00", f"2024-11-28 21:{i // 60 % 60:02d}:{i % 60:02d}")
+        if layout == "compact":
+            conn.execute(
+                "INSERT INTO receipt_images (id, store_id, employee_id, image_url, image_hash, file_size,"
+                " mime_type, ocr_extracted_data, processing_status, confidence_score, uploaded_at, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", common)
+            conn.execute(
+                "INSERT INTO receipt_ocr_payloads VALUES (?, 'zlib', ?, ?, ?)",
+                (i + 1, zlib.compress(text.encode(), OCR_PAYLOAD_COMPRESSION_LEVEL),
+                 zlib.compress(vision.AnnotateImageResponse.serialize(raw), OCR_PAYLOAD_COMPRESSION_LEVEL),
+                 common[-1]))
+        else:
+            stored = text if layout == "text" else text + "\n" + str(raw)
+            conn.execute(
+                "INSERT INTO receipt_images (id, store_id, employee_id, image_url, image_hash, file_size,"
+                " mime_type, ocr_extracted_data, processing_status, confidence_score, uploaded_at, created_at,"
+                " ocr_raw_response) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", common + (stored,))
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+
+
+def time_query(path: Path, limit: int, repeat: int) -> float:
+    """履歴の取得（ms）"""
+    conn = sqlite3.connect(path)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(HISTORY_QUERY, (limit,)).fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    conn.close()
+    return min(timings)
+
+
+def table_mb(path: Path, table: str) -> float:
+    conn = sqlite3.connect(path)
+    try:
+        pages = conn.execute("SELECT sum(pgsize) FROM dbstat WHERE name = ?", (table,)).fetchone()[0]
+    except sqlite3.OperationalError:
+        pages = None  # dbstat が無いビルド
+    conn.close()
+    return pages / 1024 / 1024 if pages else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR結果の保存サイズ・スキャン履歴の取得時間")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    extractor = get_receipt_extractor()
+    samples = []
+    for sample in load_corpus():
+        text = sample["text"] + "\n" + ITEM_LINES
+        # 保存時と同じく is_test_mode を付ける
+        extracted = dict(extractor.extract(text), is_test_mode=False)
+        samples.append((
+            text, make_vision_response(text),
+            json.dumps(extracted, ensure_ascii=False),
+            json.dumps(compact_extracted_data(extracted), ensure_ascii=False),
+        ))
+
+    sizes = {
+        "OCRテキスト": [len(t.encode()) for t, _, _, _ in samples],
+        "OCRテキスト（zlib）": [
+            len(zlib.compress(t.encode(), OCR_PAYLOAD_COMPRESSION_LEVEL)) for t, _, _, _ in samples
+        ],
+        "抽出データ（変更前）": [len(e.encode()) for _, _, e, _ in samples],
+        "抽出データ（変更後）": [len(e.encode()) for _, _, _, e in samples],
+        "レスポンス repr": [len(str(r).encode()) for _, r, _, _ in samples],
+        "レスポンス シリアライズ": [len(vision.AnnotateImageResponse.serialize(r)) for _, r, _, _ in samples],
+        "レスポンス シリアライズ（zlib）": [
+            len(zlib.compress(vision.AnnotateImageResponse.serialize(r), OCR_PAYLOAD_COMPRESSION_LEVEL))
+            for _, r, _, _ in samples
+        ],
+    }
+    print(f"1件あたりのサイズ（コーパス {len(samples)}件の平均）")
+    for name, values in sizes.items():
+        print(f"  {name:<28}{statistics.mean(values):>10,.0f} B")
+
+    started = time.perf_counter()
+    blob = zlib.compress(samples[0][0].encode(), OCR_PAYLOAD_COMPRESSION_LEVEL)
+    for _ in range(1000):
+        zlib.decompress(blob).decode()
+    print(f"  OCRテキストの展開: {(time.perf_counter() - started) * 1000:.1f} µs/件")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        layouts = {
+            "変更前（OCRテキスト）": ("text", LEGACY_SCHEMA),
+            "変更前（repr も保存）": ("repr", LEGACY_SCHEMA),
+            "変更後": ("compact", COMPACT_SCHEMA),
+        }
+        print(f"\nスキャン画像 {args.rows}件")
+        print(f"{'':<24}{'receipt_images(MB)':>20}{'LIMIT 20(ms)':>14}{'全件(ms)':>12}")
+        for name, (layout, schema) in layouts.items():
+            path = Path(tmpdir) / f"{layout}.db"
+            fill(path, schema, args.rows, samples, layout)
+            print(f"{name:<24}{table_mb(path, 'receipt_images'):>20.2f}"
+                  f"{time_query(path, 20, args.repeat):>14.3f}{time_query(path, args.rows, args.repeat):>12.1f}")
+            if layout == "compact":
+                print(f"{'（receipt_ocr_payloads）':<24}{table_mb(path, 'receipt_ocr_payloads'):>20.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# receipt_extraction.py - 伝票データ抽出の速度・精度比較
+"""
+変更前の抽出処理（benchmarks/legacy_extraction.py）と抽出エンジン（services/receipt_extraction.py）を比較
+- 精度: benchmarks/data/receipt_ocr_corpus.jsonl（OCRテキストと正解の組）で項目ごとの正解率
+  正解に含まれる項目のみ採点（null は「抽出しない」のが正解）。日付の "*-MM-DD" は今年
+- 速度: コーパス全件を繰り返し抽出した1件あたりの時間（timeit と同じく最速値）
+  実際のOCR結果に近い長さとして、明細行を加えたテキストでも計測
+
+実行:
+    python -m benchmarks.receipt_extraction --verbose
+"""
+
+import json
+import time
+import argparse
+import statistics
+from datetime import date
+from pathlib import Path
+
+from benchmarks.legacy_extraction import LegacyReceiptExtractor
+from services.receipt_extraction import ReceiptExtractor
+
+
+CORPUS_PATH = Path(__file__).parent / "data" / "receipt_ocr_corpus.jsonl"
+# 速度計測用に加える明細行
+ITEM_LINES = "\n".join(
+    f"{name}  {qty}  ¥{price:,}" for name, qty, price in [
+        ("セット料金", 1, 5000), ("延長30分", 2, 3000), ("ハウスボトル", 1, 8000),
+        ("ウーロン茶", 3, 500), ("ビール", 4, 800), ("ハイボール", 2, 900),
+        ("チャージ", 1, 1000), ("フルーツ盛り合わせ", 1, 4000), ("乾き物", 1, 1500),
+        ("カラオケ", 1, 0), ("サービス料", 1, 2000), ("消費税", 1, 1800),
+    ]
+)
+FIELDS = [
+    "total_amount", "date", "customer_name", "employee_name",
+    "drink_count", "champagne_type", "champagne_price", "is_card",
+]
+
+
+def load_corpus() -> list:
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def expected_value(field: str, value):
+    if field == "date" and isinstance(value, str) and value.startswith("*-"):
+        return f"{date.today().year}{value[1:]}"
+    return value
+
+
+def score(extract, corpus: list) -> dict:
+    """項目ごとの (正解数, 採点数, 不正解の一覧)"""
+    results = {field: [0, 0, []] for field in FIELDS}
+    for sample in corpus:
+        extracted = extract(sample["text"])
+        for field, value in sample["expected"].items():
+            expected = expected_value(field, value)
+            result = results[field]
+            result[1] += 1
+            if extracted.get(field) == expected:
+                result[0] += 1
+            else:
+                result[2].append((sample["id"], expected, extracted.get(field)))
+    return results
+
+
+def time_per_call(extractors: list, texts: list, repeat: int) -> list:
+    """
+    1件あたりの時間（µs）。コーパス全件を repeat 回抽出した最速値
+    実行環境の揺らぎが片方だけに偏らないよう、抽出処理を交互に計測する
+    """
+    timings = [[] for _ in extractors]
+    for _ in range(repeat):
+        for extract, results in zip(extractors, timings):
+            started = time.perf_counter()
+            for text in texts:
+                extract(text)
+            results.append((time.perf_counter() - started) / len(texts) * 1e6)
+    return [min(results) for results in timings]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="伝票データ抽出の速度・精度比較")
+    parser.add_argument("--repeat", type=int, default=200, help="速度計測の繰り返し回数")
+    parser.add_argument("--verbose", action="store_true", help="不正解の内容を表示")
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    texts = [sample["text"] for sample in corpus]
+    extractors = {
+        "変更前": LegacyReceiptExtractor().extract_data,
+        "抽出エンジン": ReceiptExtractor().extract,
+    }
+
+    long_texts = [text + "\n" + ITEM_LINES for text in texts]
+    print(f"コーパス: {len(corpus)}件")
+    print(f"{'µs/件':<24}" + "".join(f"{name:>16}" for name in extractors))
+    for label, inputs in [("コーパス", texts), ("明細行付き", long_texts)]:
+        label = f"{label}（平均{statistics.mean(len(t) for t in inputs):.0f}文字）"
+        timings = time_per_call(list(extractors.values()), inputs, args.repeat)
+        print(f"{label:<24}" + "".join(f"{t:>16.1f}" for t in timings))
+
+    scores = {name: score(extract, corpus) for name, extract in extractors.items()}
+    print()
+    print(f"{'項目':<18}" + "".join(f"{name:>16}" for name in extractors))
+    totals = {name: [0, 0] for name in extractors}
+    for field in FIELDS:
+        cells = []
+        for name in extractors:
+            correct, scored, _ = scores[name][field]
+            totals[name][0] += correct
+            totals[name][1] += scored
+            cells.append(f"{correct}/{scored} ({correct / scored:.0%})" if scored else "-")
+        print(f"{field:<18}" + "".join(f"{cell:>16}" for cell in cells))
+    print(f"{'合計':<18}" + "".join(
+        f"{f'{c}/{s} ({c / s:.0%})':>16}" for c, s in totals.values()
+    ))
+
+    if args.verbose:
+        for name in extractors:
+            print(f"\n[{name}] 不正解")
+            for field in FIELDS:
+                for sample_id, expected, actual in scores[name][field][2]:
+                    print(f"  {sample_id:<28}{field:<16}正解={expected!r} 抽出={actual!r}")
+
+
+if __name__ == "__main__":
+    main()
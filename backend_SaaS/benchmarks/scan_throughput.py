@@ -0,0 +1,170 @@
+# scan_throughput.py - 伝票スキャンのスループット計測
+"""
+OCRジョブのワーカープール（services/ocr_jobs.py）からスキャン全体を実行し、
+同時実行数ごとの処理件数/秒と各段階の所要時間を計測する
+- OCRは LocalReplayOCRBackend（benchmarks/data/receipt_ocr_corpus.jsonl のテキストを再生）。
+  Vision API の応答時間は --ocr-latency-ms ± --ocr-jitter-ms で再現
+- 前処理はプロセスプール、アップロードはテストモード（Cloudinary未設定）
+- 一時ディレクトリのSQLiteを使用（DATABASE_URL は上書きする）
+- 段階: 前処理 / アップロード / OCR / 抽出 / ジョブ全体（キュー待ち〜DB更新まで）
+
+実行:
+    python -m benchmarks.scan_throughput --scans 32 --concurrency 1 4 8
+"""
+
+import os
+import time
+import argparse
+import tempfile
+import threading
+import statistics
+from collections import defaultdict
+
+_tmpdir = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmpdir.name}/bench.db"
+
+from database_saas import SessionLocal, create_tables, ReceiptImage, ProcessingStatus
+from services import receipt_scanner
+from services.ocr_backends import LocalReplayOCRBackend
+from services.ocr_jobs import OcrJobPool, process_ocr_job
+from services.image_preprocessing import get_image_preprocess_executor
+from benchmarks.image_preprocess import make_receipt_photo
+from benchmarks.receipt_extraction import CORPUS_PATH
+
+
+STAGES = ["前処理", "アップロード", "OCR", "抽出", "ジョブ全体"]
+
+
+class TimedReceiptScanner(receipt_scanner.ReceiptScanner):
+    """各段階の所要時間を記録するスキャナー"""
+
+    def __init__(self, ocr_backend):
+        super().__init__(ocr_backend)
+        self.timings = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, started: float):
+        with self._lock:
+            self.timings[stage].append((time.perf_counter() - started) * 1000)
+
+    def _timed(self, stage: str, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.record(stage, started)
+
+    def preprocess_image(self, image_data):
+        return self._timed("前処理", super().preprocess_image, image_data)
+
+    def upload_image(self, image_data, filename=None):
+        return self._timed("アップロード", super().upload_image, image_data, filename)
+
+    def perform_ocr(self, image_data):
+        return self._timed("OCR", super().perform_ocr, image_data)
+
+    def extract_data(self, ocr_text):
+        return self._timed("抽出", super().extract_data, ocr_text)
+
+
+def create_pending_scans(count: int) -> list:
+    """PENDING のスキャン画像を作成（受付時と同じ状態）"""
+    db = SessionLocal()
+    try:
+        rows = [
+            ReceiptImage(store_id=1, employee_id=1, image_url="", processing_status=ProcessingStatus.PENDING)
+            for _ in range(count)
+        ]
+        db.add_all(rows)
+        db.commit()
+        return [row.id for row in rows]
+    finally:
+        db.close()
+
+
+def count_completed(ids: list) -> int:
+    db = SessionLocal()
+    try:
+        return db.query(ReceiptImage).filter(
+            ReceiptImage.id.in_(ids),
+            ReceiptImage.processing_status == ProcessingStatus.COMPLETED
+        ).count()
+    finally:
+        db.close()
+
+
+def run(scanner: TimedReceiptScanner, photos: list, scans: int, concurrency: int) -> dict:
+    ids = create_pending_scans(scans)
+    scanner.timings.clear()
+    pool = OcrJobPool(worker_count=concurrency, max_queue_size=scans)
+    pool.start()
+    remaining = [scans]
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def job(receipt_image_id, image_data, submitted):
+        try:
+            return process_ocr_job(receipt_image_id, image_data)
+        finally:
+            scanner.record("ジョブ全体", submitted)
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    done.set()
+
+    started = time.perf_counter()
+    for i, receipt_image_id in enumerate(ids):
+        pool.submit(job, receipt_image_id, photos[i % len(photos)], time.perf_counter())
+    done.wait()
+    elapsed = time.perf_counter() - started
+    pool.stop()
+
+    return {
+        "scans_per_sec": scans / elapsed,
+        "completed": count_completed(ids),
+        "timings": {stage: list(values) for stage, values in scanner.timings.items()},
+    }
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="伝票スキャンのスループット計測")
+    parser.add_argument("--scans", type=int, default=32, help="同時実行数ごとのスキャン件数")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="OCRワーカー数")
+    parser.add_argument("--size", default="4032x3024", help="写真のサイズ")
+    parser.add_argument("--photos", type=int, default=4, help="使い回す写真の枚数")
+    parser.add_argument("--ocr-latency-ms", type=float, default=300)
+    parser.add_argument("--ocr-jitter-ms", type=float, default=100)
+    args = parser.parse_args()
+
+    create_tables()
+    width, height = (int(v) for v in args.size.split("x"))
+    photos = [make_receipt_photo(width + i * 8, height) for i in range(args.photos)]
+    backend = LocalReplayOCRBackend.from_jsonl(
+        str(CORPUS_PATH), latency_ms=args.ocr_latency_ms, jitter_ms=args.ocr_jitter_ms
+    )
+    scanner = TimedReceiptScanner(backend)
+    receipt_scanner._scanner_instance = scanner
+    get_image_preprocess_executor().submit(int).result()  # ワーカープロセスを起動しておく
+
+    print(f"\nスキャン {args.scans}件（{args.size}、OCR {args.ocr_latency_ms:.0f}±{args.ocr_jitter_ms:.0f}ms）")
+    print(f"{'同時実行':>8}{'件/秒':>8}{'完了':>6}  " + "".join(f"{s + ' p50/p95(ms)':>24}" for s in STAGES))
+    for concurrency in args.concurrency:
+        result = run(scanner, photos, args.scans, concurrency)
+        cells = []
+        for stage in STAGES:
+            values = result["timings"].get(stage, [])
+            cells.append(f"{statistics.median(values):.0f} / {percentile(values, 0.95):.0f}" if values else "-")
+        print(f"{concurrency:>8}{result['scans_per_sec']:>10.2f}{result['completed']:>6}  "
+              + "".join(f"{cell:>24}" for cell in cells))
+
+    # 終了処理と競合しないよう、ワーカープロセスの終了まで待つ
+    get_image_preprocess_executor().shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# scan_upload.py - 伝票スキャンの受信経路ベンチマーク
+"""
+Base64 + JSON（POST /api/receipts/scan）と multipart（POST /api/receipts/scan/upload）で、
+スマートフォン写真相当の画像を受け取る際のレイテンシ・ピークメモリ・送信量を比較する
+- 実際の ReceiptScanRequest / decode_image / read_image_upload を使った最小アプリで計測
+  （DB登録・OCRジョブ投入は両経路で共通のため含めない）
+- ピークメモリは tracemalloc で計測（リクエスト送信からレスポンスまで・クライアント側を含む）
+
+実行:
+    python -m benchmarks.scan_upload --size-mb 8 --runs 10
+"""
+
+import os
+import json
+import time
+import base64
+import argparse
+import tracemalloc
+import statistics
+
+from fastapi import FastAPI, UploadFile, File
+from fastapi.testclient import TestClient
+
+from schemas_saas import ReceiptScanRequest
+from services.receipt_scanner import ReceiptScanner
+from routes.receipt_scan import read_image_upload
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/base64")
+    async def scan_base64(request: ReceiptScanRequest):
+        image_data = ReceiptScanner.decode_image(request.image_data)
+        return {"size": len(image_data)}
+
+    @app.post("/upload")
+    async def scan_upload(file: UploadFile = File(...)):
+        image_data = await read_image_upload(file)
+        return {"size": len(image_data)}
+
+    return app
+
+
+def make_photo(size_mb: float) -> bytes:
+    """JPEGヘッダー付きのランダムデータ（圧縮済み写真と同様に圧縮が効かない）"""
+    return b"\xff\xd8\xff\xe0" + os.urandom(int(size_mb * 1024 * 1024) - 4)
+
+
+def measure(send, runs: int) -> dict:
+    """レイテンシとピークメモリは別々に計測（tracemalloc は計測対象を大きく遅くするため）"""
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        response = send()
+        latencies.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.text
+
+    tracemalloc.start()
+    send()
+    peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    tracemalloc.stop()
+    return {
+        "p50_ms": statistics.median(latencies),
+        "max_ms": max(latencies),
+        "peak_mb": peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="伝票スキャン受信経路のベンチマーク")
+    parser.add_argument("--size-mb", type=float, default=8.0)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    client = TestClient(build_app())
+    photo = make_photo(args.size_mb)
+    json_body = json.dumps({
+        "image_data": "data:image/jpeg;base64," + base64.b64encode(photo).decode("ascii")
+    })
+
+    results = {
+        "base64 + JSON": (len(json_body), measure(lambda: client.post(
+            "/base64", content=json_body, headers={"Content-Type": "application/json"}
+        ), args.runs)),
+        "multipart": (len(photo), measure(lambda: client.post(
+            "/upload", files={"file": ("receipt.jpg", photo, "image/jpeg")}
+        ), args.runs)),
+    }
+
+    print(f"画像サイズ {args.size_mb}MB × {args.runs}回")
+    print(f"{'経路':<16}{'送信量(MB)':>12}{'p50(ms)':>10}{'max(ms)':>10}{'ピーク(MB)':>12}")
+    for name, (wire_bytes, r) in results.items():
+        print(f"{name:<16}{wire_bytes / (1024 * 1024):>12.1f}{r['p50_ms']:>10.1f}"
+              f"{r['max_ms']:>10.1f}{r['peak_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
 # database_saas.py - PostgreSQL + bcrypt修正版
 from sqlalchemy import (
     create_engine, Column, Integer, String, Date, DateTime, Boolean,
-    ForeignKey, Text, Enum, Float, text
+    ForeignKey, Text, Enum, Float, text, UniqueConstraint, Index, JSON, LargeBinary,
+    inspect, insert, literal_column
 )
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 from datetime import datetime
 import secrets
@@ -10,6 +13,7 @@ import string
 import enum
 import os
 from sqlalchemy.pool import QueuePool
+from contextlib import contextmanager
 import time
 
 # ==============================
@@ -251,6 +255,23 @@ class Subscription(Base):
     organization = relationship("Organization", back_populates="subscriptions")
 
 
+class OrganizationUsage(Base):
+    """組織利用状況カウンターテーブル（プラン上限チェック用）"""
+    __tablename__ = "organization_usage"
+    organization_id = Column(Integer, ForeignKey("organizations.id"), primary_key=True)
+    active_store_count = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class StoreUsage(Base):
+    """店舗利用状況カウンターテーブル（プラン上限チェック用）"""
+    __tablename__ = "store_usage"
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    organization_id = Column(Integer, ForeignKey("organizations.id"), nullable=False, index=True)
+    active_employee_count = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 class InviteCode(Base):
     """招待コードテーブル"""
     __tablename__ = "invite_codes"
@@ -326,6 +347,10 @@ class ProcessingStatus(enum.Enum):
 class ReceiptImage(Base):
     """伝票画像テーブル（OCR用）"""
     __tablename__ = "receipt_images"
+    __table_args__ = (
+        # 同じ画像の再スキャン判定（OCR結果キャッシュ）に使用
+        Index("idx_receipt_images_store_hash", "store_id", "image_hash"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     store_id = Column(Integer, ForeignKey("stores.id"), nullable=False)
     employee_id = Column(Integer, ForeignKey("employees.id"), nullable=False)
@@ -334,13 +359,14 @@ class ReceiptImage(Base):
     
     # 画像情報
     image_url = Column(String(500), nullable=False)
-    image_hash = Column(String(64))  # SHA-256ハッシュ（重複検出用）
+    image_hash = Column(String(64))  # 元画像（前処理前）のSHA-256ハッシュ（重複検出用）
     file_size = Column(Integer)
     mime_type = Column(String(50))
     
-    # OCR結果
-    ocr_raw_response = Column(Text)  # JSONテキスト
-    ocr_extracted_data = Column(Text)  # JSON形式の抽出データ
+    # OCR結果（OCRテキスト・レスポンスは圧縮して receipt_ocr_payloads に保存）
+    ocr_extracted_data = Column(
+        JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), "postgresql")
+    )  # 抽出データ
     
     # 処理状態
     processing_status = Column(Enum(ProcessingStatus), default=ProcessingStatus.PENDING)
@@ -353,6 +379,21 @@ class ReceiptImage(Base):
     processed_at = Column(DateTime)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # 一覧の取得では読み込まない（結果の表示時のみ）
+    ocr_payload = relationship("ReceiptOcrPayload", uselist=False, cascade="all, delete-orphan")
+
+
+class ReceiptOcrPayload(Base):
+    """伝票画像のOCR結果テーブル（圧縮して保存。receipt_images の行を小さく保つ）"""
+    __tablename__ = "receipt_ocr_payloads"
+    receipt_image_id = Column(Integer, ForeignKey("receipt_images.id", ondelete="CASCADE"), primary_key=True)
+    # 圧縮方式（"zlib" / 移行した既存データは "none"）
+    encoding = Column(String(10), nullable=False)
+    ocr_text = Column(LargeBinary)
+    # OCRバックエンドのレスポンス（Vision は AnnotateImageResponse のシリアライズ）
+    raw_response = Column(LargeBinary)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
 
 class Receipt(Base):
@@ -385,6 +426,10 @@ class Receipt(Base):
 class PersonalGoal(Base):
     """個人目標テーブル"""
     __tablename__ = "personal_goals"
+    __table_args__ = (
+        # 同じ年月の目標は1件のみ（upsert の衝突判定に使用）
+        UniqueConstraint("employee_id", "year", "month", name="uq_personal_goals_employee_month"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     employee_id = Column(Integer, ForeignKey("employees.id"), nullable=False)
     
@@ -406,6 +451,9 @@ class PersonalGoal(Base):
 class StoreGoal(Base):
     """店舗目標テーブル"""
     __tablename__ = "store_goals"
+    __table_args__ = (
+        UniqueConstraint("store_id", "year", "month", name="uq_store_goals_store_month"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     store_id = Column(Integer, ForeignKey("stores.id"), nullable=False)
     
@@ -420,6 +468,52 @@ class StoreGoal(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+class EmployeeGoalProgress(Base):
+    """個人目標進捗スナップショットテーブル（日報書き込み時に差分更新）"""
+    __tablename__ = "employee_goal_progress"
+    employee_id = Column(Integer, ForeignKey("employees.id"), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False, index=True)
+    
+    # 目標値（PersonalGoalの写し）
+    sales_goal = Column(Integer, default=500000)
+    drinks_goal = Column(Integer, default=100)
+    catch_goal = Column(Integer, default=50)
+    
+    # 実績
+    total_sales = Column(Integer, default=0, nullable=False)
+    total_drinks = Column(Integer, default=0, nullable=False)
+    total_catch = Column(Integer, default=0, nullable=False)
+    total_customers = Column(Integer, default=0, nullable=False)
+    total_champagne = Column(Integer, default=0, nullable=False)
+    work_days = Column(Integer, default=0, nullable=False)
+    
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class StoreGoalProgress(Base):
+    """店舗目標進捗スナップショットテーブル（日報書き込み時に差分更新）"""
+    __tablename__ = "store_goal_progress"
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    
+    # 目標値（StoreGoalの写し）
+    monthly_sales_goal = Column(Integer, default=3000000)
+    weekday_sales_goal = Column(Integer, default=100000)
+    weekend_sales_goal = Column(Integer, default=200000)
+    
+    # 実績
+    total_sales = Column(Integer, default=0, nullable=False)
+    weekday_sales = Column(Integer, default=0, nullable=False)
+    weekend_sales = Column(Integer, default=0, nullable=False)
+    weekday_days = Column(Integer, default=0, nullable=False)  # 日報のある平日の日数
+    weekend_days = Column(Integer, default=0, nullable=False)  # 日報のある週末の日数
+    
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 class ShiftStatus(enum.Enum):
     SCHEDULED = "scheduled"
     CONFIRMED = "confirmed"
@@ -504,6 +598,31 @@ class Notification(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class NotificationCounter(Base):
+    """未読通知カウンターテーブル（通知の未読数を従業員ごとに非正規化して保持）"""
+    __tablename__ = "notification_counters"
+    employee_id = Column(Integer, ForeignKey("employees.id"), primary_key=True)
+    unread_count = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class IdempotencyKey(Base):
+    """冪等キーテーブル（Idempotency-Key ヘッダー付きリクエストの保存済みレスポンス）"""
+    __tablename__ = "idempotency_keys"
+    # SHA-256(認証情報 + キー) の16進文字列
+    key_hash = Column(String(64), primary_key=True)
+    # SHA-256(メソッド + パス + リクエストボディ)。同じキーで異なるリクエストを検出する
+    request_hash = Column(String(64), nullable=False)
+    
+    # レスポンス（処理中は status_code が NULL）
+    status_code = Column(Integer)
+    content_type = Column(String(100))
+    response_body = Column(Text)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
 class AuditLog(Base):
     """監査ログテーブル"""
     __tablename__ = "audit_logs"
@@ -536,6 +655,118 @@ def get_db():
         db.close()
 
 
+@contextmanager
+def unit_of_work(db):
+    """
+    書き込み処理（本体＋通知・監査ログなどの付随レコード）を1トランザクションにまとめる
+    - ブロック内では flush のみ行い、正常終了時に1回だけコミット
+    - 例外時はロールバック（途中まで反映された状態を残さない）
+    - after_commit で登録した処理はコミット成功後に実行
+    - ネストした場合は外側のトランザクションに合流
+    """
+    if db.info.get("unit_of_work"):
+        yield db
+        return
+    
+    db.info["unit_of_work"] = True
+    db.info["after_commit"] = []
+    try:
+        yield db
+        db.commit()
+        callbacks = db.info["after_commit"]
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.info.pop("unit_of_work", None)
+        db.info.pop("after_commit", None)
+    
+    for callback in callbacks:
+        callback()
+
+
+def in_unit_of_work(db) -> bool:
+    """unit_of_work のブロック内かどうか"""
+    return bool(db.info.get("unit_of_work"))
+
+
+def after_commit(db, callback):
+    """コミット成功後に実行する処理を登録（unit_of_work 外では即時実行）"""
+    if in_unit_of_work(db):
+        db.info["after_commit"].append(callback)
+    else:
+        callback()
+
+
+def upsert_row(db, model, values: dict, conflict_columns: list, update_columns: list):
+    """
+    INSERT ... ON CONFLICT DO UPDATE で1行を保存し、保存後の行と新規作成かどうかを返す
+    - PostgreSQL はネイティブの upsert（新規作成かは RETURNING (xmax = 0) で判定。1往復）
+    - SQLite はネイティブの upsert（新規作成かは事前の存在確認で判定）
+    - それ以外のDBは SELECT してから INSERT / UPDATE
+    Returns: (row, inserted)
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(model).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=conflict_columns,
+            set_={column: stmt.excluded[column] for column in update_columns}
+        ).returning(model, literal_column("xmax = 0").label("inserted"))
+        row, inserted = db.execute(stmt, execution_options={"populate_existing": True}).one()
+        return row, bool(inserted)
+    
+    query = db.query(model)
+    for column in conflict_columns:
+        query = query.filter(getattr(model, column) == values[column])
+    
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        # SQLite は書き込みが直列化されるため、事前の存在確認と upsert の間に行は増えない
+        inserted = not db.query(query.exists()).scalar()
+        stmt = dialect_insert(model).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=conflict_columns,
+            set_={column: stmt.excluded[column] for column in update_columns}
+        ).returning(model)
+        return db.scalars(stmt, execution_options={"populate_existing": True}).one(), inserted
+    
+    row = query.first()
+    inserted = row is None
+    if inserted:
+        row = model(**values)
+        db.add(row)
+    else:
+        for column in update_columns:
+            setattr(row, column, values[column])
+    db.flush()
+    return row, inserted
+
+
+def insert_missing_rows(db, model, columns: list, select_stmt) -> int:
+    """
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING（同時に作成された行はそのまま残す）
+    - PostgreSQL・SQLite はネイティブの ON CONFLICT DO NOTHING
+    - それ以外のDBは SAVEPOINT 内で INSERT し、一意制約違反なら何もしない
+    Returns: 作成した行数
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(model).from_select(columns, select_stmt).on_conflict_do_nothing()
+        return db.execute(stmt).rowcount
+    
+    try:
+        with db.begin_nested():
+            return db.execute(insert(model).from_select(columns, select_stmt)).rowcount
+    except IntegrityError:
+        return 0
+
+
 def generate_store_code(prefix="BAR"):
     """店舗コード生成"""
     random_chars = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(8))
@@ -557,9 +788,38 @@ def create_tables():
     """全テーブル作成"""
     print("データベーステーブルを作成中...")
     Base.metadata.create_all(bind=engine)
+    if engine.dialect.name == "sqlite":
+        _add_sqlite_unique_constraints()
     print("✅ データベーステーブル作成完了")
 
 
+def _add_sqlite_unique_constraints():
+    """
+    既存の SQLite DB に、後から追加した一意制約を一意インデックスとして作成
+    （create_all は既存テーブルに制約を追加しないため、upsert_row の ON CONFLICT が失敗する。
+      PostgreSQL は migrations/ のSQLで追加する）
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.tables.values():
+        existing = [set(u["column_names"]) for u in inspector.get_unique_constraints(table.name)]
+        existing += [set(i["column_names"]) for i in inspector.get_indexes(table.name) if i.get("unique")]
+        for constraint in table.constraints:
+            if not isinstance(constraint, UniqueConstraint) or not constraint.name:
+                continue
+            columns = [c.name for c in constraint.columns]
+            if set(columns) in existing:
+                continue
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(
+                        f"CREATE UNIQUE INDEX IF NOT EXISTS {constraint.name} "
+                        f"ON {table.name} ({', '.join(columns)})"
+                    ))
+                print(f"✅ 一意制約を追加: {table.name}({', '.join(columns)})")
+            except Exception as e:
+                print(f"⚠️ 重複行があるため一意制約を追加できません（{table.name}）。重複を削除してください: {e}")
+
+
 def create_super_admin(email: str, password: str, name: str = "Super Admin"):
     """スーパーアドミン作成（bcryptバグ修正版）"""
     db = SessionLocal()
@@ -1,21 +1,22 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Request, Form
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Form, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, extract
+from sqlalchemy import func, extract, insert, update
+from sqlalchemy.exc import IntegrityError
+from pydantic import ValidationError
 from typing import List, Optional
 from datetime import timedelta, datetime, date
 from contextlib import asynccontextmanager
 import uvicorn
 import os
 
-# Google OAuth認証用インポート
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
+# Google OAuth認証用インポート（証明書キャッシュ付き検証）
+from services.google_token_verifier import get_google_token_verifier
 
 # SaaS対応インポート
 from database_saas import (
-    get_db, create_tables, SystemAdmin, Organization, Store, Employee, 
+    get_db, unit_of_work, upsert_row, create_tables, SystemAdmin, Organization, Store, Employee, 
     Subscription, InviteCode, DailyReport, Receipt, AuditLog,
     PersonalGoal, StoreGoal, Shift, ShiftRequest, Notification,
     ShiftStatus, ShiftRequestType, NotificationType,
@@ -43,6 +44,10 @@ from schemas_saas import (
     
     # 日報関連
     DailyReportCreate, DailyReportResponse, DailyReportUpdate, DailyReportApproval,
+    DailyReportBulkApproval,
+    
+    # 伝票関連
+    ReceiptCreate, ReceiptUpdate, ReceiptResponse, BulkReceiptCreate, BulkReceiptResponse,
     
     # ダッシュボード関連
     SuperAdminDashboardResponse, OrganizationDashboardResponse, StoreDashboardResponse,
@@ -57,7 +62,7 @@ from schemas_saas import (
     StoreGoalInput, StoreGoalResponse,
     
     # シフト関連
-    ShiftCreate, ShiftUpdate, ShiftResponse,
+    ShiftCreate, ShiftUpdate, ShiftResponse, BulkShiftPublish, BulkShiftPublishResponse,
     ShiftRequestCreate, ShiftRequestResponse,
     
     # 通知関連
@@ -69,11 +74,41 @@ from schemas_saas import (
     # エラーレスポンス
     ErrorResponse, ValidationErrorResponse
 )
+from services.notification_counters import (
+    increment_unread_count, increment_unread_counts, decrement_unread_count, reset_unread_count,
+    get_unread_count as get_cached_unread_count,
+    reconcile_unread_counters, UNREAD_COUNTER_RECONCILE_INTERVAL
+)
+from services.plan_limits import (
+    reserve_store_slot, release_store_slot, reserve_employee_slot,
+    invalidate_plan_cache, reconcile_usage_counters, USAGE_COUNTER_RECONCILE_INTERVAL
+)
+from services.goal_progress import (
+    record_daily_report_created, update_personal_goal_snapshot, update_store_goal_snapshot,
+    get_employee_progress, get_store_progress, get_store_employee_progress,
+    employee_progress_to_dict, store_progress_to_dict
+)
+from services.periodic_jobs import register_periodic_job, start_periodic_jobs, stop_periodic_jobs
+from services.audit_log_writer import start_audit_log_writer, stop_audit_log_writer
+from services.password_hasher import hash_passwords, shutdown_password_hash_executor
+from services.image_preprocessing import shutdown_image_preprocess_executor
+from services.daily_report_import import import_daily_reports
+from services.ocr_jobs import (
+    fail_stale_ocr_jobs, start_ocr_workers, stop_ocr_workers, OCR_STALE_JOB_CHECK_INTERVAL
+)
+from services.idempotency import (
+    IdempotencyMiddleware, purge_expired_idempotency_keys, IDEMPOTENCY_CLEANUP_INTERVAL
+)
+from services.receipt_totals import (
+    receipts_added, receipt_updated, receipt_removed, receipt_values,
+    check_report_totals, REPORT_TOTALS_CHECK_INTERVAL
+)
 from auth_saas import (
     get_password_hash, authenticate_system_admin, authenticate_employee,
     create_access_token, get_current_user, get_current_admin, get_current_employee,
     require_super_admin, require_role, require_store_access, require_organization_access,
     log_user_action, get_user_accessible_stores, get_user_accessible_organizations,
+    invalidate_tenant_scope_cache,
     get_legacy_user_from_employee, create_security_headers, validate_password_strength,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
@@ -88,6 +123,10 @@ app = FastAPI(
     description="マルチテナント対応バー管理システム"
 )
 
+# Idempotency-Key 対応（再送リクエストには保存済みレスポンスを返す）
+# 後から追加したミドルウェアほど外側になるため、CORS・セキュリティヘッダーより先に登録
+app.add_middleware(IdempotencyMiddleware)
+
 # CORS設定（本番環境対応）
 # backend_SaaS/main_saas.py
 # 28行目から60行目あたりのCORS設定を以下に完全置き換え
@@ -206,6 +245,36 @@ def startup_event():
             print(f"スーパーアドミン作成エラー: {e}")
             print("アプリケーションは起動しますが、管理者機能が制限される可能性があります")
         
+        # 定期メンテナンスジョブ開始
+        register_periodic_job(
+            "unread_notification_counters",
+            reconcile_unread_counters,
+            UNREAD_COUNTER_RECONCILE_INTERVAL
+        )
+        register_periodic_job(
+            "plan_usage_counters",
+            reconcile_usage_counters,
+            USAGE_COUNTER_RECONCILE_INTERVAL
+        )
+        register_periodic_job(
+            "daily_report_totals",
+            check_report_totals,
+            REPORT_TOTALS_CHECK_INTERVAL
+        )
+        register_periodic_job(
+            "idempotency_keys",
+            purge_expired_idempotency_keys,
+            IDEMPOTENCY_CLEANUP_INTERVAL
+        )
+        register_periodic_job(
+            "stale_ocr_jobs",
+            fail_stale_ocr_jobs,
+            OCR_STALE_JOB_CHECK_INTERVAL
+        )
+        start_periodic_jobs()
+        start_audit_log_writer()
+        start_ocr_workers()
+        
         print("SaaS API起動完了")
         
     except Exception as e:
@@ -213,6 +282,16 @@ def startup_event():
         print("アプリケーションは起動しますが、一部機能が制限される可能性があります")
 
 
+@app.on_event("shutdown")
+def shutdown_event():
+    # 未書き込みの監査ログを書き切る
+    stop_audit_log_writer()
+    stop_periodic_jobs()
+    stop_ocr_workers()
+    shutdown_image_preprocess_executor()
+    shutdown_password_hash_executor()
+
+
 # ====== AI伝票スキャンルーターを追加 ======
 try:
     from routes.receipt_scan import router as receipt_scan_router
@@ -335,11 +414,7 @@ def google_employee_login(
     """Google OAuth - 従業員ログイン"""
     try:
         # Googleトークンを検証
-        idinfo = id_token.verify_oauth2_token(
-            token, 
-            google_requests.Request(), 
-            GOOGLE_CLIENT_ID
-        )
+        idinfo = get_google_token_verifier().verify(token, GOOGLE_CLIENT_ID)
         
         # メールアドレスを取得
         email = idinfo.get('email')
@@ -367,6 +442,9 @@ def google_employee_login(
         
         # 従業員が見つからない場合は新規登録
         if not employee:
+            # プラン上限チェック（従業員枠を確保）
+            reserve_employee_slot(db, store)
+            
             # 従業員コード生成
             employee_code = generate_employee_code(store.store_code)
             
@@ -423,6 +501,9 @@ def google_employee_login(
             }
         }
         
+    except HTTPException:
+        # 店舗なし・プラン上限・無効アカウントなどはそのまま返す
+        raise
     except ValueError as e:
         # トークン検証失敗
         raise HTTPException(
@@ -444,11 +525,7 @@ def google_admin_login(
     """Google OAuth - スーパーアドミンログイン"""
     try:
         # Googleトークンを検証
-        idinfo = id_token.verify_oauth2_token(
-            token, 
-            google_requests.Request(), 
-            GOOGLE_CLIENT_ID
-        )
+        idinfo = get_google_token_verifier().verify(token, GOOGLE_CLIENT_ID)
         
         # メールアドレスを取得
         email = idinfo.get('email')
@@ -577,10 +654,13 @@ def register_employee(
                 detail=msg
             )
         
-        # 4. 従業員コードの生成
+        # 4. プラン上限チェック（従業員枠を確保）
+        reserve_employee_slot(db, store)
+        
+        # 5. 従業員コードの生成
         employee_code = generate_employee_code(register_data.store_code)
         
-        # 5. 新規従業員の作成
+        # 6. 新規従業員の作成
         new_employee = Employee(
             store_id=store.id,
             employee_code=employee_code,
@@ -597,7 +677,7 @@ def register_employee(
         db.commit()
         db.refresh(new_employee)
         
-        # 6. 監査ログ記録
+        # 7. 監査ログ記録
         log_user_action(
             db, new_employee, "employee_register", "employee",
             resource_id=new_employee.id,
@@ -808,11 +888,16 @@ def admin_toggle_store_active(
     if not store:
         raise HTTPException(status_code=404, detail="店舗が見つかりません")
     
-    # アクティブ状態を切り替え
+    # アクティブ状態を切り替え（有効化時はプランの店舗枠を確保）
+    if store.is_active:
+        release_store_slot(db, store.organization_id)
+    else:
+        reserve_store_slot(db, store.organization_id)
     store.is_active = not store.is_active
     store.updated_at = datetime.utcnow()
     
     db.commit()
+    invalidate_tenant_scope_cache()
     
     # 監査ログ記録
     log_user_action(
@@ -946,6 +1031,7 @@ def create_organization(
     db.add(organization)
     db.commit()
     db.refresh(organization)
+    invalidate_tenant_scope_cache()
     
     # 監査ログ記録
     log_user_action(
@@ -1012,6 +1098,7 @@ def setup_store_complete(
         )
         db.add(organization)
         db.flush()  # IDを取得するためフラッシュ
+        reserve_store_slot(db, organization.id)
         
         # 2. 店舗作成
         store_code = generate_store_code()
@@ -1029,6 +1116,7 @@ def setup_store_complete(
         )
         db.add(store)
         db.flush()
+        reserve_employee_slot(db, store)
         
         # 3. オーナー従業員作成
         is_valid, msg = validate_password_strength(setup_data.owner_data.password)
@@ -1078,6 +1166,7 @@ def setup_store_complete(
         db.add(invite_code)
         
         db.commit()
+        invalidate_tenant_scope_cache()
         
         # 監査ログ記録
         log_user_action(
@@ -1295,6 +1384,9 @@ def create_employee(
     if not store:
         raise HTTPException(status_code=404, detail="店舗が見つかりません")
     
+    # プラン上限チェック（従業員枠を確保）
+    reserve_employee_slot(db, store)
+    
     # 従業員作成
     employee_code = generate_employee_code(store.store_code)
     employee = Employee(
@@ -1340,6 +1432,110 @@ def create_employee(
         "updated_at": employee.updated_at.isoformat()
     }
 
+@app.post("/api/stores/{store_id}/employees/bulk", response_model=BulkEmployeeResponse)
+def bulk_create_employees(
+    store_id: int,
+    bulk_data: BulkEmployeeCreate,
+    request: Request,
+    current_user = Depends(require_role(UserRole.MANAGER)),
+    db: Session = Depends(get_db)
+):
+    """
+    従業員一括登録
+    - メール重複は1クエリで確認、パスワードはプロセスプールで並列ハッシュ化
+    - 有効な行のみ1回のINSERTで登録し、不正な行は行番号付きでerrorsに返す
+    """
+    # 店舗アクセス権限チェック
+    if not isinstance(current_user, SystemAdmin):
+        if current_user.store_id != store_id:
+            raise HTTPException(status_code=403, detail="指定された店舗にアクセスする権限がありません")
+    
+    store = db.query(Store).filter(Store.id == store_id).first()
+    if not store:
+        raise HTTPException(status_code=404, detail="店舗が見つかりません")
+    
+    # 1. メール重複チェック（既存分は1クエリ、リクエスト内の重複も検出）
+    emails = [e.email for e in bulk_data.employees]
+    existing_emails = {
+        email for (email,) in db.query(Employee.email).filter(Employee.email.in_(emails)).all()
+    } if emails else set()
+    
+    errors = []
+    valid_rows = []
+    seen_emails = set()
+    for index, employee_data in enumerate(bulk_data.employees):
+        if employee_data.email in existing_emails:
+            errors.append({"index": index, "email": employee_data.email, "error": "このメールアドレスは既に使用されています"})
+            continue
+        if employee_data.email in seen_emails:
+            errors.append({"index": index, "email": employee_data.email, "error": "リクエスト内でメールアドレスが重複しています"})
+            continue
+        is_valid, msg = validate_password_strength(employee_data.password)
+        if not is_valid:
+            errors.append({"index": index, "email": employee_data.email, "error": msg})
+            continue
+        seen_emails.add(employee_data.email)
+        valid_rows.append(employee_data)
+    
+    if not valid_rows:
+        return BulkEmployeeResponse(
+            success_count=0, error_count=len(errors), errors=errors, created_employees=[]
+        )
+    
+    # 2. パスワードを並列ハッシュ化（枠確保のロックを持つ前に実行）
+    password_hashes = hash_passwords([e.password for e in valid_rows])
+    
+    # 3. 従業員コード生成（リクエスト内で重複しないように）
+    employee_codes = set()
+    while len(employee_codes) < len(valid_rows):
+        employee_codes.add(generate_employee_code(store.store_code))
+    
+    try:
+        with unit_of_work(db):
+            # 4. プラン上限チェック（有効行数分の枠をまとめて確保）
+            reserve_employee_slot(db, store, count=len(valid_rows))
+            
+            # 5. 一括登録
+            employees = [
+                Employee(
+                    store_id=store_id,
+                    employee_code=employee_code,
+                    name=employee_data.name,
+                    email=employee_data.email,
+                    password_hash=password_hash,
+                    role=employee_data.role,
+                    hire_date=employee_data.hire_date or date.today(),
+                    hourly_wage=employee_data.hourly_wage,
+                    employment_type=employee_data.employment_type,
+                    phone=employee_data.phone,
+                    emergency_contact_name=employee_data.emergency_contact_name,
+                    emergency_contact_phone=employee_data.emergency_contact_phone
+                )
+                for employee_data, password_hash, employee_code
+                in zip(valid_rows, password_hashes, employee_codes)
+            ]
+            db.add_all(employees)
+            db.flush()
+            
+            # コミット後の再読み込みを避けるため flush 時点の値でレスポンスを作成
+            created_employees = [EmployeeResponse.model_validate(e) for e in employees]
+            
+            # 6. 監査ログ記録（1件に集約）
+            log_user_action(
+                db, current_user, "bulk_create_employees", "employee",
+                changes={"count": len(employees), "emails": [e.email for e in employees]},
+                request=request
+            )
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="同時に登録されたメールアドレスが含まれています。再度お試しください")
+    
+    return BulkEmployeeResponse(
+        success_count=len(created_employees),
+        error_count=len(errors),
+        errors=errors,
+        created_employees=created_employees
+    )
+
 @app.get("/api/stores/{store_id}/employees")
 def list_employees(
     store_id: int,
@@ -1500,6 +1696,9 @@ def use_invite_code(
     if not is_valid:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=msg)
     
+    # プラン上限チェック（従業員枠を確保）
+    reserve_employee_slot(db, store)
+    
     # 従業員作成
     employee_code = generate_employee_code(store.store_code)
     employee = Employee(
@@ -1580,18 +1779,20 @@ def create_daily_report(
         notes=report_data.notes
     )
     
-    db.add(daily_report)
-    db.commit()
+    # 日報・目標進捗・監査ログを1トランザクションで反映
+    with unit_of_work(db):
+        db.add(daily_report)
+        record_daily_report_created(db, daily_report)
+        
+        # 監査ログ記録
+        log_user_action(
+            db, current_user, "create_daily_report", "daily_report",
+            resource_id=daily_report.id,
+            changes={"date": report_data.date.isoformat(), "total_sales": report_data.total_sales},
+            request=request
+        )
     db.refresh(daily_report)
     
-    # 監査ログ記録
-    log_user_action(
-        db, current_user, "create_daily_report", "daily_report",
-        resource_id=daily_report.id,
-        changes={"date": report_data.date.isoformat(), "total_sales": report_data.total_sales},
-        request=request
-    )
-    
     return {
         "id": daily_report.id,
         "store_id": daily_report.store_id,
@@ -1719,6 +1920,84 @@ def approve_daily_report(
         "approved_at": report.approved_at.isoformat() if report.approved_at else None
     }
 
+@app.put("/api/stores/{store_id}/daily-reports/approve")
+def bulk_approve_daily_reports(
+    store_id: int,
+    approval_data: DailyReportBulkApproval,
+    request: Request,
+    current_user = Depends(require_role(UserRole.MANAGER)),
+    db: Session = Depends(get_db)
+):
+    """
+    日報一括承認
+    - IDリスト、または期間・従業員の条件で対象を指定
+    - 1回のUPDATEで承認状態を更新し、監査ログは1件に集約
+    """
+    # 店舗アクセス権限チェック
+    if not isinstance(current_user, SystemAdmin):
+        if current_user.store_id != store_id:
+            raise HTTPException(status_code=403, detail="指定された店舗にアクセスする権限がありません")
+    
+    # 条件なし（店舗の全日報）は誤操作を防ぐため受け付けない。従業員のみの指定は可
+    if not (approval_data.report_ids or approval_data.date_from or approval_data.date_to
+            or approval_data.employee_id):
+        raise HTTPException(status_code=400, detail="日報ID、または期間・従業員を指定してください")
+    
+    conditions = [DailyReport.store_id == store_id]
+    # 既に同じ状態の日報は更新しない
+    if approval_data.is_approved:
+        conditions.append(func.coalesce(DailyReport.is_approved, False) == False)
+    else:
+        conditions.append(DailyReport.is_approved == True)
+    if approval_data.report_ids:
+        conditions.append(DailyReport.id.in_(approval_data.report_ids))
+    if approval_data.date_from:
+        conditions.append(DailyReport.report_date >= approval_data.date_from)
+    if approval_data.date_to:
+        conditions.append(DailyReport.report_date <= approval_data.date_to)
+    if approval_data.employee_id:
+        conditions.append(DailyReport.employee_id == approval_data.employee_id)
+    
+    approved_at = datetime.utcnow() if approval_data.is_approved else None
+    with unit_of_work(db):
+        updated_ids = db.scalars(
+            update(DailyReport)
+            .where(*conditions)
+            .values(
+                is_approved=approval_data.is_approved,
+                approved_by_employee_id=approval_data.approved_by_employee_id,
+                approved_at=approved_at,
+                updated_at=datetime.utcnow()
+            )
+            .returning(DailyReport.id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        
+        # 監査ログ記録（1件に集約）
+        if updated_ids:
+            log_user_action(
+                db, current_user, "bulk_approve_daily_reports", "daily_report",
+                changes={
+                    "is_approved": approval_data.is_approved,
+                    "count": len(updated_ids),
+                    "report_ids": updated_ids[:1000],
+                    "filter": {
+                        "date_from": approval_data.date_from.isoformat() if approval_data.date_from else None,
+                        "date_to": approval_data.date_to.isoformat() if approval_data.date_to else None,
+                        "employee_id": approval_data.employee_id
+                    }
+                },
+                request=request
+            )
+    
+    return {
+        "updated_count": len(updated_ids),
+        "report_ids": updated_ids,
+        "is_approved": approval_data.is_approved,
+        "approved_by_employee_id": approval_data.approved_by_employee_id,
+        "approved_at": approved_at.isoformat() if approved_at else None
+    }
+
 # ====== サブスクリプション管理エンドポイント ======
 
 @app.get("/api/admin/subscriptions")
@@ -1769,6 +2048,7 @@ def update_subscription(
     
     subscription.updated_at = datetime.utcnow()
     db.commit()
+    invalidate_plan_cache(subscription.organization_id)
     
     # 監査ログ記録
     log_user_action(
@@ -1873,38 +2153,21 @@ def get_employee_summary(
     _, last_day = monthrange(year, month_num)
     end_date = date(year, month_num, last_day)
     
-    # 目標を取得
-    goal = db.query(PersonalGoal).filter(
-        PersonalGoal.employee_id == current_user.id,
-        PersonalGoal.year == year,
-        PersonalGoal.month == month_num
-    ).first()
-    
-    # デフォルト目標
-    sales_goal = goal.sales_goal if goal else 500000
-    drinks_goal = goal.drinks_goal if goal else 100
-    catch_goal = goal.catch_goal if goal else 50
+    # 目標と実績は進捗スナップショットから取得
+    progress = employee_progress_to_dict(
+        get_employee_progress(db, current_user.id, current_user.store_id, year, month_num)
+    )
     
-    # 実績を集計
-    reports = db.query(DailyReport).filter(
+    # 日別内訳
+    reports = db.query(
+        DailyReport.report_date, DailyReport.total_sales, DailyReport.drink_count,
+        DailyReport.catch_count, DailyReport.number_of_customers
+    ).filter(
         DailyReport.employee_id == current_user.id,
         DailyReport.report_date >= start_date,
         DailyReport.report_date <= end_date
-    ).all()
-    
-    total_sales = sum(r.total_sales for r in reports)
-    total_drinks = sum(r.drink_count for r in reports)
-    total_catch = sum(r.catch_count or 0 for r in reports)
-    total_customers = sum(r.number_of_customers for r in reports)
-    total_champagne = sum(r.champagne_sales for r in reports)
-    work_days = len(reports)
-    
-    # 達成率計算
-    sales_rate = (total_sales / sales_goal * 100) if sales_goal > 0 else 0
-    drinks_rate = (total_drinks / drinks_goal * 100) if drinks_goal > 0 else 0
-    catch_rate = (total_catch / catch_goal * 100) if catch_goal > 0 else 0
+    ).order_by(DailyReport.report_date).all()
     
-    # 日別内訳
     daily_breakdown = [
         {
             "date": r.report_date.isoformat(),
@@ -1912,7 +2175,7 @@ def get_employee_summary(
             "drinks": r.drink_count,
             "catch": r.catch_count or 0,
             "customers": r.number_of_customers
-        } for r in sorted(reports, key=lambda x: x.report_date)
+        } for r in reports
     ]
     
     return {
@@ -1927,24 +2190,11 @@ def get_employee_summary(
             "start_date": start_date.isoformat(),
             "end_date": end_date.isoformat()
         },
-        "goals": {
-            "sales_goal": sales_goal,
-            "drinks_goal": drinks_goal,
-            "catch_goal": catch_goal
-        },
-        "actual": {
-            "total_sales": total_sales,
-            "total_drinks": total_drinks,
-            "total_catch": total_catch,
-            "total_customers": total_customers,
-            "total_champagne": total_champagne,
-            "work_days": work_days
-        },
-        "achievement_rate": {
-            "sales": round(sales_rate, 1),
-            "drinks": round(drinks_rate, 1),
-            "catch": round(catch_rate, 1)
-        },
+        "goals": progress["goals"],
+        "actual": progress["actual"],
+        "achievement_rate": progress["achievement_rate"],
+        "remaining_days": progress["remaining_days"],
+        "required_daily_pace": progress["required_daily_pace"],
         "daily_breakdown": daily_breakdown
     }
 
@@ -1992,31 +2242,24 @@ def get_store_ranking(
         Employee.is_active == True
     ).all()
     
+    # 従業員ごとの実績は進捗スナップショットから取得
+    progress_rows = get_store_employee_progress(db, store_id, [emp.id for emp in employees], year, month_num)
+    
     employee_stats = []
     
     for emp in employees:
-        # 従業員ごとの実績を集計
-        reports = db.query(DailyReport).filter(
-            DailyReport.employee_id == emp.id,
-            DailyReport.report_date >= start_date,
-            DailyReport.report_date <= end_date
-        ).all()
-        
-        total_sales = sum(r.total_sales for r in reports)
-        total_drinks = sum(r.drink_count for r in reports)
-        total_catch = sum(r.catch_count or 0 for r in reports)
-        total_customers = sum(r.number_of_customers for r in reports)
-        work_days = len(reports)
-        avg_sales_per_day = total_sales // work_days if work_days > 0 else 0
+        progress = progress_rows[emp.id]
+        work_days = progress.work_days
+        avg_sales_per_day = progress.total_sales // work_days if work_days > 0 else 0
         
         employee_stats.append({
             "employee_id": emp.id,
             "employee_code": emp.employee_code,
             "name": emp.name,
-            "total_sales": total_sales,
-            "total_drinks": total_drinks,
-            "total_catch": total_catch,
-            "total_customers": total_customers,
+            "total_sales": progress.total_sales,
+            "total_drinks": progress.total_drinks,
+            "total_catch": progress.total_catch,
+            "total_customers": progress.total_customers,
             "work_days": work_days,
             "avg_sales_per_day": avg_sales_per_day
         })
@@ -2098,18 +2341,22 @@ def add_receipt_to_report(
             service_charge=receipt_data.get("service_charge", 0)
         )
         
-        db.add(new_receipt)
-        db.commit()
+        with unit_of_work(db):
+            db.add(new_receipt)
+            db.flush()
+            
+            # 日報の合計値へ差分反映
+            receipts_added(db, report, [new_receipt])
+            
+            # 監査ログ記録
+            log_user_action(
+                db, current_user, "add_receipt", "receipt",
+                resource_id=new_receipt.id,
+                changes={"daily_report_id": report_id, "amount": receipt_data.get("amount", 0)},
+                request=request
+            )
         db.refresh(new_receipt)
         
-        # 監査ログ記録
-        log_user_action(
-            db, current_user, "add_receipt", "receipt",
-            resource_id=new_receipt.id,
-            changes={"daily_report_id": report_id, "amount": receipt_data.get("amount", 0)},
-            request=request
-        )
-        
         return {
             "id": new_receipt.id,
             "daily_report_id": new_receipt.daily_report_id,
@@ -2132,6 +2379,87 @@ def add_receipt_to_report(
         raise HTTPException(status_code=500, detail=f"伝票追加に失敗: {str(e)}")
 
 
+@app.post("/api/daily-reports/{report_id}/receipts/batch", response_model=BulkReceiptResponse)
+def add_receipts_batch(
+    report_id: int,
+    batch_data: BulkReceiptCreate,
+    request: Request,
+    current_user = Depends(get_current_employee),
+    db: Session = Depends(get_db)
+):
+    """
+    日報に伝票をまとめて追加（締め作業用）
+    - 各行を ReceiptCreate で検証し、不正な行は行番号付きでerrorsに返す
+    - 有効な行は1回のINSERTで登録し、日報の合計値更新・監査ログは1回だけ
+    """
+    # 日報を取得
+    report = db.query(DailyReport).filter(DailyReport.id == report_id).first()
+    if not report:
+        raise HTTPException(status_code=404, detail="日報が見つかりません")
+    
+    # 権限チェック（自分の日報か、マネージャー以上）
+    if report.employee_id != current_user.id:
+        if current_user.role.value not in ['manager', 'owner']:
+            raise HTTPException(status_code=403, detail="他の従業員の日報には伝票を追加できません")
+    
+    errors = []
+    rows = []
+    for index, raw in enumerate(batch_data.receipts):
+        if raw.get("daily_report_id") not in (None, report_id):
+            errors.append({"index": index, "error": "daily_report_id がURLの日報IDと一致しません"})
+            continue
+        try:
+            receipt_data = ReceiptCreate.model_validate({
+                "employee_name": current_user.name, **raw, "daily_report_id": report_id
+            })
+        except ValidationError as e:
+            errors.append({
+                "index": index,
+                "error": "; ".join(
+                    f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()
+                )
+            })
+            continue
+        rows.append(receipt_data.model_dump())
+    
+    if not rows:
+        return BulkReceiptResponse(
+            success_count=0, error_count=len(errors), errors=errors, created_receipts=[]
+        )
+    
+    try:
+        with unit_of_work(db):
+            # 1回のINSERTで登録
+            receipts = db.scalars(insert(Receipt).returning(Receipt), rows).all()
+            
+            # 日報の合計値を1回だけ更新（バッチ分の差分を反映）
+            receipts_added(db, report, receipts)
+            
+            created_receipts = [ReceiptResponse.model_validate(r) for r in receipts]
+            
+            # 監査ログ記録（1件に集約）
+            log_user_action(
+                db, current_user, "add_receipts_batch", "receipt",
+                changes={
+                    "daily_report_id": report_id,
+                    "count": len(receipts),
+                    "amount": sum(r["amount"] for r in rows)
+                },
+                request=request
+            )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"伝票の一括追加に失敗: {str(e)}")
+    
+    return BulkReceiptResponse(
+        success_count=len(created_receipts),
+        error_count=len(errors),
+        errors=errors,
+        created_receipts=created_receipts
+    )
+
+
 @app.get("/api/daily-reports/{report_id}/receipts")
 def get_report_receipts(
     report_id: int,
@@ -2170,6 +2498,52 @@ def get_report_receipts(
     ]
 
 
+@app.put("/api/daily-reports/{report_id}/receipts/{receipt_id}")
+def update_receipt(
+    report_id: int,
+    receipt_id: int,
+    update_data: ReceiptUpdate,
+    request: Request,
+    current_user = Depends(get_current_employee),
+    db: Session = Depends(get_db)
+):
+    """伝票を更新（日報の合計値には差分のみ反映）"""
+    receipt = db.query(Receipt).filter(
+        Receipt.id == receipt_id,
+        Receipt.daily_report_id == report_id
+    ).first()
+    
+    if not receipt:
+        raise HTTPException(status_code=404, detail="伝票が見つかりません")
+    
+    # 日報の所有者チェック
+    report = db.query(DailyReport).filter(DailyReport.id == report_id).first()
+    if report.employee_id != current_user.id:
+        if current_user.role.value not in ['manager', 'owner']:
+            raise HTTPException(status_code=403, detail="他の従業員の伝票は更新できません")
+    
+    changes = update_data.dict(exclude_unset=True)
+    try:
+        with unit_of_work(db):
+            before = receipt_values(receipt)
+            for field, value in changes.items():
+                setattr(receipt, field, value)
+            
+            # 日報の合計値へ差分反映
+            receipt_updated(db, report, receipt, before)
+            
+            # 監査ログ記録
+            log_user_action(
+                db, current_user, "update_receipt", "receipt",
+                resource_id=receipt.id,
+                changes={"daily_report_id": report_id, **changes},
+                request=request
+            )
+        return ReceiptResponse.model_validate(receipt)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"伝票更新に失敗: {str(e)}")
+
+
 @app.delete("/api/daily-reports/{report_id}/receipts/{receipt_id}")
 def delete_receipt(
     report_id: int,
@@ -2193,8 +2567,12 @@ def delete_receipt(
             raise HTTPException(status_code=403, detail="他の従業員の伝票は削除できません")
     
     try:
-        db.delete(receipt)
-        db.commit()
+        with unit_of_work(db):
+            db.delete(receipt)
+            db.flush()
+            
+            # 日報の合計値から差し引く
+            receipt_removed(db, report, receipt)
         return {"message": "伝票を削除しました"}
     except Exception as e:
         db.rollback()
@@ -2616,6 +2994,53 @@ def export_daily_reports(
     )
 
 
+@app.post("/api/imports/daily-reports")
+def import_daily_reports_csv(
+    request: Request,
+    file: UploadFile = File(...),
+    current_user = Depends(get_current_employee),
+    db: Session = Depends(get_db)
+):
+    """
+    日報CSVを一括取り込み（エクスポートと同じ列構成）
+    - 従業員名で紐付け、同じ従業員・日付の日報が既にある行はスキップ
+    - 行単位のエラーは行番号付きで返す
+    """
+    import io
+    
+    # 権限チェック
+    if current_user.role.value not in ['manager', 'owner']:
+        raise HTTPException(status_code=403, detail="インポート権限がありません")
+    
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        with unit_of_work(db):
+            result = import_daily_reports(
+                db, current_user.store_id, stream, imported_by_id=current_user.id
+            )
+            
+            # 監査ログ記録（1件に集約）
+            log_user_action(
+                db, current_user, "import_daily_reports", "daily_report",
+                changes={
+                    "filename": file.filename,
+                    "imported_count": result["imported_count"],
+                    "duplicate_count": result["duplicate_count"],
+                    "error_count": result["error_count"]
+                },
+                request=request
+            )
+    except UnicodeDecodeError:
+        # ValueError のサブクラスのため先に捕捉する
+        raise HTTPException(status_code=400, detail="CSVはUTF-8で保存してください")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        stream.detach()
+    
+    return result
+
+
 @app.get("/api/exports/employees")
 def export_employees(
     format: str = "csv",
@@ -2699,54 +3124,38 @@ def save_personal_goal(
     - 既存の目標があれば更新、なければ新規作成
     """
     try:
-        # 同じ年月の目標が既に存在するかチェック
-        existing_goal = db.query(PersonalGoal).filter(
-            PersonalGoal.employee_id == current_user.id,
-            PersonalGoal.year == goal_data.year,
-            PersonalGoal.month == goal_data.month
-        ).first()
-        
-        if existing_goal:
-            # 既存の目標を更新
-            existing_goal.sales_goal = goal_data.sales_goal
-            existing_goal.drinks_goal = goal_data.drinks_goal
-            existing_goal.catch_goal = goal_data.catch_goal
-            existing_goal.updated_at = datetime.utcnow()
-            db.commit()
-            db.refresh(existing_goal)
-            
-            # 監査ログ記録
-            log_user_action(
-                db, current_user, "update_personal_goal", "personal_goal",
-                resource_id=existing_goal.id,
-                changes={"year": goal_data.year, "month": goal_data.month, "sales_goal": goal_data.sales_goal},
-                request=request
+        now = datetime.utcnow()
+        with unit_of_work(db):
+            # 同じ年月の目標があれば更新、なければ作成（1往復の upsert）
+            goal, created = upsert_row(
+                db, PersonalGoal,
+                {
+                    "employee_id": current_user.id,
+                    "year": goal_data.year,
+                    "month": goal_data.month,
+                    "sales_goal": goal_data.sales_goal,
+                    "drinks_goal": goal_data.drinks_goal,
+                    "catch_goal": goal_data.catch_goal,
+                    "created_at": now,
+                    "updated_at": now
+                },
+                conflict_columns=["employee_id", "year", "month"],
+                update_columns=["sales_goal", "drinks_goal", "catch_goal", "updated_at"]
             )
-            
-            return existing_goal
-        else:
-            # 新規目標を作成
-            new_goal = PersonalGoal(
-                employee_id=current_user.id,
-                year=goal_data.year,
-                month=goal_data.month,
-                sales_goal=goal_data.sales_goal,
-                drinks_goal=goal_data.drinks_goal,
-                catch_goal=goal_data.catch_goal
-            )
-            db.add(new_goal)
-            db.commit()
-            db.refresh(new_goal)
+            update_personal_goal_snapshot(db, goal)
             
             # 監査ログ記録
             log_user_action(
-                db, current_user, "create_personal_goal", "personal_goal",
-                resource_id=new_goal.id,
+                db, current_user,
+                "create_personal_goal" if created else "update_personal_goal",
+                "personal_goal",
+                resource_id=goal.id,
                 changes={"year": goal_data.year, "month": goal_data.month, "sales_goal": goal_data.sales_goal},
                 request=request
             )
-            
-            return new_goal
+            response = PersonalGoalResponse.model_validate(goal)
+        
+        return response
             
     except Exception as e:
         db.rollback()
@@ -2832,33 +3241,28 @@ def save_store_goal(
         raise HTTPException(status_code=403, detail="他店舗の目標は設定できません")
     
     try:
-        existing_goal = db.query(StoreGoal).filter(
-            StoreGoal.store_id == store_id,
-            StoreGoal.year == goal_data.year,
-            StoreGoal.month == goal_data.month
-        ).first()
-        
-        if existing_goal:
-            existing_goal.monthly_sales_goal = goal_data.monthly_sales_goal
-            existing_goal.weekday_sales_goal = goal_data.weekday_sales_goal
-            existing_goal.weekend_sales_goal = goal_data.weekend_sales_goal
-            existing_goal.updated_at = datetime.utcnow()
-            db.commit()
-            db.refresh(existing_goal)
-            return existing_goal
-        else:
-            new_goal = StoreGoal(
-                store_id=store_id,
-                year=goal_data.year,
-                month=goal_data.month,
-                monthly_sales_goal=goal_data.monthly_sales_goal,
-                weekday_sales_goal=goal_data.weekday_sales_goal,
-                weekend_sales_goal=goal_data.weekend_sales_goal
+        now = datetime.utcnow()
+        with unit_of_work(db):
+            # 同じ年月の目標があれば更新、なければ作成（1往復の upsert）
+            goal, _ = upsert_row(
+                db, StoreGoal,
+                {
+                    "store_id": store_id,
+                    "year": goal_data.year,
+                    "month": goal_data.month,
+                    "monthly_sales_goal": goal_data.monthly_sales_goal,
+                    "weekday_sales_goal": goal_data.weekday_sales_goal,
+                    "weekend_sales_goal": goal_data.weekend_sales_goal,
+                    "created_at": now,
+                    "updated_at": now
+                },
+                conflict_columns=["store_id", "year", "month"],
+                update_columns=["monthly_sales_goal", "weekday_sales_goal", "weekend_sales_goal", "updated_at"]
             )
-            db.add(new_goal)
-            db.commit()
-            db.refresh(new_goal)
-            return new_goal
+            update_store_goal_snapshot(db, goal)
+            response = StoreGoalResponse.model_validate(goal)
+        
+        return response
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"店舗目標の保存に失敗: {str(e)}")
@@ -2903,6 +3307,45 @@ def get_store_goal(
     return goal
 
 
+# ====== 目標進捗エンドポイント ======
+
+@app.get("/api/employees/me/goal-progress")
+def get_my_goal_progress(
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    current_user = Depends(get_current_employee),
+    db: Session = Depends(get_db)
+):
+    """個人目標の進捗を取得（スナップショット1行を参照）"""
+    if not year:
+        year = datetime.now().year
+    if not month:
+        month = datetime.now().month
+    
+    progress = get_employee_progress(db, current_user.id, current_user.store_id, year, month)
+    return {"employee_id": current_user.id, **employee_progress_to_dict(progress)}
+
+
+@app.get("/api/stores/{store_id}/goal-progress")
+def get_store_goal_progress(
+    store_id: int,
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    current_user = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """店舗目標の進捗を取得（スナップショット1行を参照）"""
+    if isinstance(current_user, Employee) and current_user.store_id != store_id:
+        raise HTTPException(status_code=403, detail="他店舗の目標は閲覧できません")
+    
+    if not year:
+        year = datetime.now().year
+    if not month:
+        month = datetime.now().month
+    
+    return store_progress_to_dict(get_store_progress(db, store_id, year, month))
+
+
 # ====== シフト管理エンドポイント ======
 
 @app.post("/api/stores/{store_id}/shifts", response_model=ShiftResponse)
@@ -2938,23 +3381,25 @@ def create_shift(
             notes=shift_data.notes,
             created_by_id=current_user.id
         )
-        db.add(new_shift)
-        db.commit()
+        # シフト・通知・未読数を1トランザクションで反映
+        with unit_of_work(db):
+            db.add(new_shift)
+            db.flush()
+            
+            # 通知を作成
+            notification = Notification(
+                store_id=store_id,
+                employee_id=shift_data.employee_id,
+                notification_type=NotificationType.SHIFT_ASSIGNED,
+                title="新しいシフトが割り当てられました",
+                message=f"{shift_data.shift_date.strftime('%Y年%m月%d日')} {shift_data.start_time}〜{shift_data.end_time}",
+                related_entity_type="shift",
+                related_entity_id=new_shift.id
+            )
+            db.add(notification)
+            increment_unread_count(db, shift_data.employee_id)
         db.refresh(new_shift)
         
-        # 通知を作成
-        notification = Notification(
-            store_id=store_id,
-            employee_id=shift_data.employee_id,
-            notification_type=NotificationType.SHIFT_ASSIGNED,
-            title="新しいシフトが割り当てられました",
-            message=f"{shift_data.shift_date.strftime('%Y年%m月%d日')} {shift_data.start_time}〜{shift_data.end_time}",
-            related_entity_type="shift",
-            related_entity_id=new_shift.id
-        )
-        db.add(notification)
-        db.commit()
-        
         return ShiftResponse(
             id=new_shift.id,
             store_id=new_shift.store_id,
@@ -2973,6 +3418,147 @@ def create_shift(
         raise HTTPException(status_code=500, detail=f"シフト作成に失敗: {str(e)}")
 
 
+@app.post("/api/stores/{store_id}/shifts/bulk", response_model=BulkShiftPublishResponse)
+def publish_shifts_bulk(
+    store_id: int,
+    bulk_data: BulkShiftPublish,
+    request: Request,
+    current_user = Depends(get_current_employee),
+    db: Session = Depends(get_db)
+):
+    """
+    シフトを一括公開（店長・オーナーのみ）
+    - 従業員の確認・既存シフトとの重複確認はそれぞれ1クエリ
+    - シフトは1回のINSERTで登録し、通知は従業員ごとに1件のまとめ通知
+    - 重複・不正な行は行番号付きでerrorsに返し、残りは登録する
+    """
+    if current_user.role.value not in ['manager', 'owner']:
+        raise HTTPException(status_code=403, detail="シフト作成権限がありません")
+    
+    if current_user.store_id != store_id:
+        raise HTTPException(status_code=403, detail="他店舗のシフトは作成できません")
+    
+    shifts = bulk_data.shifts
+    
+    # 1. 従業員の存在確認（1クエリ）
+    employee_ids = {s.employee_id for s in shifts}
+    employees = dict(db.query(Employee.id, Employee.name).filter(
+        Employee.id.in_(employee_ids),
+        Employee.store_id == store_id
+    ).all())
+    
+    # 2. 既存シフトとの重複確認（対象期間の (従業員, 日付) を1クエリで取得）
+    existing = set(db.query(Shift.employee_id, Shift.shift_date).filter(
+        Shift.store_id == store_id,
+        Shift.employee_id.in_(employees.keys()),
+        Shift.shift_date >= min(s.shift_date for s in shifts),
+        Shift.shift_date <= max(s.shift_date for s in shifts),
+        Shift.status != ShiftStatus.CANCELLED
+    ).all()) if employees else set()
+    
+    errors = []
+    rows = []
+    seen = set()
+    for index, shift_data in enumerate(shifts):
+        key = (shift_data.employee_id, shift_data.shift_date)
+        if shift_data.employee_id not in employees:
+            errors.append({"index": index, "employee_id": shift_data.employee_id, "error": "従業員が見つかりません"})
+            continue
+        if key in existing:
+            errors.append({
+                "index": index, "employee_id": shift_data.employee_id,
+                "error": f"{shift_data.shift_date.isoformat()} には既にシフトがあります"
+            })
+            continue
+        if key in seen:
+            errors.append({
+                "index": index, "employee_id": shift_data.employee_id,
+                "error": f"{shift_data.shift_date.isoformat()} のシフトがリクエスト内で重複しています"
+            })
+            continue
+        seen.add(key)
+        rows.append({
+            "store_id": store_id,
+            "employee_id": shift_data.employee_id,
+            "shift_date": shift_data.shift_date,
+            "start_time": shift_data.start_time,
+            "end_time": shift_data.end_time,
+            "notes": shift_data.notes,
+            "created_by_id": current_user.id
+        })
+    
+    if not rows:
+        return BulkShiftPublishResponse(
+            success_count=0, error_count=len(errors), errors=errors,
+            notified_employee_count=0, created_shifts=[]
+        )
+    
+    try:
+        with unit_of_work(db):
+            # 3. シフトを1回のINSERTで登録
+            new_shifts = db.scalars(insert(Shift).returning(Shift), rows).all()
+            
+            # 4. 従業員ごとのまとめ通知
+            by_employee = {}
+            for shift in new_shifts:
+                by_employee.setdefault(shift.employee_id, []).append(shift)
+            
+            if bulk_data.notify:
+                notifications = []
+                for employee_id, employee_shifts in by_employee.items():
+                    dates = sorted(s.shift_date for s in employee_shifts)
+                    notifications.append({
+                        "store_id": store_id,
+                        "employee_id": employee_id,
+                        "notification_type": NotificationType.SHIFT_ASSIGNED,
+                        "title": f"{dates[0].month}月のシフトが公開されました",
+                        "message": f"{len(dates)}件のシフトが割り当てられました"
+                                   f"（{dates[0].strftime('%m/%d')}〜{dates[-1].strftime('%m/%d')}）",
+                        "related_entity_type": "shift",
+                        "related_entity_id": employee_shifts[0].id
+                    })
+                db.execute(insert(Notification), notifications)
+                increment_unread_counts(db, by_employee.keys())
+            
+            created_shifts = [
+                ShiftResponse(
+                    id=shift.id,
+                    store_id=shift.store_id,
+                    employee_id=shift.employee_id,
+                    employee_name=employees.get(shift.employee_id),
+                    shift_date=shift.shift_date,
+                    start_time=shift.start_time,
+                    end_time=shift.end_time,
+                    status=shift.status.value,
+                    notes=shift.notes,
+                    created_at=shift.created_at,
+                    updated_at=shift.updated_at
+                ) for shift in new_shifts
+            ]
+            
+            # 監査ログ記録（1件に集約）
+            log_user_action(
+                db, current_user, "publish_shifts_bulk", "shift",
+                changes={
+                    "count": len(new_shifts),
+                    "employee_count": len(by_employee),
+                    "date_from": min(r["shift_date"] for r in rows).isoformat(),
+                    "date_to": max(r["shift_date"] for r in rows).isoformat()
+                },
+                request=request
+            )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"シフト一括公開に失敗: {str(e)}")
+    
+    return BulkShiftPublishResponse(
+        success_count=len(created_shifts),
+        error_count=len(errors),
+        errors=errors,
+        notified_employee_count=len(by_employee) if bulk_data.notify else 0,
+        created_shifts=created_shifts
+    )
+
+
 @app.get("/api/stores/{store_id}/shifts", response_model=List[ShiftResponse])
 def get_shifts(
     store_id: int,
@@ -3246,9 +3832,11 @@ def mark_notification_read(
     if not notification:
         raise HTTPException(status_code=404, detail="通知が見つかりません")
     
-    notification.is_read = True
-    notification.read_at = datetime.utcnow()
-    db.commit()
+    if not notification.is_read:
+        notification.is_read = True
+        notification.read_at = datetime.utcnow()
+        decrement_unread_count(db, current_user.id)
+        db.commit()
     
     return {"message": "既読にしました"}
 
@@ -3263,6 +3851,7 @@ def mark_all_notifications_read(
         Notification.employee_id == current_user.id,
         Notification.is_read == False
     ).update({"is_read": True, "read_at": datetime.utcnow()})
+    reset_unread_count(db, current_user.id)
     db.commit()
     
     return {"message": "全て既読にしました"}
@@ -3273,11 +3862,8 @@ def get_unread_count(
     current_user = Depends(get_current_employee),
     db: Session = Depends(get_db)
 ):
-    """未読通知数を取得"""
-    count = db.query(Notification).filter(
-        Notification.employee_id == current_user.id,
-        Notification.is_read == False
-    ).count()
+    """未読通知数を取得（非正規化カウンターを参照）"""
+    count = get_cached_unread_count(db, current_user.id)
     
     return {"unread_count": count}
 
@@ -3307,6 +3893,7 @@ def create_notification(
             related_entity_id=notification_data.related_entity_id
         )
         db.add(new_notification)
+        increment_unread_count(db, notification_data.employee_id)
         db.commit()
         db.refresh(new_notification)
         
@@ -0,0 +1,56 @@
+-- 目標進捗スナップショット用のマイグレーション
+-- 機能: 個人・店舗の月間目標進捗を1行で保持（日報書き込み時に差分更新）
+-- 既存月のスナップショットは初回アクセス時に日報から自動作成される
+
+CREATE TABLE IF NOT EXISTS employee_goal_progress (
+    employee_id INTEGER NOT NULL REFERENCES employees(id) ON DELETE CASCADE,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    store_id INTEGER NOT NULL REFERENCES stores(id) ON DELETE CASCADE,
+    
+    -- 目標値
+    sales_goal INTEGER DEFAULT 500000,
+    drinks_goal INTEGER DEFAULT 100,
+    catch_goal INTEGER DEFAULT 50,
+    
+    -- 実績
+    total_sales INTEGER NOT NULL DEFAULT 0,
+    total_drinks INTEGER NOT NULL DEFAULT 0,
+    total_catch INTEGER NOT NULL DEFAULT 0,
+    total_customers INTEGER NOT NULL DEFAULT 0,
+    total_champagne INTEGER NOT NULL DEFAULT 0,
+    work_days INTEGER NOT NULL DEFAULT 0,
+    
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (employee_id, year, month)
+);
+
+CREATE INDEX IF NOT EXISTS ix_employee_goal_progress_store_id
+ON employee_goal_progress(store_id);
+
+CREATE TABLE IF NOT EXISTS store_goal_progress (
+    store_id INTEGER NOT NULL REFERENCES stores(id) ON DELETE CASCADE,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    
+    -- 目標値
+    monthly_sales_goal INTEGER DEFAULT 3000000,
+    weekday_sales_goal INTEGER DEFAULT 100000,
+    weekend_sales_goal INTEGER DEFAULT 200000,
+    
+    -- 実績
+    total_sales INTEGER NOT NULL DEFAULT 0,
+    weekday_sales INTEGER NOT NULL DEFAULT 0,
+    weekend_sales INTEGER NOT NULL DEFAULT 0,
+    weekday_days INTEGER NOT NULL DEFAULT 0,
+    weekend_days INTEGER NOT NULL DEFAULT 0,
+    
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (store_id, year, month)
+);
+
+-- 成功メッセージ
+DO $$
+BEGIN
+    RAISE NOTICE '✅ 目標進捗スナップショットのマイグレーション完了';
+END$$;
@@ -0,0 +1,44 @@
+-- 個人目標・店舗目標の一意制約
+-- 機能: 同じ年月の目標を1件に限定し、保存を INSERT ... ON CONFLICT DO UPDATE の1往復にする
+-- 既存の重複行は最後に更新されたものを残して削除してから制約を追加
+
+-- 重複した個人目標を削除（updated_at が新しいもの、同時刻なら id が大きいものを残す）
+DELETE FROM personal_goals p
+USING personal_goals newer
+WHERE p.employee_id = newer.employee_id
+  AND p.year = newer.year
+  AND p.month = newer.month
+  AND (COALESCE(p.updated_at, p.created_at, TIMESTAMP 'epoch'), p.id)
+    < (COALESCE(newer.updated_at, newer.created_at, TIMESTAMP 'epoch'), newer.id);
+
+-- 重複した店舗目標を削除
+DELETE FROM store_goals s
+USING store_goals newer
+WHERE s.store_id = newer.store_id
+  AND s.year = newer.year
+  AND s.month = newer.month
+  AND (COALESCE(s.updated_at, s.created_at, TIMESTAMP 'epoch'), s.id)
+    < (COALESCE(newer.updated_at, newer.created_at, TIMESTAMP 'epoch'), newer.id);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'uq_personal_goals_employee_month'
+    ) THEN
+        ALTER TABLE personal_goals
+        ADD CONSTRAINT uq_personal_goals_employee_month UNIQUE (employee_id, year, month);
+    END IF;
+    
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'uq_store_goals_store_month'
+    ) THEN
+        ALTER TABLE store_goals
+        ADD CONSTRAINT uq_store_goals_store_month UNIQUE (store_id, year, month);
+    END IF;
+END$$;
+
+-- 成功メッセージ
+DO $$
+BEGIN
+    RAISE NOTICE '✅ 目標テーブルの一意制約マイグレーション完了';
+END$$;
@@ -0,0 +1,27 @@
+-- Idempotency-Key 用のマイグレーション
+-- 機能: 再送された書き込みリクエストに保存済みレスポンスを返す（OCR・伝票作成の重複を防止）
+-- 期限切れの行はアプリの定期ジョブで削除される
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    -- SHA-256(認証情報 + キー)
+    key_hash VARCHAR(64) PRIMARY KEY,
+    -- SHA-256(メソッド + パス + ボディ)
+    request_hash VARCHAR(64) NOT NULL,
+    
+    -- レスポンス（処理中は NULL）
+    status_code INTEGER,
+    content_type VARCHAR(100),
+    response_body TEXT,
+    
+    created_at TIMESTAMP DEFAULT NOW(),
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_idempotency_keys_expires_at
+ON idempotency_keys(expires_at);
+
+-- 成功メッセージ
+DO $$
+BEGIN
+    RAISE NOTICE '✅ Idempotency-Keyテーブルのマイグレーション完了';
+END$$;
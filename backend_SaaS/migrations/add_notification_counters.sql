@@ -0,0 +1,22 @@
+-- 未読通知カウンター用のマイグレーション
+-- 機能: 従業員ごとの未読通知数を非正規化して保持（未読数ポーリングを主キー参照にする）
+
+CREATE TABLE IF NOT EXISTS notification_counters (
+    employee_id INTEGER PRIMARY KEY REFERENCES employees(id) ON DELETE CASCADE,
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- 既存の未読通知から初期値を作成
+INSERT INTO notification_counters (employee_id, unread_count, updated_at)
+SELECT employee_id, COUNT(*), NOW()
+FROM notifications
+WHERE is_read = FALSE
+GROUP BY employee_id
+ON CONFLICT (employee_id) DO UPDATE SET unread_count = EXCLUDED.unread_count;
+
+-- 成功メッセージ
+DO $$
+BEGIN
+    RAISE NOTICE '✅ 未読通知カウンターのマイグレーション完了';
+END$$;
@@ -0,0 +1,16 @@
+-- 伝票画像の重複検出用インデックス
+-- 機能: 同じ写真の再スキャン時に (store_id, image_hash) で処理済みの結果を探し、
+--       画像アップロードとOCRを省略する
+-- image_hash は前処理前の元画像のハッシュ（既存行は前処理後の画像のハッシュのため再利用されない）
+
+CREATE INDEX IF NOT EXISTS idx_receipt_images_store_hash
+ON receipt_images(store_id, image_hash);
+
+-- store_id を含む複合インデックスで代替できるため単独インデックスは削除
+DROP INDEX IF EXISTS idx_receipt_images_hash;
+
+-- 成功メッセージ
+DO $$
+BEGIN
+    RAISE NOTICE '✅ 伝票画像の重複検出インデックスのマイグレーション完了';
+END$$;
@@ -0,0 +1,39 @@
+-- プラン上限チェック用の利用状況カウンター
+-- 機能: 組織ごとの有効店舗数・店舗ごとの有効従業員数を保持（上限チェックをO(1)にする）
+
+CREATE TABLE IF NOT EXISTS organization_usage (
+    organization_id INTEGER PRIMARY KEY REFERENCES organizations(id) ON DELETE CASCADE,
+    active_store_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS store_usage (
+    store_id INTEGER PRIMARY KEY REFERENCES stores(id) ON DELETE CASCADE,
+    organization_id INTEGER NOT NULL REFERENCES organizations(id) ON DELETE CASCADE,
+    active_employee_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS ix_store_usage_organization_id
+ON store_usage(organization_id);
+
+-- 既存データから初期値を作成
+INSERT INTO organization_usage (organization_id, active_store_count, updated_at)
+SELECT organization_id, COUNT(*), NOW()
+FROM stores
+WHERE is_active = TRUE
+GROUP BY organization_id
+ON CONFLICT (organization_id) DO UPDATE SET active_store_count = EXCLUDED.active_store_count;
+
+INSERT INTO store_usage (store_id, organization_id, active_employee_count, updated_at)
+SELECT s.id, s.organization_id, COUNT(e.id), NOW()
+FROM stores s
+LEFT JOIN employees e ON e.store_id = s.id AND e.is_active = TRUE
+GROUP BY s.id, s.organization_id
+ON CONFLICT (store_id) DO UPDATE SET active_employee_count = EXCLUDED.active_employee_count;
+
+-- 成功メッセージ
+DO $$
+BEGIN
+    RAISE NOTICE '✅ 利用状況カウンターのマイグレーション完了';
+END$$;
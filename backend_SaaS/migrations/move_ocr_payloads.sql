@@ -0,0 +1,71 @@
+-- OCR結果の保存先変更のマイグレーション
+-- 機能: OCRテキスト・OCRレスポンスを receipt_ocr_payloads に圧縮して保存し、
+--       receipt_images（スキャン履歴の一覧で読む行）を小さくする
+-- 既存のOCRテキストは非圧縮（encoding = 'none'）のまま移す（アプリはどちらも読める）
+-- 抽出データに重複して入っていたOCRテキスト（raw_text）・照合箇所（raw_match）は削除
+
+CREATE TABLE IF NOT EXISTS receipt_ocr_payloads (
+    receipt_image_id INTEGER PRIMARY KEY REFERENCES receipt_images(id) ON DELETE CASCADE,
+    -- 'zlib' / 'none'
+    encoding VARCHAR(10) NOT NULL,
+    ocr_text BYTEA,
+    raw_response BYTEA,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+DO $$
+BEGIN
+    -- 既存のOCRテキストを移して列を削除
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'receipt_images' AND column_name = 'ocr_raw_response'
+    ) THEN
+        INSERT INTO receipt_ocr_payloads (receipt_image_id, encoding, ocr_text)
+        SELECT id, 'none', convert_to(ocr_raw_response, 'UTF8')
+        FROM receipt_images
+        WHERE ocr_raw_response IS NOT NULL
+        ON CONFLICT (receipt_image_id) DO NOTHING;
+
+        ALTER TABLE receipt_images DROP COLUMN ocr_raw_response;
+    END IF;
+
+    -- 抽出データを JSONB に変換
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'receipt_images' AND column_name = 'ocr_extracted_data'
+          AND data_type = 'text'
+    ) THEN
+        ALTER TABLE receipt_images
+        ALTER COLUMN ocr_extracted_data TYPE JSONB USING NULLIF(ocr_extracted_data, '')::jsonb;
+    END IF;
+END$$;
+
+-- OCRテキストが移っていない行は、抽出データの raw_text から移す
+INSERT INTO receipt_ocr_payloads (receipt_image_id, encoding, ocr_text)
+SELECT id, 'none', convert_to(ocr_extracted_data->>'raw_text', 'UTF8')
+FROM receipt_images
+WHERE jsonb_typeof(ocr_extracted_data) = 'object'
+  AND ocr_extracted_data ? 'raw_text'
+ON CONFLICT (receipt_image_id) DO NOTHING;
+
+-- 抽出データから raw_text と extraction_details の raw_match を削除
+UPDATE receipt_images
+SET ocr_extracted_data = (ocr_extracted_data - 'raw_text') || CASE
+    WHEN jsonb_typeof(ocr_extracted_data->'extraction_details') = 'object' THEN jsonb_build_object(
+        'extraction_details', (
+            SELECT COALESCE(jsonb_object_agg(
+                field, CASE WHEN jsonb_typeof(detail) = 'object' THEN detail - 'raw_match' ELSE detail END
+            ), '{}'::jsonb)
+            FROM jsonb_each(ocr_extracted_data->'extraction_details') AS details(field, detail)
+        )
+    )
+    ELSE '{}'::jsonb
+END
+WHERE jsonb_typeof(ocr_extracted_data) = 'object'
+  AND (ocr_extracted_data ? 'raw_text' OR ocr_extracted_data ? 'extraction_details');
+
+-- 成功メッセージ
+DO $$
+BEGIN
+    RAISE NOTICE '✅ OCR結果の保存先変更のマイグレーション完了';
+END$$;
@@ -1,28 +1,50 @@
 # routes/receipt_scan.py - AI伝票スキャンAPIエンドポイント
 """
 伝票のAIスキャン機能を提供するAPIエンドポイント
-- 画像アップロード & OCR処理
+- 画像アップロード & OCR処理（ワーカーで非同期実行・結果はポーリング）
 - 抽出結果の確認・修正
 - 伝票作成・日報反映
+
+Base64デコード・画像ハッシュ・同期Sessionを使うため、エンドポイントは def で定義する
+（FastAPIがスレッドプールで実行し、処理中もイベントループは他のリクエストを処理できる）
+Base64画像を含むJSONボディの解析も _json_body でスレッドプールに移している
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Request, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 from datetime import datetime
 from typing import Optional
 import json
+import os
 
 from database_saas import (
-    get_db, ReceiptImage, Receipt, DailyReport, Employee, Store,
-    ProcessingStatus
+    get_db, unit_of_work, ReceiptImage, Receipt, DailyReport, Employee, Store,
+    SystemAdmin, ProcessingStatus
 )
 from schemas_saas import (
     ReceiptScanRequest, ReceiptScanResponse, ExtractedReceiptData,
+    ReceiptBatchScanRequest, ReceiptBatchScanResponse,
     ReceiptScanConfirmRequest, ReceiptScanConfirmResponse,
     ReceiptImageResponse
 )
-from auth_saas import get_current_employee
+from auth_saas import get_current_employee, require_super_admin
 from services.receipt_scanner import get_receipt_scanner
+from services.ocr_jobs import (
+    submit_ocr_job, submit_ocr_batch_job, get_ocr_job_pool, OcrJobQueueFull
+)
+from services.scan_cache import (
+    image_content_hash, find_cached_scan, copy_cached_scan, get_scan_cache_stats
+)
+from services.receipt_totals import receipts_added
+from services.ocr_payloads import load_ocr_text
+
+# アップロード画像の上限サイズ（スマートフォンの写真は 3〜8MB 程度）
+RECEIPT_MAX_UPLOAD_BYTES = int(os.getenv("RECEIPT_MAX_UPLOAD_BYTES", str(15 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
 router = APIRouter(
     prefix="/api/receipts",
@@ -30,86 +52,314 @@ router = APIRouter(
 )
 
 
-@router.post("/scan", response_model=ReceiptScanResponse)
-async def scan_receipt(
-    request: ReceiptScanRequest,
-    db: Session = Depends(get_db),
-    current_user: Employee = Depends(get_current_employee)
-):
+def _json_body(model):
     """
-    伝票画像をスキャンしてOCR処理を実行
-    
-    - 画像をBase64で受け取り
-    - Google Cloud Vision APIでOCR処理
-    - 金額・日付・顧客名などを自動抽出
-    - 画像をCloudinaryに保存
+    リクエストボディをスレッドプールで解析する依存関数
+    （Base64画像を含む数MBのJSONの解析で、イベントループを止めない）
     """
+    async def dependency(request: Request):
+        body = await request.body()
+        try:
+            return await run_in_threadpool(model.model_validate_json, body)
+        except ValidationError as e:
+            raise RequestValidationError(e.errors(include_url=False))
+    return dependency
+
+
+def _json_body_openapi(model) -> dict:
+    """_json_body を使うエンドポイントのリクエストボディ定義（OpenAPI用）"""
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": model.model_json_schema()}}
+        }
+    }
+
+
+def _scan_response(receipt_image: ReceiptImage, current_user: Employee) -> ReceiptScanResponse:
+    """スキャン画像の処理状況をレスポンスに変換"""
+    processing_status = receipt_image.processing_status or ProcessingStatus.PENDING
+    if processing_status == ProcessingStatus.FAILED:
+        return ReceiptScanResponse(
+            success=False,
+            receipt_image_id=receipt_image.id,
+            processing_status=processing_status.value,
+            error=receipt_image.error_message or '処理中にエラーが発生しました'
+        )
+    if processing_status != ProcessingStatus.COMPLETED:
+        return ReceiptScanResponse(
+            success=True,
+            receipt_image_id=receipt_image.id,
+            processing_status=processing_status.value
+        )
+    
+    # 抽出データを整形
+    extracted = receipt_image.ocr_extracted_data or {}
+    extracted_data = ExtractedReceiptData(
+        total_amount=extracted.get('total_amount'),
+        customer_name=extracted.get('customer_name'),
+        employee_name=extracted.get('employee_name') or current_user.name,
+        date=extracted.get('date'),
+        drink_count=extracted.get('drink_count'),
+        champagne_type=extracted.get('champagne_type'),
+        champagne_price=extracted.get('champagne_price'),
+        is_card=extracted.get('is_card')
+    )
+    return ReceiptScanResponse(
+        success=True,
+        receipt_image_id=receipt_image.id,
+        processing_status=processing_status.value,
+        image_url=receipt_image.image_url,
+        extracted_data=extracted_data,
+        confidence_score=receipt_image.confidence_score,
+        ocr_text=load_ocr_text(receipt_image.ocr_payload),
+        is_test_mode=extracted.get('is_test_mode', False)
+    )
+
+
+def _image_too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"画像サイズが上限（{max_bytes // (1024 * 1024)}MB）を超えています"
+    )
+
+
+def decode_image_base64(image_base64: str, max_bytes: int = RECEIPT_MAX_UPLOAD_BYTES) -> bytes:
+    """Base64の画像をデコード（読み込めなければ 400、上限を超えたら 413）"""
     try:
-        # スキャナーを取得
-        scanner = get_receipt_scanner()
-        
-        # OCR処理実行
-        result = scanner.scan_receipt(request.image_data)
-        
-        if not result.get('success'):
-            return ReceiptScanResponse(
-                success=False,
-                error=result.get('error', '処理中にエラーが発生しました'),
-                is_test_mode=result.get('is_test_mode', False)
-            )
-        
-        # 抽出データを整形
-        extracted = result.get('extracted_data', {})
-        extracted_data = ExtractedReceiptData(
-            total_amount=extracted.get('total_amount'),
-            customer_name=extracted.get('customer_name'),
-            employee_name=extracted.get('employee_name') or current_user.name,
-            date=extracted.get('date'),
-            drink_count=extracted.get('drink_count'),
-            champagne_type=extracted.get('champagne_type'),
-            champagne_price=extracted.get('champagne_price'),
-            is_card=extracted.get('is_card')
+        image_data = get_receipt_scanner().decode_image(image_base64)
+    except Exception:
+        image_data = b""
+    if not image_data:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="画像データを読み込めません"
         )
-        
-        # データベースに保存
-        receipt_image = ReceiptImage(
-            store_id=current_user.store_id,
-            employee_id=current_user.id,
-            daily_report_id=request.daily_report_id,
-            image_url=result.get('image_url', ''),
-            image_hash=result.get('image_hash'),
-            ocr_raw_response=result.get('ocr_text', ''),
-            ocr_extracted_data=json.dumps(extracted, ensure_ascii=False),
-            processing_status=ProcessingStatus.COMPLETED,
-            confidence_score=result.get('confidence_score', 0),
-            uploaded_at=datetime.utcnow(),
-            processed_at=datetime.utcnow()
+    if len(image_data) > max_bytes:
+        raise _image_too_large(max_bytes)
+    return image_data
+
+
+async def read_image_upload(file: UploadFile, max_bytes: int = RECEIPT_MAX_UPLOAD_BYTES) -> bytes:
+    """アップロードされた画像をチャンク単位で読み込む（上限を超えたら 413）"""
+    chunks = []
+    size = 0
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise _image_too_large(max_bytes)
+        chunks.append(chunk)
+    if not size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="画像データを読み込めません"
         )
-        
+    return b"".join(chunks)
+
+
+def _submit_scan(db: Session, current_user: Employee, image_data: bytes,
+                 daily_report_id: Optional[int], mime_type: Optional[str] = None) -> ReceiptScanResponse:
+    """デコード済みの画像をスキャン待ちとして登録し、OCRジョブを投入"""
+    # 同じ画像の再スキャンなら、アップロード・OCRを省略して処理済みの結果を使う
+    image_hash = image_content_hash(image_data)
+    cached = find_cached_scan(db, current_user.store_id, image_hash)
+    if cached is not None and cached.processing_status != ProcessingStatus.COMPLETED:
+        # 処理待ち・処理中の同じ画像（二重送信など）
+        return _scan_response(cached, current_user)
+    if cached is not None:
+        receipt_image = copy_cached_scan(cached, current_user.id, daily_report_id)
         db.add(receipt_image)
         db.commit()
         db.refresh(receipt_image)
-        
-        return ReceiptScanResponse(
-            success=True,
-            receipt_image_id=receipt_image.id,
-            image_url=result.get('image_url'),
-            extracted_data=extracted_data,
-            confidence_score=result.get('confidence_score'),
-            ocr_text=result.get('ocr_text'),
-            is_test_mode=result.get('is_test_mode', False)
+        return _scan_response(receipt_image, current_user)
+    
+    # データベースに保存（OCR完了まで image_url は空）
+    receipt_image = ReceiptImage(
+        store_id=current_user.store_id,
+        employee_id=current_user.id,
+        daily_report_id=daily_report_id,
+        image_url='',
+        image_hash=image_hash,
+        file_size=len(image_data),
+        mime_type=mime_type,
+        processing_status=ProcessingStatus.PENDING,
+        uploaded_at=datetime.utcnow()
+    )
+    db.add(receipt_image)
+    db.commit()
+    db.refresh(receipt_image)
+    
+    try:
+        submit_ocr_job(receipt_image.id, image_data)
+    except OcrJobQueueFull:
+        receipt_image.processing_status = ProcessingStatus.FAILED
+        receipt_image.error_message = "混み合っているため受け付けできませんでした"
+        db.commit()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="スキャン処理が混み合っています。しばらくしてから再度お試しください",
+            headers={"Retry-After": "5"}
         )
-        
-    except Exception as e:
-        print(f"❌ スキャンエラー: {e}")
-        return ReceiptScanResponse(
-            success=False,
-            error=str(e)
+    
+    return _scan_response(receipt_image, current_user)
+
+
+@router.post("/scan", response_model=ReceiptScanResponse, status_code=status.HTTP_202_ACCEPTED,
+             openapi_extra=_json_body_openapi(ReceiptScanRequest))
+def scan_receipt(
+    request: ReceiptScanRequest = Depends(_json_body(ReceiptScanRequest)),
+    db: Session = Depends(get_db),
+    current_user: Employee = Depends(get_current_employee)
+):
+    """
+    伝票画像のスキャンを受け付ける（202）
+    
+    - 画像をBase64で受け取り、PENDING のスキャン画像として保存
+    - 同じ店舗で同じ画像を処理済みなら、その結果を使って即完了
+    - OCR処理（Google Cloud Vision API・Cloudinary保存・データ抽出）はワーカーで実行
+    - 結果は GET /api/receipts/scan/{receipt_image_id} でポーリング
+    - デコード後の画像サイズは RECEIPT_MAX_UPLOAD_BYTES まで（超える場合は 413）
+    """
+    image_data = decode_image_base64(request.image_data)
+    
+    return _submit_scan(db, current_user, image_data, request.daily_report_id)
+
+
+@router.post("/scan/upload", response_model=ReceiptScanResponse, status_code=status.HTTP_202_ACCEPTED)
+async def scan_receipt_upload(
+    file: UploadFile = File(...),
+    daily_report_id: Optional[int] = Form(None),
+    db: Session = Depends(get_db),
+    current_user: Employee = Depends(get_current_employee)
+):
+    """
+    伝票画像のスキャンを受け付ける（multipart/form-data・202）
+    
+    - Base64 + JSON より送信量が約25%小さく、JSON解析・Base64デコードが不要
+    - 画像サイズは RECEIPT_MAX_UPLOAD_BYTES まで（超える場合は 413）
+    - 以降の処理は POST /api/receipts/scan と同じ
+    """
+    if file.content_type and not file.content_type.startswith("image/"):
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="画像ファイルを選択してください"
         )
+    image_data = await read_image_upload(file)
+    # ハッシュ計算・DB書き込みはスレッドプールで実行（イベントループを止めない）
+    return await run_in_threadpool(
+        _submit_scan, db, current_user, image_data, daily_report_id, file.content_type
+    )
+
+
+@router.post("/scan/batch", response_model=ReceiptBatchScanResponse, status_code=status.HTTP_202_ACCEPTED,
+             openapi_extra=_json_body_openapi(ReceiptBatchScanRequest))
+def scan_receipts_batch(
+    request: ReceiptBatchScanRequest = Depends(_json_body(ReceiptBatchScanRequest)),
+    db: Session = Depends(get_db),
+    current_user: Employee = Depends(get_current_employee)
+):
+    """
+    複数の伝票画像をまとめてスキャン（202）
+    
+    - 処理済みの画像は結果を再利用、それ以外は PENDING でまとめて保存
+    - 前処理・アップロードは並列、OCRは Vision のバッチAPIで1ジョブとして実行
+    - 読み込めない画像・RECEIPT_MAX_UPLOAD_BYTES を超える画像はその画像だけ失敗
+    - 結果は画像ごとに GET /api/receipts/scan/{receipt_image_id} でポーリング
+    """
+    results = [None] * len(request.images)
+    pending_rows, pending_images, pending_indexes = [], [], []
+    batch_hashes = {}
+    now = datetime.utcnow()
+    
+    for i, image_base64 in enumerate(request.images):
+        try:
+            image_data = decode_image_base64(image_base64)
+        except HTTPException as e:
+            results[i] = ReceiptScanResponse(success=False, error=e.detail)
+            continue
+        
+        image_hash = image_content_hash(image_data)
+        if image_hash in batch_hashes:
+            # 同じリクエスト内の同じ画像は1回だけ処理
+            batch_hashes[image_hash].append(i)
+            continue
+        batch_hashes[image_hash] = [i]
+        
+        cached = find_cached_scan(db, current_user.store_id, image_hash)
+        if cached is not None and cached.processing_status == ProcessingStatus.COMPLETED:
+            cached = copy_cached_scan(cached, current_user.id, request.daily_report_id)
+            db.add(cached)
+        if cached is not None:
+            results[i] = cached
+            continue
+        
+        pending_indexes.append(i)
+        pending_images.append(image_data)
+        pending_rows.append({
+            "store_id": current_user.store_id,
+            "employee_id": current_user.id,
+            "daily_report_id": request.daily_report_id,
+            "image_url": "",
+            "image_hash": image_hash,
+            "file_size": len(image_data),
+            "processing_status": ProcessingStatus.PENDING,
+            "uploaded_at": now,
+            "created_at": now,
+            "updated_at": now,
+        })
+    
+    cached_count = sum(1 for r in results if isinstance(r, ReceiptImage))
+    
+    # 処理待ちのスキャン画像は1回のINSERTでまとめて作成
+    pending_ids = []
+    if pending_rows:
+        receipt_images = db.scalars(insert(ReceiptImage).returning(ReceiptImage), pending_rows).all()
+        for i, receipt_image in zip(pending_indexes, receipt_images):
+            results[i] = receipt_image
+        pending_ids = [r.id for r in receipt_images]
+    db.flush()
+    
+    # 同じ画像の重複分は最初の画像と同じ結果を返す
+    for indexes in batch_hashes.values():
+        for i in indexes[1:]:
+            results[i] = results[indexes[0]]
+    
+    # コミット後の再読み込みを避けるため、レスポンスはコミット前に作成
+    responses = [
+        _scan_response(r, current_user) if isinstance(r, ReceiptImage) else r
+        for r in results
+    ]
+    db.commit()
+    
+    if pending_ids:
+        try:
+            submit_ocr_batch_job(pending_ids, pending_images)
+        except OcrJobQueueFull:
+            db.query(ReceiptImage).filter(ReceiptImage.id.in_(pending_ids)).update({
+                ReceiptImage.processing_status: ProcessingStatus.FAILED,
+                ReceiptImage.error_message: "混み合っているため受け付けできませんでした"
+            }, synchronize_session=False)
+            db.commit()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="スキャン処理が混み合っています。しばらくしてから再度お試しください",
+                headers={"Retry-After": "5"}
+            )
+    
+    return ReceiptBatchScanResponse(
+        success=True,
+        accepted_count=len(pending_rows),
+        cached_count=cached_count,
+        error_count=sum(1 for r in responses if not r.success),
+        results=responses
+    )
 
 
 @router.put("/scan/{receipt_image_id}/confirm", response_model=ReceiptScanConfirmResponse)
-async def confirm_scan_result(
+def confirm_scan_result(
     receipt_image_id: int,
     request: ReceiptScanConfirmRequest,
     db: Session = Depends(get_db),
@@ -135,6 +385,12 @@ async def confirm_scan_result(
                 detail="スキャン画像が見つかりません"
             )
         
+        if receipt_image.processing_status != ProcessingStatus.COMPLETED:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="スキャン処理が完了していません"
+            )
+        
         # 日報IDの確認（リクエストまたはスキャン時に設定されたもの）
         daily_report_id = request.daily_report_id or receipt_image.daily_report_id
         
@@ -174,17 +430,17 @@ async def confirm_scan_result(
             manual_corrections=json.dumps(request.manual_corrections or {}, ensure_ascii=False)
         )
         
-        db.add(receipt)
-        
-        # スキャン画像を確認済みに更新
-        receipt_image.is_verified = True
-        receipt_image.daily_report_id = daily_report_id
-        
-        db.commit()
-        db.refresh(receipt)
-        
-        # 日報の売上を更新
-        _update_daily_report_totals(db, daily_report)
+        # 伝票作成・画像更新・日報集計を1トランザクションで反映
+        with unit_of_work(db):
+            db.add(receipt)
+            
+            # スキャン画像を確認済みに更新
+            receipt_image.is_verified = True
+            receipt_image.daily_report_id = daily_report_id
+            db.flush()
+            
+            # 日報の売上へ差分反映
+            receipts_added(db, daily_report, [receipt])
         
         return ReceiptScanConfirmResponse(
             success=True,
@@ -205,7 +461,7 @@ async def confirm_scan_result(
 
 
 @router.get("/scan/history", response_model=list)
-async def get_scan_history(
+def get_scan_history(
     daily_report_id: Optional[int] = None,
     limit: int = 20,
     db: Session = Depends(get_db),
@@ -239,8 +495,45 @@ async def get_scan_history(
     ]
 
 
+@router.get("/scan/stats")
+async def get_scan_stats(
+    admin: SystemAdmin = Depends(require_super_admin)
+):
+    """
+    OCRジョブ・結果キャッシュの統計（プロセス起動からの累計）
+    """
+    pool = get_ocr_job_pool()
+    return {
+        "jobs": dict(pool.stats, queued=pool.pending_count(), queued_bytes=pool.queued_bytes()),
+        "cache": get_scan_cache_stats()
+    }
+
+
+@router.get("/scan/{receipt_image_id}", response_model=ReceiptScanResponse)
+def get_scan_result(
+    receipt_image_id: int,
+    db: Session = Depends(get_db),
+    current_user: Employee = Depends(get_current_employee)
+):
+    """
+    スキャンの処理状況・結果を取得（完了までポーリング）
+    """
+    receipt_image = db.query(ReceiptImage).filter(
+        ReceiptImage.id == receipt_image_id,
+        ReceiptImage.store_id == current_user.store_id
+    ).first()
+    
+    if not receipt_image:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="スキャン画像が見つかりません"
+        )
+    
+    return _scan_response(receipt_image, current_user)
+
+
 @router.delete("/scan/{receipt_image_id}")
-async def delete_scan(
+def delete_scan(
     receipt_image_id: int,
     db: Session = Depends(get_db),
     current_user: Employee = Depends(get_current_employee)
@@ -270,30 +563,3 @@ async def delete_scan(
     db.commit()
     
     return {"success": True, "message": "スキャン画像を削除しました"}
-
-
-def _update_daily_report_totals(db: Session, daily_report: DailyReport):
-    """
-    日報の合計値を更新
-    """
-    # 関連する伝票を取得
-    receipts = db.query(Receipt).filter(
-        Receipt.daily_report_id == daily_report.id
-    ).all()
-    
-    # 集計
-    total_sales = sum(r.amount for r in receipts)
-    card_sales = sum(r.amount for r in receipts if r.is_card)
-    drink_count = sum(r.drink_count for r in receipts)
-    champagne_price = sum(r.champagne_price for r in receipts)
-    champagne_types = [r.champagne_type for r in receipts if r.champagne_type]
-    
-    # 更新
-    daily_report.total_sales = total_sales
-    daily_report.card_sales = card_sales
-    daily_report.drink_count = drink_count
-    daily_report.champagne_price = champagne_price
-    daily_report.champagne_type = ", ".join(set(champagne_types))
-    
-    db.commit()
-
@@ -314,6 +314,15 @@ class DailyReportApproval(BaseModel):
     is_approved: bool
     approved_by_employee_id: int
 
+class DailyReportBulkApproval(BaseModel):
+    """日報一括承認（IDリスト、または期間・従業員の条件で指定）"""
+    is_approved: bool = True
+    approved_by_employee_id: int
+    report_ids: Optional[List[int]] = Field(None, min_length=1, max_length=1000)
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    employee_id: Optional[int] = None
+
 # ====== 伝票関連スキーマ（拡張版） ======
 
 class ReceiptCreate(BaseModel):
@@ -358,6 +367,16 @@ class ReceiptResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class BulkReceiptCreate(BaseModel):
+    # 行ごとのエラーを返すため、各行はエンドポイント側で ReceiptCreate として検証する
+    receipts: List[dict] = Field(..., min_length=1, max_length=200)
+
+class BulkReceiptResponse(BaseModel):
+    success_count: int
+    error_count: int
+    errors: List[dict]
+    created_receipts: List[ReceiptResponse]
+
 # ====== 監査ログ関連スキーマ ======
 
 class AuditLogCreate(BaseModel):
@@ -662,6 +681,19 @@ class ShiftResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class BulkShiftPublish(BaseModel):
+    """シフト一括公開用スキーマ（1ヶ月分など）"""
+    shifts: List[ShiftCreate] = Field(..., min_length=1, max_length=5000)
+    notify: bool = True  # 従業員ごとにまとめ通知を送る
+
+class BulkShiftPublishResponse(BaseModel):
+    """シフト一括公開レスポンス用スキーマ"""
+    success_count: int
+    error_count: int
+    errors: List[dict]
+    notified_employee_count: int
+    created_shifts: List[ShiftResponse]
+
 class ShiftRequestCreate(BaseModel):
     """シフト希望作成用スキーマ"""
     request_date: date
@@ -764,6 +796,7 @@ class ReceiptScanResponse(BaseModel):
     """伝票スキャンレスポンス"""
     success: bool
     receipt_image_id: Optional[int] = None
+    processing_status: Optional[str] = Field(None, description="pending / processing / completed / failed")
     image_url: Optional[str] = None
     extracted_data: Optional[ExtractedReceiptData] = None
     confidence_score: Optional[float] = None
@@ -775,6 +808,21 @@ class ReceiptScanResponse(BaseModel):
         from_attributes = True
 
 
+class ReceiptBatchScanRequest(BaseModel):
+    """伝票一括スキャンリクエスト"""
+    images: List[str] = Field(..., min_length=1, max_length=50, description="Base64エンコードされた画像データ")
+    daily_report_id: Optional[int] = Field(None, description="関連付ける日報ID")
+
+
+class ReceiptBatchScanResponse(BaseModel):
+    """伝票一括スキャンレスポンス（入力と同じ順序）"""
+    success: bool
+    accepted_count: int
+    cached_count: int
+    error_count: int
+    results: List[ReceiptScanResponse]
+
+
 class ReceiptScanConfirmRequest(BaseModel):
     """スキャン結果確認リクエスト"""
     confirmed_data: ExtractedReceiptData
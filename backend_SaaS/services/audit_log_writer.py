@@ -0,0 +1,171 @@
+# audit_log_writer.py - 監査ログの非同期一括書き込み
+"""
+監査ログをプロセス内キューに積み、バックグラウンドスレッドで複数行INSERTにまとめて書き込む
+- リクエスト側は enqueue のみ（監査ログのための追加コミットが不要）
+- キューは上限付き。満杯時は呼び出し元スレッドで即時書き込み（ログを捨てない）
+- アプリ終了時（shutdown / atexit）にキューを書き切る
+- AUDIT_LOG_MODE=sync で従来どおり呼び出し元セッションで即時コミット（耐久性優先）
+"""
+
+import os
+import time
+import queue
+import atexit
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from database_saas import engine, AuditLog, in_unit_of_work, after_commit
+
+
+# 書き込みモード: "async"（既定・一括書き込み） / "sync"（リクエスト内で即時コミット）
+AUDIT_LOG_MODE = os.getenv("AUDIT_LOG_MODE", "async").lower()
+# キューの上限件数
+AUDIT_LOG_QUEUE_MAX_SIZE = int(os.getenv("AUDIT_LOG_QUEUE_MAX_SIZE", "10000"))
+# 1回のINSERTにまとめる最大件数
+AUDIT_LOG_BATCH_SIZE = int(os.getenv("AUDIT_LOG_BATCH_SIZE", "500"))
+# 書き込み間隔（秒）: バッチが満たなくてもこの間隔で書き込む
+AUDIT_LOG_FLUSH_INTERVAL = float(os.getenv("AUDIT_LOG_FLUSH_INTERVAL", "1.0"))
+
+_STOP = object()
+
+
+class AuditLogWriter:
+    """監査ログのバッチ書き込みワーカー"""
+
+    def __init__(
+        self,
+        max_queue_size: int = AUDIT_LOG_QUEUE_MAX_SIZE,
+        batch_size: int = AUDIT_LOG_BATCH_SIZE,
+        flush_interval: float = AUDIT_LOG_FLUSH_INTERVAL
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.stats = {"written": 0, "failed": 0, "overflow": 0}
+
+    def start(self):
+        """ワーカースレッドを開始"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """キューを書き切ってから停止"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if not thread or not thread.is_alive():
+            # ワーカー未起動でも積まれた分は書き込む
+            self._write_batch(self._drain())
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def enqueue(self, record: Dict):
+        """監査ログ1件をキューに追加（満杯時は即時書き込み）"""
+        if not self._thread:
+            self.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.stats["overflow"] += 1
+            self._write_batch([record])
+
+    def _drain(self) -> List[Dict]:
+        records = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return records
+            if item is not _STOP:
+                records.append(item)
+
+    def _run(self):
+        batch: List[Dict] = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                batch.extend(self._drain())
+                self._write_batch(batch)
+                return
+            if item is not None:
+                batch.append(item)
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._write_batch(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write_batch(self, records: List[Dict]):
+        """複数行INSERTで一括書き込み（失敗時は1回だけ再試行）"""
+        for start in range(0, len(records), self.batch_size):
+            chunk = records[start:start + self.batch_size]
+            for attempt in range(2):
+                try:
+                    with engine.begin() as conn:
+                        conn.execute(insert(AuditLog.__table__), chunk)
+                    self.stats["written"] += len(chunk)
+                    break
+                except Exception as e:
+                    if attempt:
+                        self.stats["failed"] += len(chunk)
+                        print(f"❌ 監査ログ書き込みエラー（{len(chunk)}件）: {e}")
+
+
+# シングルトンインスタンス
+_writer_instance = None
+
+def get_audit_log_writer() -> AuditLogWriter:
+    """監査ログライターのシングルトンインスタンスを取得"""
+    global _writer_instance
+    if _writer_instance is None:
+        _writer_instance = AuditLogWriter()
+    return _writer_instance
+
+
+def write_audit_log(db: Session, record: Dict):
+    """
+    監査ログを記録（モードに応じてキュー投入または即時コミット）
+    unit_of_work 内では本体と同じトランザクションに含める（async はコミット成功後に投入）
+    """
+    if "created_at" not in record:
+        # 書き込み時刻ではなく発生時刻を記録
+        record["created_at"] = datetime.utcnow()
+
+    if AUDIT_LOG_MODE == "sync":
+        db.add(AuditLog(**record))
+        if not in_unit_of_work(db):
+            db.commit()
+        return
+    after_commit(db, lambda: get_audit_log_writer().enqueue(record))
+
+
+def start_audit_log_writer():
+    """起動時にワーカーを開始"""
+    if AUDIT_LOG_MODE != "sync":
+        get_audit_log_writer().start()
+        print(f"✅ 監査ログ非同期書き込み開始（バッチ{AUDIT_LOG_BATCH_SIZE}件 / {AUDIT_LOG_FLUSH_INTERVAL}秒）")
+
+
+def stop_audit_log_writer():
+    """終了時にキューを書き切る"""
+    if _writer_instance is not None:
+        _writer_instance.stop()
+
+
+atexit.register(stop_audit_log_writer)
@@ -0,0 +1,279 @@
+# daily_report_import.py - 日報CSV一括取り込み
+"""
+スプレッドシートからの移行用に、日報CSVを一括で取り込む
+- 列構成は /api/exports/daily-reports のCSVと同じ（エクスポート結果をそのまま取り込める）
+- CSVはチャンク単位でストリーム処理（ファイル全体をメモリに載せない）
+- 従業員名は店舗の従業員を1クエリで読み込んで解決
+- 重複（store_id, employee_id, report_date）はチャンクごとに1クエリで集合判定
+- 書き込みは PostgreSQL(psycopg2) では COPY、それ以外はチャンク単位の executemany
+- 取り込んだ月の目標進捗スナップショットは破棄し、次回アクセス時に再集計
+
+CLI:
+    python -m services.daily_report_import --store-id 1 reports.csv
+"""
+
+import io
+import os
+import csv
+import time
+from datetime import date, datetime
+from typing import Dict, List, Optional, TextIO
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from database_saas import DailyReport, Employee
+from services.goal_progress import discard_progress_snapshots
+
+
+# 1チャンクあたりの行数
+IMPORT_CHUNK_SIZE = int(os.getenv("DAILY_REPORT_IMPORT_CHUNK_SIZE", "1000"))
+# 取り込み速度の目標（行/秒）。下回った場合は警告を出す
+IMPORT_TARGET_ROWS_PER_SECOND = int(os.getenv("DAILY_REPORT_IMPORT_TARGET_RPS", "5000"))
+
+# エクスポートCSVの列 → 日報カラム（数値列）
+INTEGER_COLUMNS = {
+    "総売上": "total_sales",
+    "客数": "number_of_customers",
+    "ドリンク売上": "drink_sales",
+    "ドリンク数": "drink_count",
+    "シャンパン売上": "champagne_sales",
+    "キャッチ数": "catch_count",
+    "現金売上": "cash_sales",
+    "カード売上": "card_sales",
+}
+TEXT_COLUMNS = {
+    "勤務開始": "work_start_time",
+    "勤務終了": "work_end_time",
+}
+REQUIRED_COLUMNS = ("日付", "従業員名")
+
+# COPY で NULL を表す値（空文字列は executemany と同じく "" として書き込む）
+COPY_NULL = "\\N"
+
+# 書き込むカラム（COPYは SQLAlchemy のデフォルト値を使わないため全カラムを明示）
+LOAD_COLUMNS = [
+    "store_id", "employee_id", "report_date",
+    "work_start_time", "work_end_time", "work_hours",
+    "total_sales", "number_of_customers", "drink_sales", "drink_count",
+    "champagne_sales", "champagne_type", "champagne_price", "catch_count",
+    "alcohol_cost", "other_expenses", "break_minutes",
+    "cash_sales", "card_sales",
+    "is_approved", "approved_by_employee_id", "approved_at",
+    "created_at", "updated_at",
+]
+
+
+def _parse_int(value: str) -> int:
+    value = (value or "").replace(",", "").strip()
+    return int(float(value)) if value else 0
+
+
+def _parse_row(row: Dict[str, str]) -> dict:
+    """CSV1行を日報カラムの辞書に変換（不正な値は ValueError）"""
+    try:
+        report_date = date.fromisoformat((row.get("日付") or "").strip().replace("/", "-"))
+    except ValueError:
+        raise ValueError(f"日付が不正です: {row.get('日付')}")
+
+    values = {"report_date": report_date}
+    for header, column in INTEGER_COLUMNS.items():
+        try:
+            values[column] = _parse_int(row.get(header))
+        except ValueError:
+            raise ValueError(f"{header}が数値ではありません: {row.get(header)}")
+    for header, column in TEXT_COLUMNS.items():
+        values[column] = (row.get(header) or "").strip() or None
+    values["is_approved"] = (row.get("承認済み") or "").strip() in ("○", "true", "True", "1")
+    return values
+
+
+def _copy_value(value):
+    """COPY（CSV形式）の1項目"""
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+class DailyReportImporter:
+    """日報CSVの取り込み処理（1回の取り込みごとに生成）"""
+
+    def __init__(self, db: Session, store_id: int, imported_by_id: Optional[int] = None,
+                 chunk_size: int = IMPORT_CHUNK_SIZE):
+        self.db = db
+        self.store_id = store_id
+        self.imported_by_id = imported_by_id
+        self.chunk_size = chunk_size
+        self.use_copy = db.get_bind().dialect.driver == "psycopg2"
+
+        self.imported = 0
+        self.duplicates = 0
+        self.errors: List[dict] = []
+        self.months = set()
+        self._seen_keys = set()
+        self._employee_ids: Dict[str, Optional[int]] = {}
+
+    def _load_employees(self):
+        """店舗の従業員名 → ID（同名が複数いる場合は None）"""
+        for employee_id, name in self.db.query(Employee.id, Employee.name).filter(
+            Employee.store_id == self.store_id
+        ).all():
+            key = name.strip()
+            self._employee_ids[key] = None if key in self._employee_ids else employee_id
+
+    def _resolve(self, line: int, row: Dict[str, str]) -> Optional[dict]:
+        name = (row.get("従業員名") or "").strip()
+        if name not in self._employee_ids:
+            self.errors.append({"line": line, "error": f"従業員が見つかりません: {name}"})
+            return None
+        employee_id = self._employee_ids[name]
+        if employee_id is None:
+            self.errors.append({"line": line, "error": f"同名の従業員が複数います: {name}"})
+            return None
+        try:
+            values = _parse_row(row)
+        except ValueError as e:
+            self.errors.append({"line": line, "error": str(e)})
+            return None
+        values["employee_id"] = employee_id
+        return values
+
+    def _existing_keys(self, rows: List[dict]) -> set:
+        """チャンク内の (employee_id, report_date) のうち既に登録済みのものを1クエリで取得"""
+        employee_ids = {r["employee_id"] for r in rows}
+        dates = [r["report_date"] for r in rows]
+        return set(self.db.query(DailyReport.employee_id, DailyReport.report_date).filter(
+            DailyReport.store_id == self.store_id,
+            DailyReport.employee_id.in_(employee_ids),
+            DailyReport.report_date >= min(dates),
+            DailyReport.report_date <= max(dates)
+        ).all())
+
+    def _to_record(self, values: dict, now: datetime) -> dict:
+        approved = values["is_approved"]
+        record = {column: 0 for column in LOAD_COLUMNS}
+        record.update(values)
+        record.update({
+            "store_id": self.store_id,
+            "champagne_type": "",
+            "approved_by_employee_id": self.imported_by_id if approved else None,
+            "approved_at": now if approved else None,
+            "created_at": now,
+            "updated_at": now,
+        })
+        return record
+
+    def _copy(self, records: List[dict]):
+        """PostgreSQL COPY で書き込み（セッションと同じトランザクション）"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for record in records:
+            writer.writerow([_copy_value(record[c]) for c in LOAD_COLUMNS])
+        buffer.seek(0)
+        cursor = self.db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {DailyReport.__tablename__} ({', '.join(LOAD_COLUMNS)}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+                buffer
+            )
+        finally:
+            cursor.close()
+
+    def _load_chunk(self, chunk: List[tuple]):
+        rows = [(line, values) for line, values in chunk if values]
+        if not rows:
+            return
+        existing = self._existing_keys([v for _, v in rows])
+
+        now = datetime.utcnow()
+        records = []
+        for line, values in rows:
+            key = (values["employee_id"], values["report_date"])
+            if key in existing or key in self._seen_keys:
+                self.duplicates += 1
+                continue
+            self._seen_keys.add(key)
+            self.months.add((values["report_date"].year, values["report_date"].month))
+            records.append(self._to_record(values, now))
+
+        if not records:
+            return
+        if self.use_copy:
+            self._copy(records)
+        else:
+            self.db.execute(insert(DailyReport.__table__), records)
+        self.imported += len(records)
+
+    def run(self, stream: TextIO) -> dict:
+        """
+        CSVを取り込む（コミットは呼び出し側）
+        Returns: 取り込み件数・重複件数・行エラー・処理速度
+        """
+        started = time.perf_counter()
+        reader = csv.DictReader(stream)
+        missing = [c for c in REQUIRED_COLUMNS if c not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"CSVに必須の列がありません: {', '.join(missing)}")
+
+        self._load_employees()
+        chunk = []
+        for row in reader:
+            chunk.append((reader.line_num, self._resolve(reader.line_num, row)))
+            if len(chunk) >= self.chunk_size:
+                self._load_chunk(chunk)
+                chunk = []
+        self._load_chunk(chunk)
+
+        # 取り込んだ月のスナップショットは再集計させる
+        discard_progress_snapshots(self.db, self.store_id, self.months)
+
+        elapsed = time.perf_counter() - started
+        total_rows = self.imported + self.duplicates + len(self.errors)
+        rows_per_second = round(total_rows / elapsed) if elapsed > 0 else total_rows
+        if total_rows >= self.chunk_size and rows_per_second < IMPORT_TARGET_ROWS_PER_SECOND:
+            print(f"⚠️ 日報取り込み速度が目標を下回りました: {rows_per_second}行/秒（目標 {IMPORT_TARGET_ROWS_PER_SECOND}行/秒）")
+
+        return {
+            "imported_count": self.imported,
+            "duplicate_count": self.duplicates,
+            "error_count": len(self.errors),
+            "errors": self.errors[:100],
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": rows_per_second,
+            "method": "copy" if self.use_copy else "executemany",
+        }
+
+
+def import_daily_reports(db: Session, store_id: int, stream: TextIO,
+                         imported_by_id: Optional[int] = None,
+                         chunk_size: int = IMPORT_CHUNK_SIZE) -> dict:
+    """日報CSVを取り込む（コミットは呼び出し側）"""
+    return DailyReportImporter(db, store_id, imported_by_id, chunk_size).run(stream)
+
+
+if __name__ == "__main__":
+    import argparse
+    from database_saas import SessionLocal, unit_of_work
+
+    parser = argparse.ArgumentParser(description="日報CSV一括取り込み")
+    parser.add_argument("csv_path", help="エクスポート形式の日報CSV")
+    parser.add_argument("--store-id", type=int, required=True)
+    parser.add_argument("--imported-by", type=int, default=None, help="承認済み行の承認者として記録する従業員ID")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        with open(args.csv_path, encoding="utf-8-sig", newline="") as f:
+            with unit_of_work(db):
+                result = import_daily_reports(db, args.store_id, f, args.imported_by, args.chunk_size)
+    finally:
+        db.close()
+
+    print(f"✅ 取り込み完了: {result['imported_count']}件（重複スキップ {result['duplicate_count']}件 / "
+          f"エラー {result['error_count']}件）")
+    print(f"   {result['elapsed_seconds']}秒 / {result['rows_per_second']}行/秒 ({result['method']})")
+    for error in result["errors"]:
+        print(f"   ❌ {error['line']}行目: {error['error']}")
@@ -0,0 +1,405 @@
+# goal_progress.py - 目標進捗スナップショット
+"""
+個人目標・店舗目標の進捗を月単位のスナップショット行で管理
+- 日報の作成・更新時に UPDATE ... SET total = total + :delta で差分反映
+- スナップショット行が無い月は初回アクセス時に日報から集計して作成
+- 達成率・残り日数で必要な1日あたりのペースは行の値だけから計算（追加クエリなし）
+"""
+
+from calendar import monthrange
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database_saas import (
+    DailyReport, PersonalGoal, StoreGoal,
+    EmployeeGoalProgress, StoreGoalProgress
+)
+
+
+# 目標が未設定の場合のデフォルト値
+DEFAULT_PERSONAL_GOAL = {"sales_goal": 500000, "drinks_goal": 100, "catch_goal": 50}
+DEFAULT_STORE_GOAL = {"monthly_sales_goal": 3000000, "weekday_sales_goal": 100000, "weekend_sales_goal": 200000}
+
+# スナップショットに反映する日報カラム → 個人スナップショットカラム
+REPORT_METRICS = {
+    "total_sales": "total_sales",
+    "drink_count": "total_drinks",
+    "catch_count": "total_catch",
+    "number_of_customers": "total_customers",
+    "champagne_sales": "total_champagne",
+}
+
+
+def report_metrics(report: DailyReport) -> Dict[str, int]:
+    """日報からスナップショット対象の値を取り出す（差分計算用）"""
+    return {column: getattr(report, column) or 0 for column in REPORT_METRICS}
+
+
+def _is_weekend(day: date) -> bool:
+    return day.weekday() >= 5
+
+
+def _remaining_days(year: int, month: int, today: Optional[date] = None) -> List[date]:
+    """今日（含む）から月末までの日付一覧"""
+    today = today or date.today()
+    _, last_day = monthrange(year, month)
+    start = date(year, month, 1)
+    end = date(year, month, last_day)
+    if today > end:
+        return []
+    first = max(today, start)
+    return [date(year, month, d) for d in range(first.day, last_day + 1)]
+
+
+# ====== スナップショット作成 ======
+
+def _month_range(year: int, month: int):
+    _, last_day = monthrange(year, month)
+    return date(year, month, 1), date(year, month, last_day)
+
+
+def _insert_ignoring_conflict(db: Session, row):
+    try:
+        with db.begin_nested():
+            db.add(row)
+    except IntegrityError:
+        # 同時作成された場合は既存行を使う
+        pass
+
+
+def build_employee_progress(db: Session, employee_id: int, store_id: int, year: int, month: int) -> EmployeeGoalProgress:
+    """日報から集計して個人スナップショットを作成（コミットは呼び出し側）"""
+    db.flush()
+    start_date, end_date = _month_range(year, month)
+    totals = db.query(
+        func.coalesce(func.sum(DailyReport.total_sales), 0),
+        func.coalesce(func.sum(DailyReport.drink_count), 0),
+        func.coalesce(func.sum(DailyReport.catch_count), 0),
+        func.coalesce(func.sum(DailyReport.number_of_customers), 0),
+        func.coalesce(func.sum(DailyReport.champagne_sales), 0),
+        func.count(DailyReport.id)
+    ).filter(
+        DailyReport.employee_id == employee_id,
+        DailyReport.report_date >= start_date,
+        DailyReport.report_date <= end_date
+    ).one()
+
+    goal = db.query(
+        PersonalGoal.sales_goal, PersonalGoal.drinks_goal, PersonalGoal.catch_goal
+    ).filter(
+        PersonalGoal.employee_id == employee_id,
+        PersonalGoal.year == year,
+        PersonalGoal.month == month
+    ).first()
+    goals = dict(zip(DEFAULT_PERSONAL_GOAL, goal)) if goal else DEFAULT_PERSONAL_GOAL
+
+    row = EmployeeGoalProgress(
+        employee_id=employee_id, store_id=store_id, year=year, month=month,
+        total_sales=totals[0], total_drinks=totals[1], total_catch=totals[2],
+        total_customers=totals[3], total_champagne=totals[4], work_days=totals[5],
+        **goals
+    )
+    _insert_ignoring_conflict(db, row)
+    return row
+
+
+def build_store_progress(db: Session, store_id: int, year: int, month: int) -> StoreGoalProgress:
+    """日報から集計して店舗スナップショットを作成（コミットは呼び出し側）"""
+    db.flush()
+    start_date, end_date = _month_range(year, month)
+    daily_totals = db.query(
+        DailyReport.report_date, func.coalesce(func.sum(DailyReport.total_sales), 0)
+    ).filter(
+        DailyReport.store_id == store_id,
+        DailyReport.report_date >= start_date,
+        DailyReport.report_date <= end_date
+    ).group_by(DailyReport.report_date).all()
+
+    goal = db.query(
+        StoreGoal.monthly_sales_goal, StoreGoal.weekday_sales_goal, StoreGoal.weekend_sales_goal
+    ).filter(
+        StoreGoal.store_id == store_id,
+        StoreGoal.year == year,
+        StoreGoal.month == month
+    ).first()
+    goals = dict(zip(DEFAULT_STORE_GOAL, goal)) if goal else DEFAULT_STORE_GOAL
+
+    row = StoreGoalProgress(store_id=store_id, year=year, month=month, **goals)
+    row.total_sales = row.weekday_sales = row.weekend_sales = 0
+    row.weekday_days = row.weekend_days = 0
+    for report_date, sales in daily_totals:
+        row.total_sales += sales
+        if _is_weekend(report_date):
+            row.weekend_sales += sales
+            row.weekend_days += 1
+        else:
+            row.weekday_sales += sales
+            row.weekday_days += 1
+    _insert_ignoring_conflict(db, row)
+    return row
+
+
+def get_employee_progress(db: Session, employee_id: int, store_id: int, year: int, month: int) -> EmployeeGoalProgress:
+    """個人スナップショットを取得（無ければ作成してコミット）"""
+    row = db.query(EmployeeGoalProgress).filter(
+        EmployeeGoalProgress.employee_id == employee_id,
+        EmployeeGoalProgress.year == year,
+        EmployeeGoalProgress.month == month
+    ).first()
+    if row:
+        return row
+    row = build_employee_progress(db, employee_id, store_id, year, month)
+    db.commit()
+    return row
+
+
+def get_store_progress(db: Session, store_id: int, year: int, month: int) -> StoreGoalProgress:
+    """店舗スナップショットを取得（無ければ作成してコミット）"""
+    row = db.query(StoreGoalProgress).filter(
+        StoreGoalProgress.store_id == store_id,
+        StoreGoalProgress.year == year,
+        StoreGoalProgress.month == month
+    ).first()
+    if row:
+        return row
+    row = build_store_progress(db, store_id, year, month)
+    db.commit()
+    return row
+
+
+def get_store_employee_progress(db: Session, store_id: int, employee_ids: Iterable[int], year: int, month: int) -> Dict[int, EmployeeGoalProgress]:
+    """店舗の従業員スナップショットをまとめて取得（ランキング用、無い分は作成）"""
+    employee_ids = set(employee_ids)
+    rows = {
+        row.employee_id: row
+        for row in db.query(EmployeeGoalProgress).filter(
+            EmployeeGoalProgress.employee_id.in_(employee_ids),
+            EmployeeGoalProgress.year == year,
+            EmployeeGoalProgress.month == month
+        ).all()
+    } if employee_ids else {}
+
+    missing = employee_ids - rows.keys()
+    for employee_id in missing:
+        rows[employee_id] = build_employee_progress(db, employee_id, store_id, year, month)
+    if missing:
+        db.commit()
+    return rows
+
+
+# ====== 差分反映 ======
+
+def _apply_employee_delta(db: Session, report: DailyReport, deltas: Dict[str, int], day_delta: int):
+    values = {
+        getattr(EmployeeGoalProgress, REPORT_METRICS[column]): getattr(EmployeeGoalProgress, REPORT_METRICS[column]) + delta
+        for column, delta in deltas.items() if delta
+    }
+    if day_delta:
+        values[EmployeeGoalProgress.work_days] = EmployeeGoalProgress.work_days + day_delta
+
+    year, month = report.report_date.year, report.report_date.month
+    query = db.query(EmployeeGoalProgress).filter(
+        EmployeeGoalProgress.employee_id == report.employee_id,
+        EmployeeGoalProgress.year == year,
+        EmployeeGoalProgress.month == month
+    )
+    if values:
+        updated = query.update(values, synchronize_session=False)
+    else:
+        updated = query.count()
+    if not updated:
+        # スナップショットが無い月は日報から作成（flush済みの日報も含めて集計）
+        build_employee_progress(db, report.employee_id, report.store_id, year, month)
+
+
+def _apply_store_delta(db: Session, report: DailyReport, sales_delta: int, day_delta: int):
+    weekend = _is_weekend(report.report_date)
+    sales_column = StoreGoalProgress.weekend_sales if weekend else StoreGoalProgress.weekday_sales
+    days_column = StoreGoalProgress.weekend_days if weekend else StoreGoalProgress.weekday_days
+
+    values = {}
+    if sales_delta:
+        values[StoreGoalProgress.total_sales] = StoreGoalProgress.total_sales + sales_delta
+        values[sales_column] = sales_column + sales_delta
+    if day_delta:
+        values[days_column] = days_column + day_delta
+
+    year, month = report.report_date.year, report.report_date.month
+    query = db.query(StoreGoalProgress).filter(
+        StoreGoalProgress.store_id == report.store_id,
+        StoreGoalProgress.year == year,
+        StoreGoalProgress.month == month
+    )
+    if values:
+        updated = query.update(values, synchronize_session=False)
+    else:
+        updated = query.count()
+    if not updated:
+        build_store_progress(db, report.store_id, year, month)
+
+
+def record_daily_report_created(db: Session, report: DailyReport):
+    """日報作成をスナップショットへ反映（日報と同じトランザクションで呼ぶ）"""
+    db.flush()
+    metrics = report_metrics(report)
+    _apply_employee_delta(db, report, metrics, 1)
+
+    # 同じ日に他の日報があれば店舗の営業日数は増やさない
+    other_report = db.query(DailyReport.id).filter(
+        DailyReport.store_id == report.store_id,
+        DailyReport.report_date == report.report_date,
+        DailyReport.id != report.id
+    ).first()
+    _apply_store_delta(db, report, metrics["total_sales"], 0 if other_report else 1)
+
+
+def record_daily_report_changed(db: Session, report: DailyReport, before: Dict[str, int]):
+    """日報の数値変更をスナップショットへ反映（before は変更前の report_metrics）"""
+    db.flush()
+    after = report_metrics(report)
+    record_daily_report_deltas(
+        db, report, {column: after[column] - before.get(column, 0) for column in REPORT_METRICS}
+    )
+
+
+def record_daily_report_deltas(db: Session, report: DailyReport, deltas: Dict[str, int]):
+    """日報の数値の増減をスナップショットへ反映（deltas は日報カラム → 増減。日報側は反映済みであること）"""
+    deltas = {column: deltas.get(column, 0) for column in REPORT_METRICS}
+    if not any(deltas.values()):
+        return
+    _apply_employee_delta(db, report, deltas, 0)
+    _apply_store_delta(db, report, deltas["total_sales"], 0)
+
+
+def discard_progress_snapshots(db: Session, store_id: int, months: Iterable[tuple]):
+    """
+    一括取り込みなどで日報をまとめて書き込んだ月のスナップショットを破棄
+    次回アクセス時に日報から再集計される
+    """
+    for year, month in set(months):
+        db.query(EmployeeGoalProgress).filter(
+            EmployeeGoalProgress.store_id == store_id,
+            EmployeeGoalProgress.year == year,
+            EmployeeGoalProgress.month == month
+        ).delete(synchronize_session=False)
+        db.query(StoreGoalProgress).filter(
+            StoreGoalProgress.store_id == store_id,
+            StoreGoalProgress.year == year,
+            StoreGoalProgress.month == month
+        ).delete(synchronize_session=False)
+
+
+def update_personal_goal_snapshot(db: Session, goal: PersonalGoal):
+    """個人目標の変更をスナップショットへ反映"""
+    db.query(EmployeeGoalProgress).filter(
+        EmployeeGoalProgress.employee_id == goal.employee_id,
+        EmployeeGoalProgress.year == goal.year,
+        EmployeeGoalProgress.month == goal.month
+    ).update({
+        EmployeeGoalProgress.sales_goal: goal.sales_goal,
+        EmployeeGoalProgress.drinks_goal: goal.drinks_goal,
+        EmployeeGoalProgress.catch_goal: goal.catch_goal,
+    }, synchronize_session=False)
+
+
+def update_store_goal_snapshot(db: Session, goal: StoreGoal):
+    """店舗目標の変更をスナップショットへ反映"""
+    db.query(StoreGoalProgress).filter(
+        StoreGoalProgress.store_id == goal.store_id,
+        StoreGoalProgress.year == goal.year,
+        StoreGoalProgress.month == goal.month
+    ).update({
+        StoreGoalProgress.monthly_sales_goal: goal.monthly_sales_goal,
+        StoreGoalProgress.weekday_sales_goal: goal.weekday_sales_goal,
+        StoreGoalProgress.weekend_sales_goal: goal.weekend_sales_goal,
+    }, synchronize_session=False)
+
+
+# ====== レスポンス整形 ======
+
+def _rate(actual: int, goal: int) -> float:
+    return round(actual / goal * 100, 1) if goal and goal > 0 else 0
+
+
+def _pace(actual: int, goal: int, remaining_days: int) -> int:
+    if remaining_days <= 0:
+        return 0
+    return max(goal - actual, 0) // remaining_days
+
+
+def employee_progress_to_dict(row: EmployeeGoalProgress, today: Optional[date] = None) -> dict:
+    """個人スナップショットをレスポンス形式に変換"""
+    remaining = len(_remaining_days(row.year, row.month, today))
+    return {
+        "year": row.year,
+        "month": row.month,
+        "goals": {
+            "sales_goal": row.sales_goal,
+            "drinks_goal": row.drinks_goal,
+            "catch_goal": row.catch_goal
+        },
+        "actual": {
+            "total_sales": row.total_sales,
+            "total_drinks": row.total_drinks,
+            "total_catch": row.total_catch,
+            "total_customers": row.total_customers,
+            "total_champagne": row.total_champagne,
+            "work_days": row.work_days
+        },
+        "achievement_rate": {
+            "sales": _rate(row.total_sales, row.sales_goal),
+            "drinks": _rate(row.total_drinks, row.drinks_goal),
+            "catch": _rate(row.total_catch, row.catch_goal)
+        },
+        "remaining_days": remaining,
+        "required_daily_pace": {
+            "sales": _pace(row.total_sales, row.sales_goal, remaining),
+            "drinks": _pace(row.total_drinks, row.drinks_goal, remaining),
+            "catch": _pace(row.total_catch, row.catch_goal, remaining)
+        },
+        "updated_at": row.updated_at.isoformat() if row.updated_at else None
+    }
+
+
+def store_progress_to_dict(row: StoreGoalProgress, today: Optional[date] = None) -> dict:
+    """店舗スナップショットをレスポンス形式に変換"""
+    remaining_days = _remaining_days(row.year, row.month, today)
+    remaining_weekend = sum(1 for d in remaining_days if _is_weekend(d))
+    remaining_weekday = len(remaining_days) - remaining_weekend
+    projected_sales = (
+        row.total_sales
+        + remaining_weekday * (row.weekday_sales_goal or 0)
+        + remaining_weekend * (row.weekend_sales_goal or 0)
+    )
+    return {
+        "store_id": row.store_id,
+        "year": row.year,
+        "month": row.month,
+        "goals": {
+            "monthly_sales_goal": row.monthly_sales_goal,
+            "weekday_sales_goal": row.weekday_sales_goal,
+            "weekend_sales_goal": row.weekend_sales_goal
+        },
+        "actual": {
+            "total_sales": row.total_sales,
+            "weekday_sales": row.weekday_sales,
+            "weekend_sales": row.weekend_sales,
+            "weekday_days": row.weekday_days,
+            "weekend_days": row.weekend_days
+        },
+        "achievement_rate": {
+            "monthly": _rate(row.total_sales, row.monthly_sales_goal),
+            "weekday": _rate(row.weekday_sales, (row.weekday_sales_goal or 0) * row.weekday_days),
+            "weekend": _rate(row.weekend_sales, (row.weekend_sales_goal or 0) * row.weekend_days)
+        },
+        "remaining_days": len(remaining_days),
+        "remaining_weekdays": remaining_weekday,
+        "remaining_weekend_days": remaining_weekend,
+        "required_daily_pace": _pace(row.total_sales, row.monthly_sales_goal, len(remaining_days)),
+        "projected_sales": projected_sales,
+        "updated_at": row.updated_at.isoformat() if row.updated_at else None
+    }
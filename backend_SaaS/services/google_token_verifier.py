@@ -0,0 +1,181 @@
+# google_token_verifier.py - Google IDトークン検証サービス
+"""
+Google OAuthのIDトークン検証
+- Googleの公開証明書をCache-Controlのmax-ageに従ってキャッシュ（全リクエストで共有）
+- 検証済みトークンのハッシュを短時間メモ化し、同一トークンの再検証を省略
+- 証明書取得処理（fetcher）は差し替え可能（テストではローカルの鍵セットを使用）
+"""
+
+import re
+import time
+import hashlib
+import threading
+from typing import Optional, Dict, Any, Callable
+
+# Google認証ライブラリ
+try:
+    from google.oauth2 import id_token
+    from google.auth.transport import requests as google_requests
+    GOOGLE_AUTH_AVAILABLE = True
+except ImportError:
+    GOOGLE_AUTH_AVAILABLE = False
+    print("⚠️ google-auth未インストール: pip install google-auth")
+
+
+# 証明書キャッシュ設定
+DEFAULT_CERTS_MAX_AGE = 3600  # Cache-Controlが無い場合の保持秒数
+# 検証済みトークンのメモ設定
+VERIFIED_TOKEN_MEMO_TTL = 120  # 2分
+VERIFIED_TOKEN_MEMO_MAX_SIZE = 1000
+
+_MAX_AGE_PATTERN = re.compile(r'max-age\s*=\s*(\d+)', re.IGNORECASE)
+
+
+class _CachedResponse:
+    """キャッシュ済みレスポンス（google.auth.transport.Response互換）"""
+
+    def __init__(self, status: int, headers: Dict[str, str], data: bytes):
+        self.status = status
+        self.headers = headers
+        self.data = data
+
+
+class CachingCertRequest:
+    """
+    証明書取得用のキャッシュ付きトランスポート
+    google.auth.transport.Request と同じ呼び出し形式で使用できる
+    """
+
+    def __init__(self, fetcher: Optional[Callable] = None):
+        self._fetcher = fetcher
+        self._cache: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def _get_fetcher(self) -> Callable:
+        if self._fetcher is None:
+            if not GOOGLE_AUTH_AVAILABLE:
+                raise ValueError("google-authがインストールされていません")
+            # requests.Sessionを共有してコネクションを再利用
+            self._fetcher = google_requests.Request()
+        return self._fetcher
+
+    @staticmethod
+    def _parse_max_age(headers: Dict[str, str]) -> int:
+        """Cache-Controlヘッダーからmax-ageを取得"""
+        cache_control = ""
+        for name, value in (headers or {}).items():
+            if name.lower() == "cache-control":
+                cache_control = value
+                break
+        if "no-store" in cache_control or "no-cache" in cache_control:
+            return 0
+        match = _MAX_AGE_PATTERN.search(cache_control)
+        return int(match.group(1)) if match else DEFAULT_CERTS_MAX_AGE
+
+    def __call__(self, url, method="GET", body=None, headers=None, timeout=None, **kwargs):
+        fetcher = self._get_fetcher()
+        if method != "GET":
+            return fetcher(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(url)
+            if entry and entry[0] > now:
+                return entry[1]
+
+        response = fetcher(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
+
+        if response.status == 200:
+            max_age = self._parse_max_age(dict(response.headers or {}))
+            if max_age > 0:
+                cached = _CachedResponse(response.status, dict(response.headers or {}), response.data)
+                with self._lock:
+                    self._cache[url] = (now + max_age, cached)
+                return cached
+        return response
+
+    def clear(self):
+        """キャッシュを破棄"""
+        with self._lock:
+            self._cache.clear()
+
+
+class GoogleTokenVerifier:
+    """
+    Google IDトークン検証サービス
+    - 証明書はCachingCertRequest経由で取得（max-age期間は再取得しない）
+    - 検証済みトークンはSHA-256ハッシュで短時間メモ化
+    """
+
+    def __init__(self, fetcher: Optional[Callable] = None, memo_ttl: int = VERIFIED_TOKEN_MEMO_TTL):
+        self.cert_request = CachingCertRequest(fetcher)
+        self.memo_ttl = memo_ttl
+        self._memo: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def _get_memo(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._memo.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            self._memo.pop(key, None)
+        return None
+
+    def _set_memo(self, key: str, idinfo: Dict[str, Any]):
+        now = time.monotonic()
+        ttl = self.memo_ttl
+        # トークン自体の有効期限を超えてメモしない
+        exp = idinfo.get('exp')
+        if exp:
+            ttl = min(ttl, int(exp) - int(time.time()))
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            if len(self._memo) >= VERIFIED_TOKEN_MEMO_MAX_SIZE:
+                expired = [k for k, (expires_at, _) in self._memo.items() if expires_at <= now]
+                for k in expired:
+                    del self._memo[k]
+                if len(self._memo) >= VERIFIED_TOKEN_MEMO_MAX_SIZE:
+                    self._memo.clear()
+            self._memo[key] = (now + ttl, idinfo)
+
+    def verify(self, token: str, audience: str) -> Dict[str, Any]:
+        """
+        IDトークンを検証してクレームを返す
+        検証失敗時は id_token.verify_oauth2_token と同様に ValueError を送出
+        """
+        key = hashlib.sha256(f"{audience}:{token}".encode("utf-8")).hexdigest()
+        idinfo = self._get_memo(key)
+        if idinfo is not None:
+            return idinfo
+
+        if not GOOGLE_AUTH_AVAILABLE:
+            raise ValueError("google-authがインストールされていません")
+
+        idinfo = id_token.verify_oauth2_token(token, self.cert_request, audience)
+        self._set_memo(key, idinfo)
+        return idinfo
+
+    def clear(self):
+        """証明書キャッシュとメモを破棄"""
+        self.cert_request.clear()
+        with self._lock:
+            self._memo.clear()
+
+
+# シングルトンインスタンス
+_verifier_instance = None
+
+def get_google_token_verifier() -> GoogleTokenVerifier:
+    """トークン検証サービスのシングルトンインスタンスを取得"""
+    global _verifier_instance
+    if _verifier_instance is None:
+        _verifier_instance = GoogleTokenVerifier()
+    return _verifier_instance
+
+
+def set_google_token_verifier(verifier: GoogleTokenVerifier):
+    """トークン検証サービスを差し替え（テスト用の証明書fetcherを注入する場合など）"""
+    global _verifier_instance
+    _verifier_instance = verifier
@@ -0,0 +1,263 @@
+# idempotency.py - Idempotency-Key による再送リクエストの重複処理防止
+"""
+書き込み系リクエスト（POST / PUT / PATCH / DELETE）の Idempotency-Key ヘッダーに対応
+- 同じキーの再送には保存済みのレスポンスをそのまま返す（OCR・伝票作成などを再実行しない）
+- キーは認証情報（Authorizationヘッダー）ごとに区別し、ハッシュ化して idempotency_keys に保存
+- 同じキーで内容の異なるリクエストは 422、処理中の重複は 409
+  multipart/form-data は送信ごとに変わる boundary を除いて比較する
+- キー付きのリクエストはボディを読み込むため、IDEMPOTENCY_MAX_REQUEST_BYTES を超えるものは 413
+- 5xx や success: false のレスポンスは保存しない（同じキーで再試行できる）
+- 保存期間は IDEMPOTENCY_KEY_TTL 秒。期限切れの行は定期ジョブで削除
+"""
+
+import os
+import json
+import hashlib
+from datetime import datetime, timedelta
+from typing import Optional
+
+from anyio import to_thread
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database_saas import SessionLocal, IdempotencyKey
+
+
+# 保存済みレスポンスの保持秒数
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", "86400"))
+# 期限切れキーの削除間隔（秒）
+IDEMPOTENCY_CLEANUP_INTERVAL = int(os.getenv("IDEMPOTENCY_CLEANUP_INTERVAL", "3600"))
+# 処理中のまま残ったキー（プロセス停止など）を破棄するまでの秒数
+IDEMPOTENCY_LOCK_TIMEOUT = 300
+# 保存するレスポンスボディの上限（これを超えるレスポンスは保存しない）
+IDEMPOTENCY_MAX_BODY_BYTES = 256 * 1024
+# Idempotency-Key 付きリクエストのボディの上限（比較・再生のためメモリに読み込むため）
+IDEMPOTENCY_MAX_REQUEST_BYTES = int(os.getenv("IDEMPOTENCY_MAX_REQUEST_BYTES", str(64 * 1024 * 1024)))
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+def _json_response(status_code: int, body: dict) -> tuple:
+    return status_code, "application/json", json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+
+def _multipart_boundary(content_type: bytes) -> Optional[bytes]:
+    """multipart の Content-Type から boundary を取り出す"""
+    media_type, _, params = content_type.partition(b";")
+    if not media_type.strip().lower().startswith(b"multipart/"):
+        return None
+    for param in params.split(b";"):
+        name, _, value = param.strip().partition(b"=")
+        if name.lower() == b"boundary" and value:
+            return value.strip(b'"')
+    return None
+
+
+def _request_hash(scope, content_type: Optional[bytes], body: bytes) -> str:
+    """
+    同じ内容のリクエストかを判定するハッシュ
+    multipart は boundary（クライアントが送信ごとに生成）を除いて各パートの内容で比較する
+    """
+    boundary = _multipart_boundary(content_type) if content_type else None
+    if boundary:
+        body = body.replace(b"--" + boundary, b"--")
+    return hashlib.sha256(
+        scope["method"].encode() + b" " + scope["path"].encode() + b"?"
+        + scope.get("query_string", b"") + b"\n" + body
+    ).hexdigest()
+
+
+# ====== DB操作（ワーカースレッドで実行） ======
+
+def _begin(key_hash: str, request_hash: str) -> Optional[tuple]:
+    """
+    キーを確保する
+    Returns: 保存済み/エラーのレスポンス (status, content_type, body)。処理を進めてよい場合は None
+    """
+    db: Session = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        row = db.query(IdempotencyKey).filter(IdempotencyKey.key_hash == key_hash).first()
+        abandoned = row and row.status_code is None and \
+            row.created_at <= now - timedelta(seconds=IDEMPOTENCY_LOCK_TIMEOUT)
+        if row and (row.expires_at <= now or abandoned):
+            db.delete(row)
+            db.flush()
+            row = None
+
+        if row is None:
+            db.add(IdempotencyKey(
+                key_hash=key_hash,
+                request_hash=request_hash,
+                created_at=now,
+                expires_at=now + timedelta(seconds=IDEMPOTENCY_KEY_TTL)
+            ))
+            try:
+                db.commit()
+                return None
+            except IntegrityError:
+                # 同時に同じキーで処理が始まった
+                db.rollback()
+                return _json_response(409, {"detail": "同じIdempotency-Keyのリクエストを処理中です"})
+
+        if row.request_hash != request_hash:
+            return _json_response(422, {"detail": "Idempotency-Keyが別のリクエストで使用されています"})
+        if row.status_code is None:
+            return _json_response(409, {"detail": "同じIdempotency-Keyのリクエストを処理中です"})
+        return row.status_code, row.content_type, (row.response_body or "").encode("utf-8")
+    finally:
+        db.close()
+
+
+def _finish(key_hash: str, status_code: int, content_type: Optional[str], body: Optional[str]):
+    """レスポンスを保存（body が None の場合はキーを解放して再試行可能にする）"""
+    db: Session = SessionLocal()
+    try:
+        query = db.query(IdempotencyKey).filter(IdempotencyKey.key_hash == key_hash)
+        if body is None:
+            query.delete(synchronize_session=False)
+        else:
+            query.update({
+                IdempotencyKey.status_code: status_code,
+                IdempotencyKey.content_type: content_type,
+                IdempotencyKey.response_body: body,
+            }, synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Idempotency-Key保存エラー: {e}")
+    finally:
+        db.close()
+
+
+def purge_expired_idempotency_keys(db: Session) -> int:
+    """期限切れのキーを削除（定期ジョブ）"""
+    deleted = db.query(IdempotencyKey).filter(
+        IdempotencyKey.expires_at <= datetime.utcnow()
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+def _should_store(status_code: int, content_type: Optional[str], body: bytes) -> bool:
+    if status_code >= 500 or status_code in (409, 429):
+        return False
+    if len(body) > IDEMPOTENCY_MAX_BODY_BYTES:
+        return False
+    if content_type and content_type.startswith("application/json") and b'"success":false' in body.replace(b" ", b""):
+        # 伝票スキャンなど success: false を200で返すAPIは再試行できるようにする
+        return False
+    return True
+
+
+# ====== ミドルウェア ======
+
+class IdempotencyMiddleware:
+    """
+    Idempotency-Key ヘッダー付きの書き込みリクエストを処理するASGIミドルウェア
+    （リクエストボディを読み直せるよう BaseHTTPMiddleware ではなく素のASGIで実装）
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in MUTATING_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        idempotency_key = headers.get(IDEMPOTENCY_HEADER)
+        authorization = headers.get(b"authorization")
+        if not idempotency_key or not authorization:
+            # 未認証のリクエストはキーの持ち主を区別できないため対象外
+            await self.app(scope, receive, send)
+            return
+
+        # リクエストボディを読み込んで、後段のアプリ用に再生できるようにする（上限を超えたら 413）
+        too_large = _json_response(413, {"detail": "Idempotency-Key付きのリクエストが大きすぎます"})
+        try:
+            content_length = int(headers.get(b"content-length", b"0"))
+        except ValueError:
+            content_length = 0
+        if content_length > IDEMPOTENCY_MAX_REQUEST_BYTES:
+            await self._send_response(send, *too_large)
+            return
+
+        chunks = []
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > IDEMPOTENCY_MAX_REQUEST_BYTES:
+                await self._send_response(send, *too_large)
+                return
+            chunks.append(chunk)
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+
+        key_hash = hashlib.sha256(authorization + b"\n" + idempotency_key).hexdigest()
+        request_hash = _request_hash(scope, headers.get(b"content-type"), body)
+
+        stored = await to_thread.run_sync(_begin, key_hash, request_hash)
+        if stored is not None:
+            await self._send_response(send, *stored, replayed=True)
+            return
+
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        response = {"status": 500, "content_type": None, "body": []}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                for name, value in message.get("headers", []):
+                    if name.lower() == b"content-type":
+                        response["content_type"] = value.decode("latin-1")
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        finally:
+            response_body = b"".join(response["body"])
+            stored_body = None
+            if _should_store(response["status"], response["content_type"], response_body):
+                try:
+                    stored_body = response_body.decode("utf-8")
+                except UnicodeDecodeError:
+                    stored_body = None
+            await to_thread.run_sync(
+                _finish, key_hash, response["status"], response["content_type"], stored_body
+            )
+
+    @staticmethod
+    async def _send_response(send, status_code: int, content_type: Optional[str], body: bytes,
+                             replayed: bool = False):
+        headers = [
+            (b"content-type", (content_type or "application/json").encode()),
+            (b"content-length", str(len(body)).encode()),
+        ]
+        if replayed:
+            headers.append((b"idempotent-replayed", b"true"))
+        await send({"type": "http.response.start", "status": status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+if __name__ == "__main__":
+    from services.periodic_jobs import run_job_once
+
+    print(f"期限切れのIdempotency-Keyを削除しました: {run_job_once(purge_expired_idempotency_keys)}件")
@@ -0,0 +1,137 @@
+# image_preprocessing.py - 伝票画像の前処理（プロセスプール）
+"""
+OCR前の伝票画像の前処理（縮小・シャープネス・コントラスト・明度調整・JPEG再エンコード）
+- CPUバウンドで GIL を長く保持するため、OCRワーカースレッドではなくプロセスプールで実行
+  （同時に投入されるのは OCRワーカー・スキャン用スレッドの数まで）
+- JPEG は draft() でデコード時に 1/2〜1/8 へ縮小し、フル解像度での展開を避ける
+- コントラスト・明度は1つの LUT（point）に、シャープネスは1回の畳み込みにまとめる
+  （ImageEnhance のように調整ごとに画像を作って合成しない）
+- ワーカーは spawn で起動（fork だとスレッド・DB接続を持つアプリのプロセスごと複製され、
+  他スレッドが保持中のロックも引き継ぐ）。ワーカーが読み込むのはこのモジュールと Pillow のみ
+- プールが使えない環境では呼び出し元のスレッドで実行
+"""
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import List
+
+try:
+    from PIL import Image, ImageFilter, ImageStat
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+    print("⚠️ Pillow未インストール: pip install Pillow")
+
+# ワーカープロセスの起動方式
+IMAGE_PREPROCESS_START_METHOD = "spawn"
+# プロセス数（既定はCPUコア数）
+IMAGE_PREPROCESS_WORKERS = int(os.getenv("IMAGE_PREPROCESS_WORKERS", str(os.cpu_count() or 2)))
+# 1枚あたりの前処理の待ち時間の上限（秒）
+IMAGE_PREPROCESS_TIMEOUT = float(os.getenv("IMAGE_PREPROCESS_TIMEOUT", "30"))
+
+# OCRに渡す画像の最大サイズ（長辺px）
+MAX_IMAGE_SIZE = 2048
+# draft() は 1/2・1/4・1/8 単位でしか縮小できないため、最大サイズをわずかに下回るのは許容
+# （4032px の写真は 2016px でデコード）
+DRAFT_SIZE_TOLERANCE = 0.95
+CONTRAST = 1.5
+SHARPNESS = 1.2
+BRIGHTNESS = 1.1
+JPEG_QUALITY = 85
+
+
+def _tone_curve(mean: int) -> List[int]:
+    """コントラスト（平均輝度を中心に CONTRAST 倍）と明度（BRIGHTNESS 倍）を合わせた LUT"""
+    lut = []
+    for value in range(256):
+        contrasted = min(255, max(0, int(mean + CONTRAST * (value - mean))))
+        lut.append(min(255, int(BRIGHTNESS * contrasted)))
+    return lut
+
+
+def _sharpen_kernel() -> "ImageFilter.Kernel":
+    """
+    ImageEnhance.Sharpness(SHARPNESS) と同じ畳み込み
+    （元画像と SMOOTH フィルタ結果の合成 = 1つの 3x3 カーネル）
+    """
+    smooth = (1, 1, 1, 1, 5, 1, 1, 1, 1)  # ImageFilter.SMOOTH（合計 13）
+    identity = (0, 0, 0, 0, 13, 0, 0, 0, 0)
+    weights = [SHARPNESS * i + (1 - SHARPNESS) * s for i, s in zip(identity, smooth)]
+    return ImageFilter.Kernel((3, 3), weights, scale=13)
+
+
+def preprocess_image_bytes(image_data: bytes) -> bytes:
+    """
+    画像の前処理（ワーカープロセスで実行。DB・外部APIのモジュールは読み込まない）
+    - サイズ最適化（最大 MAX_IMAGE_SIZE px。JPEG はデコード時に縮小）
+    - シャープネス → コントラスト・明度
+    """
+    image = Image.open(BytesIO(image_data))
+    if image.format == "JPEG" and max(image.size) > MAX_IMAGE_SIZE:
+        ratio = MAX_IMAGE_SIZE * DRAFT_SIZE_TOLERANCE / max(image.size)
+        image.draft("RGB", (int(image.size[0] * ratio), int(image.size[1] * ratio)))
+
+    # RGBに変換（透過画像・パレット画像など）
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    if max(image.size) > MAX_IMAGE_SIZE:
+        ratio = MAX_IMAGE_SIZE / max(image.size)
+        new_size = (int(image.size[0] * ratio), int(image.size[1] * ratio))
+        image = image.resize(new_size, Image.Resampling.LANCZOS)
+
+    # コントラストの中心は調整前の平均輝度（ImageEnhance.Contrast と同じ）
+    mean = int(ImageStat.Stat(image.convert("L")).mean[0] + 0.5)
+    image = image.filter(_sharpen_kernel())
+    image = image.point(_tone_curve(mean) * len(image.getbands()))
+
+    output = BytesIO()
+    image.save(output, format="JPEG", quality=JPEG_QUALITY)
+    return output.getvalue()
+
+
+# シングルトンインスタンス
+_executor_instance = None
+
+def get_image_preprocess_executor() -> ProcessPoolExecutor:
+    """前処理用プロセスプールのシングルトンインスタンスを取得"""
+    global _executor_instance
+    if _executor_instance is None:
+        _executor_instance = ProcessPoolExecutor(
+            max_workers=IMAGE_PREPROCESS_WORKERS,
+            mp_context=multiprocessing.get_context(IMAGE_PREPROCESS_START_METHOD)
+        )
+    return _executor_instance
+
+
+def preprocess_image(image_data: bytes) -> bytes:
+    """プロセスプールで前処理（プールが使えない場合はこのスレッドで実行）"""
+    try:
+        future = get_image_preprocess_executor().submit(preprocess_image_bytes, image_data)
+    except (BrokenProcessPool, OSError) as e:
+        # ワーカープロセスを起動できない
+        return _preprocess_in_thread(image_data, e)
+    try:
+        return future.result(timeout=IMAGE_PREPROCESS_TIMEOUT)
+    except BrokenProcessPool as e:
+        # ワーカープロセスが異常終了した（画像を読めない場合の OSError はそのまま呼び出し元へ）
+        return _preprocess_in_thread(image_data, e)
+
+
+def _preprocess_in_thread(image_data: bytes, error: Exception) -> bytes:
+    """プールを破棄して（次回作り直す）このスレッドで前処理"""
+    global _executor_instance
+    print(f"⚠️ 前処理プロセスプールが使えないためスレッドで実行します: {error}")
+    _executor_instance = None
+    return preprocess_image_bytes(image_data)
+
+
+def shutdown_image_preprocess_executor():
+    """プロセスプールを停止"""
+    global _executor_instance
+    if _executor_instance is not None:
+        _executor_instance.shutdown(wait=False, cancel_futures=True)
+        _executor_instance = None
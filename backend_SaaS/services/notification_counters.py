@@ -0,0 +1,154 @@
+# notification_counters.py - 未読通知カウンター
+"""
+従業員ごとの未読通知数を notification_counters テーブルで管理
+- 通知作成・既読化と同じトランザクション内で UPDATE ... SET unread_count = unread_count + :delta
+- 未読数の取得は主キー1件の参照のみ
+- reconcile_unread_counters で実件数との差分を定期補正
+"""
+
+import os
+from datetime import datetime
+
+from sqlalchemy import case, exists, func, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database_saas import Notification, NotificationCounter
+
+
+# 整合性チェックの実行間隔（秒）
+UNREAD_COUNTER_RECONCILE_INTERVAL = int(os.getenv("UNREAD_COUNTER_RECONCILE_INTERVAL", "3600"))
+
+
+def _count_unread(db: Session, employee_id: int) -> int:
+    return db.query(func.count(Notification.id)).filter(
+        Notification.employee_id == employee_id,
+        Notification.is_read == False
+    ).scalar() or 0
+
+
+def _seed_counter(db: Session, employee_id: int) -> int:
+    """カウンター行が無い場合に実件数から作成（コミットは呼び出し側）"""
+    db.flush()
+    unread_count = _count_unread(db, employee_id)
+    try:
+        with db.begin_nested():
+            db.add(NotificationCounter(employee_id=employee_id, unread_count=unread_count))
+    except IntegrityError:
+        # 同時作成された場合は既存行をそのまま使う
+        pass
+    return unread_count
+
+
+def increment_unread_count(db: Session, employee_id: int, delta: int = 1):
+    """未読数を加算（通知作成と同じトランザクションで呼ぶ）"""
+    updated = db.query(NotificationCounter).filter(
+        NotificationCounter.employee_id == employee_id
+    ).update(
+        {NotificationCounter.unread_count: NotificationCounter.unread_count + delta},
+        synchronize_session=False
+    )
+    if not updated:
+        # 新規行は flush 済みの通知も含めた実件数で初期化
+        _seed_counter(db, employee_id)
+
+
+def increment_unread_counts(db: Session, employee_ids, delta: int = 1):
+    """複数従業員の未読数をまとめて加算（一括通知用。UPDATEは1回）"""
+    employee_ids = set(employee_ids)
+    if not employee_ids:
+        return
+    db.query(NotificationCounter).filter(
+        NotificationCounter.employee_id.in_(employee_ids)
+    ).update(
+        {NotificationCounter.unread_count: NotificationCounter.unread_count + delta},
+        synchronize_session=False
+    )
+    existing = {
+        employee_id for (employee_id,) in db.query(NotificationCounter.employee_id).filter(
+            NotificationCounter.employee_id.in_(employee_ids)
+        ).all()
+    }
+    for employee_id in employee_ids - existing:
+        _seed_counter(db, employee_id)
+
+
+def decrement_unread_count(db: Session, employee_id: int, delta: int = 1):
+    """未読数を減算（0未満にはしない）"""
+    db.query(NotificationCounter).filter(
+        NotificationCounter.employee_id == employee_id
+    ).update(
+        {NotificationCounter.unread_count: case(
+            (NotificationCounter.unread_count > delta, NotificationCounter.unread_count - delta),
+            else_=0
+        )},
+        synchronize_session=False
+    )
+
+
+def reset_unread_count(db: Session, employee_id: int):
+    """未読数を0にする（全既読時）"""
+    updated = db.query(NotificationCounter).filter(
+        NotificationCounter.employee_id == employee_id
+    ).update({NotificationCounter.unread_count: 0}, synchronize_session=False)
+    if not updated:
+        _seed_counter(db, employee_id)
+
+
+def get_unread_count(db: Session, employee_id: int) -> int:
+    """未読数を取得（主キー参照。行が無ければ実件数から作成）"""
+    unread_count = db.query(NotificationCounter.unread_count).filter(
+        NotificationCounter.employee_id == employee_id
+    ).scalar()
+    if unread_count is not None:
+        return unread_count
+
+    unread_count = _seed_counter(db, employee_id)
+    db.commit()
+    return unread_count
+
+
+def reconcile_unread_counters(db: Session) -> int:
+    """
+    カウンターを実件数と突き合わせて補正
+    - 補正は UPDATE 1文（件数の集計と書き込みの間に加算されても上書きで失われない）
+    - カウンター行の無い従業員は INSERT ... SELECT で作成
+    Returns: 補正した従業員数
+    """
+    now = datetime.utcnow()
+    unread = select(func.count(Notification.id)).where(
+        Notification.employee_id == NotificationCounter.employee_id,
+        Notification.is_read == False
+    ).scalar_subquery()
+    fixed = db.execute(
+        update(NotificationCounter).where(
+            NotificationCounter.unread_count != unread
+        ).values(unread_count=unread, updated_at=now),
+        execution_options={"synchronize_session": False}
+    ).rowcount
+
+    missing = select(
+        Notification.employee_id, func.count(Notification.id), literal(now)
+    ).where(
+        Notification.is_read == False,
+        ~exists().where(NotificationCounter.employee_id == Notification.employee_id)
+    ).group_by(Notification.employee_id)
+    try:
+        with db.begin_nested():
+            fixed += db.execute(
+                insert(NotificationCounter).from_select(
+                    ["employee_id", "unread_count", "updated_at"], missing
+                )
+            ).rowcount
+    except IntegrityError:
+        # 同時に作成された行は次回の補正で突き合わせる
+        pass
+
+    db.commit()
+    return fixed
+
+
+if __name__ == "__main__":
+    from services.periodic_jobs import run_job_once
+
+    print(f"未読通知カウンターを補正しました: {run_job_once(reconcile_unread_counters)}件")
@@ -0,0 +1,305 @@
+# ocr_backends.py - 伝票OCRのバックエンド
+"""
+ReceiptScanner が使うOCR処理の差し替え口
+- VisionOCRBackend: Google Cloud Vision API（text_detection / batch_annotate_images）
+- LocalReplayOCRBackend: 記録済みのOCR結果を画像ハッシュで引いて返す（外部APIを呼ばない）
+  応答時間（OCR_REPLAY_LATENCY_MS ± OCR_REPLAY_JITTER_MS）は画像ハッシュから決まるため、
+  同じ画像なら常に同じ結果・同じ待ち時間になる（オフラインでの負荷試験用）
+- RecordingOCRBackend: 別のバックエンドの結果を JSONL に追記（再生用の記録を作る）
+- OCR_BACKEND で選択（"vision" / "local"。未指定なら Vision が使えれば Vision）
+"""
+
+import os
+import json
+import time
+import base64
+import hashlib
+import threading
+from typing import Optional, Dict, Any, List, Protocol
+
+# Google Cloud Vision API
+try:
+    from google.cloud import vision
+    from google.oauth2 import service_account
+    VISION_AVAILABLE = True
+except ImportError:
+    VISION_AVAILABLE = False
+    print("⚠️ google-cloud-vision未インストール: pip install google-cloud-vision")
+
+# 使用するバックエンド（"vision" / "local"。空なら自動選択）
+OCR_BACKEND = os.getenv("OCR_BACKEND", "")
+# OCRのタイムアウト（秒）
+OCR_TIMEOUT = float(os.getenv("RECEIPT_OCR_TIMEOUT", "20"))
+# batch_annotate_images 1回あたりの画像数（Vision APIの同期リクエスト上限は16件）
+VISION_BATCH_SIZE = int(os.getenv("VISION_BATCH_SIZE", "16"))
+# 再生するOCR結果（JSONL: {"image_hash": ..., "text": ..., "confidence": ...}）
+OCR_REPLAY_PATH = os.getenv("OCR_REPLAY_PATH", "")
+# 再生時の応答時間（ms）とその揺らぎ（±ms）
+OCR_REPLAY_LATENCY_MS = float(os.getenv("OCR_REPLAY_LATENCY_MS", "0"))
+OCR_REPLAY_JITTER_MS = float(os.getenv("OCR_REPLAY_JITTER_MS", "0"))
+# OCR結果の記録先（JSONL。空なら記録しない）
+OCR_RECORD_PATH = os.getenv("OCR_RECORD_PATH", "")
+
+# 記録が無いときに返すテキスト
+SAMPLE_OCR_TEXT = """
+        伝票 No.1234
+        2024年11月28日
+
+        お客様名: 田中様
+        担当: 花子
+
+        ドリンク 8杯
+        シャンパン: モエ
+
+        合計: ¥35,000
+
+        支払: カード
+
+        ありがとうございました
+        """
+
+
+class OCRBackend(Protocol):
+    """
+    OCRバックエンド
+    結果は {'text', 'confidence', ...}。失敗時は {'error', 'text': '', 'confidence': 0}
+    """
+
+    name: str
+
+    def recognize(self, image_data: bytes) -> Dict[str, Any]:
+        """1枚のOCR（通信エラーなどは例外）"""
+        ...
+
+    def recognize_batch(self, images: List[bytes]) -> List[Dict[str, Any]]:
+        """複数画像のOCR（入力と同じ順序）"""
+        ...
+
+
+def _error_result(error: str) -> Dict[str, Any]:
+    return {'error': error, 'text': '', 'confidence': 0}
+
+
+# ====== Google Cloud Vision ======
+
+def create_vision_client():
+    """
+    環境変数の認証情報から Vision API クライアントを作成
+    Returns: クライアント（未インストール・未設定・エラー時は None）
+    """
+    if not VISION_AVAILABLE:
+        return None
+
+    try:
+        # 環境変数から認証情報を取得
+        credentials_base64 = os.getenv('GOOGLE_CREDENTIALS_BASE64')
+        credentials_file = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+
+        if credentials_base64:
+            # Base64エンコードされた認証情報
+            credentials_json = base64.b64decode(credentials_base64)
+            credentials_dict = json.loads(credentials_json)
+            credentials = service_account.Credentials.from_service_account_info(
+                credentials_dict
+            )
+            print("✅ Vision API初期化成功（Base64認証）")
+            return vision.ImageAnnotatorClient(credentials=credentials)
+
+        if credentials_file and os.path.exists(credentials_file):
+            # ファイルから認証情報
+            print("✅ Vision API初期化成功（ファイル認証）")
+            return vision.ImageAnnotatorClient()
+
+        print("⚠️ Vision API認証情報が設定されていません")
+
+    except Exception as e:
+        print(f"❌ Vision API初期化エラー: {e}")
+    return None
+
+
+class VisionOCRBackend:
+    """Google Cloud Vision API のOCR"""
+
+    name = "vision"
+
+    def __init__(self, client):
+        self.client = client
+
+    def recognize(self, image_data: bytes) -> Dict[str, Any]:
+        image = vision.Image(content=image_data)
+        response = self.client.text_detection(image=image, timeout=OCR_TIMEOUT)
+        return self._parse_response(response)
+
+    def recognize_batch(self, images: List[bytes]) -> List[Dict[str, Any]]:
+        """batch_annotate_images を VISION_BATCH_SIZE 件ずつ（失敗したまとまりはエラー結果）"""
+        results = []
+        for start in range(0, len(images), VISION_BATCH_SIZE):
+            chunk = images[start:start + VISION_BATCH_SIZE]
+            try:
+                response = self.client.batch_annotate_images(
+                    requests=[
+                        vision.AnnotateImageRequest(
+                            image=vision.Image(content=image_data),
+                            features=[vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)]
+                        )
+                        for image_data in chunk
+                    ],
+                    timeout=OCR_TIMEOUT
+                )
+                results.extend(self._parse_response(r) for r in response.responses)
+            except Exception as e:
+                print(f"❌ OCRエラー（{len(chunk)}件）: {e}")
+                results.extend(_error_result(str(e)) for _ in chunk)
+        return results
+
+    @staticmethod
+    def _parse_response(response) -> Dict[str, Any]:
+        """Vision APIのレスポンス（AnnotateImageResponse）を結果の辞書に変換"""
+        if response.error.message:
+            return _error_result(response.error.message)
+
+        # テキスト抽出
+        texts = response.text_annotations
+        if texts:
+            full_text = texts[0].description
+
+            # 信頼度計算（単語ごとの平均）
+            confidence = 0.0
+            if len(texts) > 1:
+                confidence_sum = sum(
+                    getattr(t, 'confidence', 0.8)
+                    for t in texts[1:]
+                )
+                confidence = confidence_sum / (len(texts) - 1)
+
+            return {
+                'text': full_text,
+                'confidence': confidence,
+                'word_count': len(texts) - 1,
+                # 保存用（repr ではなく protobuf のシリアライズ）
+                'raw_response': vision.AnnotateImageResponse.serialize(response)
+            }
+
+        return {
+            'text': '',
+            'confidence': 0,
+            'message': 'テキストが検出されませんでした'
+        }
+
+
+# ====== 記録の再生 ======
+
+class LocalReplayOCRBackend:
+    """
+    記録済みのOCR結果を返すバックエンド（結果には is_test_mode が付く）
+    - 画像ハッシュ（前処理後の画像のSHA-256）が一致する記録があればそれを返す
+    - 一致しない画像には、ハッシュから決まる記録を返す（image_hash の無い記録も対象）
+    - 記録が1件も無ければ SAMPLE_OCR_TEXT
+    """
+
+    name = "local"
+
+    def __init__(self, recordings: Optional[List[Dict[str, Any]]] = None,
+                 latency_ms: float = OCR_REPLAY_LATENCY_MS, jitter_ms: float = OCR_REPLAY_JITTER_MS):
+        self.recordings = recordings or [{'text': SAMPLE_OCR_TEXT, 'confidence': 0.85}]
+        self.by_hash = {r['image_hash']: r for r in self.recordings if r.get('image_hash')}
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+
+    @classmethod
+    def from_jsonl(cls, path: str, **kwargs) -> "LocalReplayOCRBackend":
+        """JSONL から読み込み（text 以外の項目は無視。confidence が無ければ 0.85）"""
+        with open(path, encoding="utf-8") as f:
+            recordings = [json.loads(line) for line in f if line.strip()]
+        return cls(recordings, **kwargs)
+
+    def _lookup(self, image_data: bytes):
+        image_hash = hashlib.sha256(image_data).hexdigest()
+        recording = self.by_hash.get(image_hash)
+        if recording is None:
+            recording = self.recordings[int(image_hash[:8], 16) % len(self.recordings)]
+        return image_hash, recording
+
+    def _delay(self, image_hash: str) -> float:
+        """応答時間（秒）。ハッシュの末尾から揺らぎを決める"""
+        jitter = (int(image_hash[-8:], 16) / 0xFFFFFFFF * 2 - 1) * self.jitter_ms
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    @staticmethod
+    def _result(recording: Dict[str, Any]) -> Dict[str, Any]:
+        if recording.get('error'):
+            return _error_result(recording['error'])
+        return {
+            'text': recording['text'],
+            'confidence': recording.get('confidence', 0.85),
+            'is_test_mode': True
+        }
+
+    def recognize(self, image_data: bytes) -> Dict[str, Any]:
+        image_hash, recording = self._lookup(image_data)
+        time.sleep(self._delay(image_hash))
+        return self._result(recording)
+
+    def recognize_batch(self, images: List[bytes]) -> List[Dict[str, Any]]:
+        """1回のリクエストとして待つ（待ち時間は最も遅い画像に合わせる）"""
+        looked_up = [self._lookup(image_data) for image_data in images]
+        time.sleep(max((self._delay(h) for h, _ in looked_up), default=0.0))
+        return [self._result(recording) for _, recording in looked_up]
+
+
+class RecordingOCRBackend:
+    """別のバックエンドのOCR結果を JSONL に追記（LocalReplayOCRBackend で再生できる形式）"""
+
+    def __init__(self, backend: OCRBackend, path: str):
+        self.backend = backend
+        self.name = backend.name
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _record(self, image_data: bytes, result: Dict[str, Any]):
+        if not result.get('text'):
+            return
+        line = json.dumps({
+            'image_hash': hashlib.sha256(image_data).hexdigest(),
+            'text': result['text'],
+            'confidence': result.get('confidence', 0),
+        }, ensure_ascii=False)
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            print(f"⚠️ OCR結果の記録に失敗しました: {e}")
+
+    def recognize(self, image_data: bytes) -> Dict[str, Any]:
+        result = self.backend.recognize(image_data)
+        self._record(image_data, result)
+        return result
+
+    def recognize_batch(self, images: List[bytes]) -> List[Dict[str, Any]]:
+        results = self.backend.recognize_batch(images)
+        for image_data, result in zip(images, results):
+            self._record(image_data, result)
+        return results
+
+
+def create_ocr_backend() -> OCRBackend:
+    """環境変数の設定からOCRバックエンドを作成"""
+    backend = None
+    if OCR_BACKEND != "local":
+        client = create_vision_client()
+        if client is not None:
+            backend = VisionOCRBackend(client)
+        elif OCR_BACKEND == "vision":
+            print("❌ OCR_BACKEND=vision ですが Vision API を初期化できませんでした")
+
+    if backend is None:
+        if OCR_REPLAY_PATH:
+            backend = LocalReplayOCRBackend.from_jsonl(OCR_REPLAY_PATH)
+            print(f"✅ OCR記録の再生モード（{len(backend.recordings)}件）")
+        else:
+            backend = LocalReplayOCRBackend()
+            print("⚠️ Vision API未設定（テストモードで動作）")
+
+    if OCR_RECORD_PATH:
+        backend = RecordingOCRBackend(backend, OCR_RECORD_PATH)
+    return backend
@@ -0,0 +1,302 @@
+# ocr_jobs.py - 伝票スキャンの非同期OCRジョブ
+"""
+伝票スキャン（前処理・画像アップロード・OCR・データ抽出）をワーカースレッドで処理する
+- スキャン受付時は ReceiptImage を PENDING で保存してジョブをキューに積むだけ（HTTPは即 202）
+- ワーカーは PENDING → PROCESSING → COMPLETED / FAILED の順に状態を更新
+- クライアントは GET /api/receipts/scan/{id} で完了をポーリング
+- 処理能力はHTTP接続数ではなくワーカー数（OCR_WORKER_COUNT）で決まる
+- キューは件数と、保持している画像の合計サイズ（一括スキャンは最大50枚で1件）の両方で制限
+- 一括スキャンは1ジョブにまとめ、OCRは Vision のバッチAPIで実行
+- キューはプロセス内のため、再起動で失われたジョブは定期ジョブで FAILED にする
+"""
+
+import os
+import time
+import queue
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from database_saas import SessionLocal, ReceiptImage, ProcessingStatus
+from services.receipt_scanner import get_receipt_scanner
+from services.ocr_payloads import save_ocr_payload, compact_extracted_data
+
+
+# ワーカースレッド数（OCR・アップロードはI/O待ちが中心のためスレッドで並列化）
+OCR_WORKER_COUNT = int(os.getenv("OCR_WORKER_COUNT", "4"))
+# キューの上限件数（満杯時は受付を 503 で断る）
+OCR_QUEUE_MAX_SIZE = int(os.getenv("OCR_QUEUE_MAX_SIZE", "100"))
+# キュー待ち・処理中のジョブが保持する画像の合計サイズの上限（超える場合も 503）
+OCR_QUEUE_MAX_BYTES = int(os.getenv("OCR_QUEUE_MAX_BYTES", str(512 * 1024 * 1024)))
+# この秒数を過ぎても完了しないジョブは失敗扱い
+OCR_JOB_TIMEOUT = int(os.getenv("OCR_JOB_TIMEOUT", "600"))
+# 取り残されたジョブのチェック間隔（秒）
+OCR_STALE_JOB_CHECK_INTERVAL = int(os.getenv("OCR_STALE_JOB_CHECK_INTERVAL", "300"))
+
+_STOP = object()
+
+
+class OcrJobQueueFull(Exception):
+    """OCRジョブキューが満杯"""
+
+
+class OcrJobPool:
+    """OCRジョブのワーカープール"""
+
+    def __init__(self, worker_count: int = OCR_WORKER_COUNT, max_queue_size: int = OCR_QUEUE_MAX_SIZE,
+                 max_queued_bytes: int = OCR_QUEUE_MAX_BYTES):
+        self.worker_count = worker_count
+        self.max_queued_bytes = max_queued_bytes
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._queued_bytes = 0
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.stats = {"completed": 0, "failed": 0, "rejected": 0}
+
+    def start(self):
+        """ワーカースレッドを開始"""
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self.worker_count):
+                thread = threading.Thread(target=self._run, name=f"ocr-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: float = 10.0):
+        """
+        処理中のジョブを待って停止
+        未着手のジョブはキューに残り、再開後に処理される（再開しなければ定期ジョブで FAILED）
+        """
+        with self._lock:
+            threads = self._threads
+            self._threads = []
+        for _ in threads:
+            try:
+                self._queue.put_nowait(_STOP)
+            except queue.Full:
+                # キューが満杯でもワーカーは次のジョブを取る前に停止する
+                self._stopping.set()
+                break
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._stopping.clear()
+
+    def submit(self, func, *args, size: int = 0):
+        """
+        ジョブ func(*args) をキューに追加（満杯時は OcrJobQueueFull）
+        size: ジョブが保持する画像のバイト数（完了まで合計サイズの上限に数える）
+        """
+        if not self._threads:
+            self.start()
+        with self._lock:
+            # 上限より大きいジョブでも、他に保持しているジョブが無ければ受け付ける
+            if self._queued_bytes and self._queued_bytes + size > self.max_queued_bytes:
+                self.stats["rejected"] += 1
+                raise OcrJobQueueFull()
+            try:
+                self._queue.put_nowait((func, args, size))
+            except queue.Full:
+                self.stats["rejected"] += 1
+                raise OcrJobQueueFull()
+            self._queued_bytes += size
+
+    def pending_count(self) -> int:
+        return self._queue.qsize()
+
+    def queued_bytes(self) -> int:
+        """キュー待ち・処理中のジョブが保持する画像の合計サイズ"""
+        return self._queued_bytes
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            func, args, size = item
+            if self._stopping.is_set():
+                # 取り出したジョブはキューに戻す（再開後に処理。戻せなければ定期ジョブで FAILED）
+                try:
+                    self._queue.put_nowait(item)
+                except queue.Full:
+                    self._record(failed=0, released=size)
+                return
+            completed, failed = 0, 1
+            try:
+                completed, failed = func(*args)
+            except Exception as e:
+                print(f"❌ OCRジョブエラー（{func.__name__}{args[:1]}）: {e}")
+            finally:
+                self._record(completed, failed, released=size)
+
+    def _record(self, completed: int = 0, failed: int = 0, released: int = 0):
+        """ジョブの結果を集計し、保持していた画像サイズを上限から外す"""
+        with self._lock:
+            self.stats["completed"] += completed
+            self.stats["failed"] += failed
+            self._queued_bytes -= released
+
+
+# シングルトンインスタンス
+_pool_instance = None
+
+def get_ocr_job_pool() -> OcrJobPool:
+    """OCRワーカープールのシングルトンインスタンスを取得"""
+    global _pool_instance
+    if _pool_instance is None:
+        _pool_instance = OcrJobPool()
+    return _pool_instance
+
+
+def _claim(db: Session, receipt_image_ids: List[int]) -> List[int]:
+    """PENDING のものだけを PROCESSING にする（削除・タイムアウト済みは除く）"""
+    claimed = db.query(ReceiptImage.id).filter(
+        ReceiptImage.id.in_(receipt_image_ids),
+        ReceiptImage.processing_status == ProcessingStatus.PENDING
+    ).with_for_update(skip_locked=True).all()
+    claimed_ids = [row.id for row in claimed]
+    if claimed_ids:
+        db.query(ReceiptImage).filter(
+            ReceiptImage.id.in_(claimed_ids),
+            ReceiptImage.processing_status == ProcessingStatus.PENDING
+        ).update({
+            ReceiptImage.processing_status: ProcessingStatus.PROCESSING,
+            ReceiptImage.updated_at: datetime.utcnow()
+        }, synchronize_session=False)
+    db.commit()
+    return claimed_ids
+
+
+def _store_result(db: Session, receipt_image_id: int, result: Dict):
+    """スキャン結果を ReceiptImage・OCR結果テーブルに反映（コミットは呼び出し側）"""
+    now = datetime.utcnow()
+    values = {
+        ReceiptImage.image_url: result.get('image_url') or '',
+        ReceiptImage.processed_at: now,
+        ReceiptImage.updated_at: now,
+    }
+    if result.get('success'):
+        values.update({
+            ReceiptImage.processing_status: ProcessingStatus.COMPLETED,
+            ReceiptImage.ocr_extracted_data: dict(
+                compact_extracted_data(result.get('extracted_data', {})),
+                is_test_mode=result.get('is_test_mode', False)
+            ),
+            ReceiptImage.confidence_score: result.get('confidence_score', 0),
+        })
+    else:
+        values.update({
+            ReceiptImage.processing_status: ProcessingStatus.FAILED,
+            ReceiptImage.error_message: result.get('error', '処理中にエラーが発生しました'),
+        })
+
+    updated = db.query(ReceiptImage).filter(
+        ReceiptImage.id == receipt_image_id,
+        ReceiptImage.processing_status == ProcessingStatus.PROCESSING
+    ).update(values, synchronize_session=False)
+    if updated and result.get('success'):
+        save_ocr_payload(db, receipt_image_id, result)
+
+
+def process_ocr_job(receipt_image_id: int, image_data: bytes) -> Tuple[int, int]:
+    """
+    1件のスキャンを処理して ReceiptImage を更新（ワーカースレッドで実行）
+    Returns: (成功件数, 失敗件数)
+    """
+    return process_ocr_batch_job([receipt_image_id], [image_data])
+
+
+def process_ocr_batch_job(receipt_image_ids: List[int], images: List[bytes]) -> Tuple[int, int]:
+    """
+    複数のスキャンをまとめて処理（2件以上は Vision のバッチOCRを使用）
+    Returns: (成功件数, 失敗件数)
+    """
+    db: Session = SessionLocal()
+    claimed_ids: List[int] = []
+    try:
+        claimed_ids = _claim(db, receipt_image_ids)
+        if not claimed_ids:
+            return 0, 0
+        image_by_id = dict(zip(receipt_image_ids, images))
+        targets = [image_by_id[i] for i in claimed_ids]
+
+        scanner = get_receipt_scanner()
+        if len(targets) == 1:
+            results = [scanner.scan_image(targets[0])]
+        else:
+            results = scanner.scan_images(targets)
+
+        for receipt_image_id, result in zip(claimed_ids, results):
+            _store_result(db, receipt_image_id, result)
+        db.commit()
+        completed = sum(1 for r in results if r.get('success'))
+        return completed, len(results) - completed
+    except Exception as e:
+        db.rollback()
+        _mark_failed(db, claimed_ids or receipt_image_ids, str(e))
+        raise
+    finally:
+        db.close()
+
+
+def _mark_failed(db: Session, receipt_image_ids: List[int], error: str):
+    try:
+        db.query(ReceiptImage).filter(
+            ReceiptImage.id.in_(receipt_image_ids),
+            ReceiptImage.processing_status.in_([ProcessingStatus.PENDING, ProcessingStatus.PROCESSING])
+        ).update({
+            ReceiptImage.processing_status: ProcessingStatus.FAILED,
+            ReceiptImage.error_message: error,
+            ReceiptImage.processed_at: datetime.utcnow(),
+        }, synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+
+
+def submit_ocr_job(receipt_image_id: int, image_data: bytes):
+    """スキャンジョブを投入（満杯時は OcrJobQueueFull）"""
+    get_ocr_job_pool().submit(process_ocr_job, receipt_image_id, image_data, size=len(image_data))
+
+
+def submit_ocr_batch_job(receipt_image_ids: List[int], images: List[bytes]):
+    """複数画像のスキャンを1ジョブとして投入（満杯時は OcrJobQueueFull）"""
+    get_ocr_job_pool().submit(
+        process_ocr_batch_job, list(receipt_image_ids), list(images), size=sum(len(i) for i in images)
+    )
+
+
+def fail_stale_ocr_jobs(db: Session, timeout: Optional[int] = None) -> int:
+    """一定時間を過ぎても完了しないジョブ（再起動でキューから失われたものなど）を FAILED にする"""
+    cutoff = datetime.utcnow() - timedelta(seconds=timeout or OCR_JOB_TIMEOUT)
+    updated = db.query(ReceiptImage).filter(
+        ReceiptImage.processing_status.in_([ProcessingStatus.PENDING, ProcessingStatus.PROCESSING]),
+        ReceiptImage.uploaded_at <= cutoff
+    ).update({
+        ReceiptImage.processing_status: ProcessingStatus.FAILED,
+        ReceiptImage.error_message: "処理がタイムアウトしました。もう一度スキャンしてください",
+        ReceiptImage.processed_at: datetime.utcnow(),
+    }, synchronize_session=False)
+    db.commit()
+    return updated
+
+
+def start_ocr_workers():
+    """起動時にワーカーを開始"""
+    get_ocr_job_pool().start()
+    print(f"✅ OCRワーカー開始（{OCR_WORKER_COUNT}スレッド / キュー上限{OCR_QUEUE_MAX_SIZE}件）")
+
+
+def stop_ocr_workers():
+    """終了時にワーカーを停止"""
+    if _pool_instance is not None:
+        _pool_instance.stop()
+
+
+if __name__ == "__main__":
+    from services.periodic_jobs import run_job_once
+
+    print(f"タイムアウトしたOCRジョブ: {run_job_once(fail_stale_ocr_jobs)}件")
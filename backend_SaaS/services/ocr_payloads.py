@@ -0,0 +1,85 @@
+# ocr_payloads.py - OCR結果の圧縮保存
+"""
+伝票画像のOCRテキスト・OCRレスポンスを zlib で圧縮して receipt_ocr_payloads に保存する
+- receipt_images には抽出データ（JSON）だけを残し、一覧の取得で大きなテキストを読まない
+  抽出データからもOCRテキスト（raw_text）・照合箇所（raw_match）は除く（compact_extracted_data）
+- Vision のレスポンスは repr ではなく protobuf のシリアライズ（単語ごとの座標を含めて再解析できる）
+- 移行した既存データ（encoding="none"）はそのまま読める
+"""
+
+import zlib
+from typing import Optional, Dict, Any
+
+from sqlalchemy.orm import Session
+
+from database_saas import ReceiptOcrPayload, upsert_row
+
+
+# zlib の圧縮レベル（OCRテキストは数KBのため、最大でも圧縮時間は問題にならない）
+OCR_PAYLOAD_COMPRESSION_LEVEL = 9
+ENCODING_ZLIB = "zlib"
+ENCODING_NONE = "none"
+
+
+def _compress(data) -> Optional[bytes]:
+    if data is None:
+        return None
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return zlib.compress(data, OCR_PAYLOAD_COMPRESSION_LEVEL)
+
+
+def _decompress(payload: ReceiptOcrPayload, data: Optional[bytes]) -> Optional[bytes]:
+    if data is None:
+        return None
+    if payload.encoding == ENCODING_ZLIB:
+        return zlib.decompress(data)
+    return bytes(data)
+
+
+def compact_extracted_data(extracted: Dict[str, Any]) -> Dict[str, Any]:
+    """抽出データを ocr_extracted_data に保存する形に変換（OCRテキストと重複する部分を除く）"""
+    compact = {key: value for key, value in extracted.items() if key != 'raw_text'}
+    details = compact.get('extraction_details')
+    if isinstance(details, dict):
+        compact['extraction_details'] = {
+            field: {k: v for k, v in detail.items() if k != 'raw_match'} if isinstance(detail, dict) else detail
+            for field, detail in details.items()
+        }
+    return compact
+
+
+def save_ocr_payload(db: Session, receipt_image_id: int, ocr_result: Dict[str, Any]):
+    """スキャン結果のOCRテキスト・レスポンスを圧縮して保存（コミットは呼び出し側）"""
+    upsert_row(db, ReceiptOcrPayload, {
+        "receipt_image_id": receipt_image_id,
+        "encoding": ENCODING_ZLIB,
+        "ocr_text": _compress(ocr_result.get('ocr_text', '')),
+        "raw_response": _compress(ocr_result.get('raw_response')),
+    }, ["receipt_image_id"], ["encoding", "ocr_text", "raw_response"])
+
+
+def copy_ocr_payload(payload: Optional[ReceiptOcrPayload]) -> Optional[ReceiptOcrPayload]:
+    """別のスキャン画像用に複製（圧縮済みのまま）"""
+    if payload is None:
+        return None
+    return ReceiptOcrPayload(
+        encoding=payload.encoding,
+        ocr_text=payload.ocr_text,
+        raw_response=payload.raw_response
+    )
+
+
+def load_ocr_text(payload: Optional[ReceiptOcrPayload]) -> Optional[str]:
+    """OCRテキストを展開"""
+    if payload is None:
+        return None
+    data = _decompress(payload, payload.ocr_text)
+    return data.decode("utf-8") if data is not None else None
+
+
+def load_raw_response(payload: Optional[ReceiptOcrPayload]) -> Optional[bytes]:
+    """OCRレスポンスを展開（Vision は vision.AnnotateImageResponse.deserialize で復元）"""
+    if payload is None:
+        return None
+    return _decompress(payload, payload.raw_response)
@@ -0,0 +1,63 @@
+# password_hasher.py - パスワードの並列ハッシュ化
+"""
+一括登録用のパスワードハッシュ化
+- bcrypt はCPUバウンドのため、プロセスプールで複数件を並列にハッシュ化
+- 60件でもおおよそ bcrypt 1〜数回分の時間で完了する
+- ワーカーは spawn で起動（fork だとDB接続・スレッドを持つアプリのプロセスごと複製される）
+- プールが使えない環境では auth_saas.get_password_hash で逐次処理にフォールバック
+"""
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+# プロセス数（既定はCPUコア数）
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+
+# ワーカープロセス内の CryptContext（auth_saas と同じ設定）
+_worker_context = None
+
+
+def _hash_password(password: str) -> str:
+    """ワーカープロセスで実行（DB接続を持つ auth_saas は読み込まない）"""
+    global _worker_context
+    if _worker_context is None:
+        from passlib.context import CryptContext
+        _worker_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _worker_context.hash(password)
+
+
+# シングルトンインスタンス
+_executor_instance = None
+
+def get_password_hash_executor() -> ProcessPoolExecutor:
+    """ハッシュ化用プロセスプールのシングルトンインスタンスを取得"""
+    global _executor_instance
+    if _executor_instance is None:
+        _executor_instance = ProcessPoolExecutor(
+            max_workers=PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor_instance
+
+
+def hash_passwords(passwords: List[str]) -> List[str]:
+    """複数のパスワードを並列にハッシュ化（入力と同じ順序で返す）"""
+    if len(passwords) <= 1:
+        from auth_saas import get_password_hash
+        return [get_password_hash(p) for p in passwords]
+
+    try:
+        return list(get_password_hash_executor().map(_hash_password, passwords))
+    except Exception as e:
+        print(f"⚠️ 並列ハッシュ化に失敗したため逐次処理します: {e}")
+        from auth_saas import get_password_hash
+        return [get_password_hash(p) for p in passwords]
+
+
+def shutdown_password_hash_executor():
+    """プロセスプールを停止"""
+    global _executor_instance
+    if _executor_instance is not None:
+        _executor_instance.shutdown(wait=False, cancel_futures=True)
+        _executor_instance = None
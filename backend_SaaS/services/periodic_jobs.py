@@ -0,0 +1,64 @@
+# periodic_jobs.py - 定期実行ジョブ
+"""
+アプリ内で定期実行するメンテナンスジョブ（カウンターの整合性チェックなど）
+- ジョブは register_periodic_job で登録し、起動時に start_periodic_jobs でスレッドを開始
+- 各ジョブには専用のDBセッションを渡す
+"""
+
+import threading
+from typing import Callable, Dict, List
+
+from database_saas import SessionLocal
+
+
+_jobs: List[Dict] = []
+_stop_event = threading.Event()
+_threads: List[threading.Thread] = []
+
+
+def register_periodic_job(name: str, func: Callable, interval_seconds: int):
+    """定期ジョブを登録（func は db セッションを引数に取る）"""
+    _jobs.append({"name": name, "func": func, "interval": interval_seconds})
+
+
+def run_job_once(func: Callable):
+    """ジョブを1回実行（CLI・手動実行用）"""
+    db = SessionLocal()
+    try:
+        return func(db)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _job_loop(job: Dict):
+    while not _stop_event.wait(job["interval"]):
+        try:
+            result = run_job_once(job["func"])
+            if result:
+                print(f"🔧 定期ジョブ {job['name']}: {result}件を補正")
+        except Exception as e:
+            print(f"❌ 定期ジョブエラー ({job['name']}): {e}")
+
+
+def start_periodic_jobs():
+    """登録済みジョブのスレッドを開始"""
+    if _threads:
+        return
+    _stop_event.clear()
+    for job in _jobs:
+        thread = threading.Thread(
+            target=_job_loop, args=(job,), name=f"periodic-{job['name']}", daemon=True
+        )
+        thread.start()
+        _threads.append(thread)
+    if _jobs:
+        print(f"✅ 定期ジョブ開始: {', '.join(job['name'] for job in _jobs)}")
+
+
+def stop_periodic_jobs():
+    """定期ジョブを停止"""
+    _stop_event.set()
+    _threads.clear()
@@ -0,0 +1,217 @@
+# plan_limits.py - サブスクリプションプラン上限チェック
+"""
+Subscription.max_stores / max_employees_per_store の上限チェック
+- 組織ごとの有効店舗数・店舗ごとの有効従業員数をカウンターテーブルで保持
+- 枠の確保は条件付き UPDATE（count + n <= max のときだけ +n）で行い、書き込みごとの COUNT(*) を不要にする
+- プラン情報は組織IDごとにキャッシュ（サブスクリプション更新時に破棄）
+- reconcile_usage_counters で実件数との差分を定期補正
+"""
+
+import os
+import time
+import threading
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import case, exists, func, literal, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database_saas import (
+    Employee, Store, Subscription, OrganizationUsage, StoreUsage, insert_missing_rows
+)
+
+
+# プラン情報キャッシュの保持秒数
+PLAN_CACHE_TTL = 300
+# 整合性チェックの実行間隔（秒）
+USAGE_COUNTER_RECONCILE_INTERVAL = int(os.getenv("USAGE_COUNTER_RECONCILE_INTERVAL", "3600"))
+
+
+class PlanLimits(NamedTuple):
+    max_stores: Optional[int]
+    max_employees_per_store: Optional[int]
+
+
+_plan_cache: dict = {}
+_plan_cache_lock = threading.Lock()
+
+
+def get_plan_limits(db: Session, organization_id: int) -> Optional[PlanLimits]:
+    """組織のプラン上限を取得（キャッシュ付き）"""
+    with _plan_cache_lock:
+        entry = _plan_cache.get(organization_id)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+
+    row = db.query(
+        Subscription.max_stores, Subscription.max_employees_per_store
+    ).filter(Subscription.organization_id == organization_id).first()
+    if not row:
+        # サブスクリプション未作成の組織はキャッシュしない
+        return None
+
+    limits = PlanLimits(max_stores=row[0], max_employees_per_store=row[1])
+    with _plan_cache_lock:
+        _plan_cache[organization_id] = (time.monotonic() + PLAN_CACHE_TTL, limits)
+    return limits
+
+
+def invalidate_plan_cache(organization_id: Optional[int] = None):
+    """プラン情報キャッシュを破棄（サブスクリプション更新時）"""
+    with _plan_cache_lock:
+        if organization_id is None:
+            _plan_cache.clear()
+        else:
+            _plan_cache.pop(organization_id, None)
+
+
+def _reserve(db: Session, model, key_column, key, count_column, limit, seed, extra=None,
+             count: int = 1) -> bool:
+    """
+    カウンターを条件付きで+count（上限 0 は「作成不可」、None は無制限）
+    Returns: 確保できた場合True、上限を超える場合False
+    """
+    for _ in range(2):
+        query = db.query(model).filter(key_column == key)
+        if limit is not None:
+            query = query.filter(count_column + count <= limit)
+        if query.update({count_column: count_column + count}, synchronize_session=False):
+            return True
+
+        exists = db.query(key_column).filter(key_column == key).scalar()
+        if exists is not None:
+            return False
+
+        # カウンター行が無い場合は実件数から作成
+        current = seed()
+        if limit is not None and current + count > limit:
+            return False
+        try:
+            with db.begin_nested():
+                db.add(model(**{key_column.key: key, count_column.key: current + count}, **(extra or {})))
+            return True
+        except IntegrityError:
+            # 同時作成された場合は条件付きUPDATEからやり直す
+            continue
+    return False
+
+
+def _release(db: Session, model, key_column, key, count_column, delta: int = 1):
+    db.query(model).filter(key_column == key).update(
+        {count_column: case((count_column > delta, count_column - delta), else_=0)},
+        synchronize_session=False
+    )
+
+
+def reserve_store_slot(db: Session, organization_id: int):
+    """店舗の作成・有効化前に枠を確保（上限超過時は403）"""
+    limits = get_plan_limits(db, organization_id)
+    limit = limits.max_stores if limits else None
+
+    def seed():
+        return db.query(func.count(Store.id)).filter(
+            Store.organization_id == organization_id,
+            Store.is_active == True
+        ).scalar() or 0
+
+    if not _reserve(
+        db, OrganizationUsage, OrganizationUsage.organization_id, organization_id,
+        OrganizationUsage.active_store_count, limit, seed
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"ご契約プランの店舗数上限（{limit}店舗）に達しています"
+        )
+
+
+def release_store_slot(db: Session, organization_id: int):
+    """店舗の無効化時に枠を解放"""
+    _release(db, OrganizationUsage, OrganizationUsage.organization_id, organization_id,
+             OrganizationUsage.active_store_count)
+
+
+def reserve_employee_slot(db: Session, store: Store, count: int = 1):
+    """従業員の作成前に枠を確保（count 名分を1回の条件付き UPDATE で確保。上限超過時は403）"""
+    limits = get_plan_limits(db, store.organization_id)
+    limit = limits.max_employees_per_store if limits else None
+
+    def seed():
+        return db.query(func.count(Employee.id)).filter(
+            Employee.store_id == store.id,
+            Employee.is_active == True
+        ).scalar() or 0
+
+    if not _reserve(
+        db, StoreUsage, StoreUsage.store_id, store.id,
+        StoreUsage.active_employee_count, limit, seed,
+        extra={"organization_id": store.organization_id}, count=count
+    ):
+        raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"ご契約プランの従業員数上限（1店舗あたり{limit}名）に達しています"
+        )
+
+
+def release_employee_slot(db: Session, store_id: int, count: int = 1):
+    """従業員の無効化時に枠を解放"""
+    _release(db, StoreUsage, StoreUsage.store_id, store_id, StoreUsage.active_employee_count, count)
+
+
+def reconcile_usage_counters(db: Session) -> int:
+    """
+    利用状況カウンターを実件数と突き合わせて補正
+    - 補正は UPDATE 1文ずつ（件数の集計と書き込みの間の枠の確保・解放を上書きしない）
+    - カウンター行の無い組織・店舗は INSERT ... ON CONFLICT DO NOTHING で作成
+    Returns: 補正した行数
+    """
+    now = datetime.utcnow()
+
+    active_stores = select(func.count(Store.id)).where(
+        Store.organization_id == OrganizationUsage.organization_id,
+        Store.is_active == True
+    ).scalar_subquery()
+    fixed = db.execute(
+        update(OrganizationUsage).where(
+            OrganizationUsage.active_store_count != active_stores
+        ).values(active_store_count=active_stores, updated_at=now),
+        execution_options={"synchronize_session": False}
+    ).rowcount
+    fixed += insert_missing_rows(
+        db, OrganizationUsage, ["organization_id", "active_store_count", "updated_at"],
+        select(Store.organization_id, func.count(Store.id), literal(now)).where(
+            Store.is_active == True,
+            ~exists().where(OrganizationUsage.organization_id == Store.organization_id)
+        ).group_by(Store.organization_id)
+    )
+
+    active_employees = select(func.count(Employee.id)).where(
+        Employee.store_id == StoreUsage.store_id,
+        Employee.is_active == True
+    ).scalar_subquery()
+    fixed += db.execute(
+        update(StoreUsage).where(
+            StoreUsage.active_employee_count != active_employees
+        ).values(active_employee_count=active_employees, updated_at=now),
+        execution_options={"synchronize_session": False}
+    ).rowcount
+    store_employees = select(func.count(Employee.id)).where(
+        Employee.store_id == Store.id,
+        Employee.is_active == True
+    ).scalar_subquery()
+    fixed += insert_missing_rows(
+        db, StoreUsage, ["store_id", "organization_id", "active_employee_count", "updated_at"],
+        select(Store.id, Store.organization_id, store_employees, literal(now)).where(
+            ~exists().where(StoreUsage.store_id == Store.id)
+        )
+    )
+
+    db.commit()
+    return fixed
+
+
+if __name__ == "__main__":
+    from services.periodic_jobs import run_job_once
+
+    print(f"利用状況カウンターを補正しました: {run_job_once(reconcile_usage_counters)}件")
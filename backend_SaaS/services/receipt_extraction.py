@@ -0,0 +1,374 @@
+# receipt_extraction.py - 伝票OCRテキストの項目抽出エンジン
+"""
+OCRテキストから金額・日付・顧客名・担当・ドリンク数・シャンパン・支払い方法を抽出する
+- テキストは NFKC 正規化（全角数字・記号・半角カナを統一）・小文字化してから1回だけ走査
+- ラベル（合計・お客様など）・ブランド・支払いキーワード・敬称（様・さん）は
+  トライ木から生成した正規表現で検出（最長一致のため「ドンペリニヨン」「ポイントカード」
+  「小計」「お客様」などを1語として扱う）
+- ¥金額・○円・日付・○杯も同じ結合正規表現の分岐として検出。先頭文字で候補位置を絞り込むため
+  分岐が増えても走査はほぼテキスト長に比例
+- ラベルの値はラベル直後から事前コンパイル済みの正規表現で読む（pattern.match(text, pos)）
+- 同じ項目の候補が複数ある場合は、従来と同じ優先順位（合計 > 会計 > ¥ > 円 > 売上 など）で選ぶ
+"""
+
+import re
+import unicodedata
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+# ====== キーワード定義 ======
+
+# (ラベル, 優先度) 優先度は小さいほど優先。¥金額は 2、○円は 3
+AMOUNT_LABELS = [
+    ("合計", 0), ("お会計", 1), ("会計", 1), ("計", 1), ("total", 1),
+    ("売上", 4), ("売り上げ", 4),
+]
+CUSTOMER_LABELS = ["お客様名", "お客様", "顧客名", "顧客", "お名前", "名前", "name"]
+EMPLOYEE_LABELS = ["担当", "指名", "キャスト"]
+DRINK_LABELS = ["ドリンク", "drinks", "drink", "飲み物"]
+CHAMPAGNE_LABELS = ["シャンパン", "champagne", "ボトル", "bottle"]
+PAYMENT_LABELS = ["お支払い", "お支払", "支払い", "支払", "決済", "payment"]
+HONORIFICS = ["様", "さん", "さま"]
+
+# 表記ゆれ → 表示名
+CHAMPAGNE_BRANDS = {
+    "モエ": "モエ", "モエ・エ・シャンドン": "モエ", "モエエシャンドン": "モエ", "moet": "モエ",
+    "ドンペリ": "ドンペリ", "ドンペリニヨン": "ドンペリ", "dom perignon": "ドンペリ",
+    "ヴーヴクリコ": "ヴーヴクリコ", "ヴーヴ・クリコ": "ヴーヴクリコ", "veuve clicquot": "ヴーヴクリコ",
+    "アルマンド": "アルマンド", "armand": "アルマンド",
+    "クリュッグ": "クリュッグ", "krug": "クリュッグ",
+    "ペリエジュエ": "ペリエジュエ", "ベルエポック": "ベルエポック",
+    "エース": "ACE", "ace": "ACE", "アンジェロ": "アンジェロ",
+}
+CARD_KEYWORDS = ["カード", "card", "クレジット", "credit", "visa", "master"]
+CASH_KEYWORDS = ["現金", "cash", "キャッシュ"]
+# 最長一致で部分一致を打ち消すための語（「小計」の「計」・「ポイントカード」の「カード」など）
+IGNORED_KEYWORDS = ["小計", "ポイントカード", "キャッシュレス", "時計", "皆様"]
+
+
+def _keyword_table() -> Dict[str, Tuple[str, Any, int]]:
+    """キーワード（小文字） → (種類, 値, 優先度)"""
+    table: Dict[str, Tuple[str, Any, int]] = {}
+
+    def add(words: Iterable[str], kind: str, value: Any = None, priority: int = 0):
+        for word in words:
+            table.setdefault(word.lower(), (kind, value, priority))
+
+    for word, priority in AMOUNT_LABELS:
+        add([word], "amount", priority=priority)
+    add(CUSTOMER_LABELS, "customer")
+    add(EMPLOYEE_LABELS, "employee")
+    add(DRINK_LABELS, "drink")
+    add(CHAMPAGNE_LABELS, "champagne")
+    add(PAYMENT_LABELS, "payment")
+    add(HONORIFICS, "honorific")
+    for word, name in CHAMPAGNE_BRANDS.items():
+        add([word], "brand", name)
+    add(CARD_KEYWORDS, "card", True)
+    add(CASH_KEYWORDS, "cash", False)
+    add(IGNORED_KEYWORDS, "ignore")
+    return table
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """
+    キーワード群をトライ木にまとめ、最長一致する正規表現に変換
+    先頭の1文字は走査側で読み進めてあるため、2文字目以降を後読みで先頭文字と対応づける
+    （例: 「(?<=合)計|(?<=お)(?:会計|客様(?:名)?)|…」）
+    """
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def emit(node: dict) -> str:
+        branches = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # 短い語で終わることもできる（貪欲なので長い語を優先）
+        return "(?:" + body + ")?" if "" in node else body
+
+    return "|".join(f"(?<={re.escape(ch)}){emit(child)}" for ch, child in sorted(trie.items()))
+
+
+# ====== 値の読み取り（ラベル直後から match） ======
+
+_AMOUNT_VALUE = re.compile(r"[:\s]*¥?\s*([0-9][0-9,]*)")
+# 名前・シャンパンはラベルと同じ行だけ（空欄のラベルで次の行の「合計 ¥35,000」などを読まない）
+_TEXT_VALUE = re.compile(r"[:\t ]*([^\s:][^\n]*?)[ \t]*(?=[ \t]{2,}|\n|$)")
+_DRINK_VALUE = re.compile(r"[^\d\n]{0,10}(\d+)")
+_CHAMPAGNE_VALUE = re.compile(r"[:\t ]*([^\s:¥0-9][^\n¥0-9]*)")
+# 敬称の直前の名前（行頭側から、コロンの後ろ）
+_NAME_BEFORE = re.compile(r"([^\s:][^\n:]{0,19}?)\s*$")
+_HONORIFIC_SUFFIX = re.compile(r"(様|さん|さま)$")
+# 「お客様 3名」のような人数は名前として扱わない
+_HEAD_COUNT = re.compile(r"\d+\s*(?:名|人)$")
+
+_NOT_FOUND = {"matched_pattern": None, "raw_match": None}
+# 数字から始まる分岐（1つ目の数値の先頭1文字がグループに含まれない）
+_DIGIT_LED = {"ymd", "short", "md", "en", "cups"}
+
+
+class ReceiptExtractor:
+    """伝票OCRテキストの抽出エンジン（パターンは生成時に1回だけコンパイル）"""
+
+    def __init__(self):
+        self._keywords = _keyword_table()
+        keyword_first_chars = re.escape("".join(sorted({word[0] for word in self._keywords})))
+        # 1回の走査で全候補を検出する結合正規表現
+        # 先頭を文字クラスにすると re が候補文字まで高速に読み飛ばすため、先頭の1文字を
+        # 文字クラスで読み、各分岐は後読みで先頭文字を確認してから2文字目以降を照合する
+        # （数字が最も多いため数字の分岐を先に置く）
+        self._scanner = re.compile(
+            r"[0-9¥r令" + keyword_first_chars + "](?:"
+            r"(?<=\d)(?:"
+            r"(?P<ymd>(\d{3})\s*[/\-年.]\s*(\d{1,2})\s*[/\-月.]\s*(\d{1,2})日?)"
+            r"|(?P<short>(\d?)[/.\-](\d{1,2})[/.\-](\d{1,2}))"
+            r"|(?P<md>(\d?)[/\-月](\d{1,2})日?)"
+            r"|(?P<en>([0-9,]*)\s*円)"
+            r"|(?P<cups>(\d*)\s*(?:杯|ドリンク))"
+            r")"
+            r"|(?<=¥)(?P<yen>\s*([0-9][0-9,]*)(?:円)?)"
+            r"|(?<=r|令)(?P<reiwa>和?(\d{1,2}|元)[/.\-年](\d{1,2})[/.\-月](\d{1,2})日?)"
+            r"|(?<=[" + keyword_first_chars + "])(?P<kw>" + _trie_pattern(self._keywords) + ")"
+            ")"
+        )
+        self._group_index = dict(self._scanner.groupindex)
+
+    # ------ 走査 ------
+
+    def _scan(self, text: str) -> Dict[str, List[tuple]]:
+        """
+        テキストを1回走査して、種類ごとの候補を集める
+        - キーワード: (位置, 終了位置, 値, 優先度, キーワード)
+        - 数値・日付: (位置, 終了位置, 1つ目の数値, 2つ目の数値, 3つ目の数値)
+        """
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # 小文字化で長さが変わる文字を含む場合は位置がずれるため元のテキストで走査
+            lowered = text
+        hits: Dict[str, List[tuple]] = defaultdict(list)
+        keywords = self._keywords
+        group_index = self._group_index
+        for match in self._scanner.finditer(lowered):
+            kind = match.lastgroup
+            start, end = match.span()
+            if kind == "kw":
+                word = lowered[start:end]
+                if word.isascii() and not self._is_ascii_word(lowered, start, end):
+                    continue
+                entry_kind, value, priority = keywords[word]
+                hits[entry_kind].append((start, end, value, priority, word))
+            else:
+                index = group_index[kind]
+                groups = match.groups()
+                if kind in _DIGIT_LED:
+                    # 先頭の数字は文字クラス側で読んでいるため、グループの前に補う
+                    first = lowered[start:match.end(index + 1)]
+                else:
+                    first = groups[index]
+                hits[kind].append((start, end, first) + groups[index + 1:index + 3])
+        return hits
+
+    @staticmethod
+    def _is_ascii_word(text: str, start: int, end: int) -> bool:
+        """英字キーワードは単語の一部（place の ace など）を除外"""
+        before = text[start - 1] if start > 0 else " "
+        after = text[end] if end < len(text) else " "
+        return not (before.isascii() and before.isalnum()) and not (after.isascii() and after.isalnum())
+
+    @staticmethod
+    def _line_span(text: str, pos: int) -> Tuple[int, int]:
+        start = text.rfind("\n", 0, pos) + 1
+        end = text.find("\n", pos)
+        return start, len(text) if end < 0 else end
+
+    # ------ 項目ごとの選択 ------
+
+    def _amount(self, text: str, hits: Dict[str, List[tuple]]) -> Tuple[Optional[int], Dict]:
+        candidates = []
+        for start, end, _, priority, word in hits.get("amount", ()):
+            match = _AMOUNT_VALUE.match(text, end)
+            if match:
+                candidates.append((priority, start, match.group(1), f"ラベル: {word}", match.end()))
+        # ¥金額は必ず数値になるため最初の1件だけでよい
+        for hit in hits.get("yen", ())[:1]:
+            candidates.append((2, hit[0], hit[2], "¥金額", hit[1]))
+        for hit in hits.get("en", ()):
+            candidates.append((3, hit[0], hit[2], "○円", hit[1]))
+
+        for _, start, amount, pattern, end in sorted(candidates):
+            try:
+                return int(amount.replace(",", "")), {"matched_pattern": pattern, "raw_match": text[start:end]}
+            except ValueError:
+                continue
+        return None, dict(_NOT_FOUND)
+
+    def _date(self, text: str, hits: Dict[str, List[tuple]]) -> Tuple[str, Dict]:
+        for kind in ("ymd", "reiwa", "md", "short"):
+            for start, end, first, second, third in hits.get(kind, ()):
+                try:
+                    if kind == "ymd":
+                        result = date(int(first), int(second), int(third))
+                    elif kind == "reiwa":
+                        # R6.11.28・令和6年11月28日・令和元年5月1日
+                        result = date(2018 + (1 if first == "元" else int(first)), int(second), int(third))
+                    elif kind == "md":
+                        # 年なしの場合は今年
+                        result = date(date.today().year, int(first), int(second))
+                    else:
+                        # 2桁年は2000年代
+                        result = date(2000 + int(first), int(second), int(third))
+                except (TypeError, ValueError):
+                    continue
+                return result.isoformat(), {"matched_pattern": kind, "raw_match": text[start:end]}
+        # 見つからない場合は今日の日付
+        return date.today().isoformat(), dict(_NOT_FOUND)
+
+    @staticmethod
+    def _label_text(text: str, label_hits: Iterable[tuple]) -> Tuple[Optional[str], Optional[Dict]]:
+        """ラベル直後の文字列（同じ行のみ）"""
+        for start, end, _, _, word in label_hits:
+            match = _TEXT_VALUE.match(text, end)
+            if not match:
+                continue
+            value = match.group(1).strip()
+            if 1 <= len(value) <= 20 and not _HEAD_COUNT.search(value):
+                return value, {"matched_pattern": f"ラベル: {word}", "raw_match": text[start:match.end()]}
+        return None, None
+
+    def _customer(self, text: str, hits: Dict[str, List[tuple]]) -> Tuple[Optional[str], Dict]:
+        name, details = self._label_text(text, hits.get("customer", ()))
+        if name is None:
+            # ラベルが無い場合は「○○様」（担当行の「○○さん」は除く）
+            employee_lines = [self._line_span(text, hit[0]) for hit in hits.get("employee", ())]
+            for start, end, _, _, _ in hits.get("honorific", ()):
+                if any(line_start <= start <= line_end for line_start, line_end in employee_lines):
+                    continue
+                line_start = text.rfind("\n", 0, start) + 1
+                match = _NAME_BEFORE.search(text, line_start, start)
+                if match:
+                    name = match.group(1).strip()
+                    details = {"matched_pattern": "○○様", "raw_match": text[match.start(1):end]}
+                    break
+        if name:
+            # 「様」「さん」を正規化
+            name = _HONORIFIC_SUFFIX.sub("", name).strip()
+        if not name:
+            return None, dict(_NOT_FOUND)
+        return name + "様", details
+
+    def _employee(self, text: str, hits: Dict[str, List[tuple]]) -> Tuple[Optional[str], Dict]:
+        name, details = self._label_text(text, hits.get("employee", ()))
+        if name:
+            name = _HONORIFIC_SUFFIX.sub("", name).strip()
+        if not name:
+            return None, dict(_NOT_FOUND)
+        return name, details
+
+    def _drink_count(self, text: str, hits: Dict[str, List[tuple]]) -> Tuple[Optional[int], Dict]:
+        candidates = []
+        for start, end, _, _, word in hits.get("drink", ()):
+            match = _DRINK_VALUE.match(text, end)
+            if match:
+                candidates.append((0, start, match.group(1), f"ラベル: {word}", match.end()))
+        for hit in hits.get("cups", ()):
+            candidates.append((1, hit[0], hit[2], "○杯", hit[1]))
+
+        for _, start, count, pattern, end in sorted(candidates):
+            count = int(count)
+            if 0 < count < 100:  # 妥当な範囲
+                return count, {"matched_pattern": pattern, "raw_match": text[start:end]}
+        return None, dict(_NOT_FOUND)
+
+    def _champagne(self, text: str, hits: Dict[str, List[tuple]]) -> Tuple[Optional[str], Optional[int], Dict]:
+        champagne = None
+        brands = hits.get("brand")
+        if brands:
+            start, end, champagne, _, word = brands[0]
+            anchor = start
+            details = {"matched_pattern": f"ブランド検出: {word}", "raw_match": text[start:end]}
+        else:
+            for start, end, _, _, word in hits.get("champagne", ()):
+                match = _CHAMPAGNE_VALUE.match(text, end)
+                value = match.group(1).strip() if match else ""
+                if value and len(value) <= 30:
+                    champagne, anchor = value, start
+                    details = {"matched_pattern": f"ラベル: {word}", "raw_match": text[start:match.end()]}
+                    break
+        if champagne is None:
+            return None, None, dict(_NOT_FOUND)
+
+        # 同じ行の金額をシャンパン金額とする
+        line_start, line_end = self._line_span(text, anchor)
+        for kind in ("yen", "en"):
+            for hit in hits.get(kind, ()):
+                if line_start <= hit[0] <= line_end:
+                    try:
+                        return champagne, int(hit[2].replace(",", "")), details
+                    except ValueError:
+                        continue
+        return champagne, None, details
+
+    def _payment(self, text: str, hits: Dict[str, List[tuple]]) -> Tuple[Optional[bool], Dict]:
+        card, cash = hits.get("card", []), hits.get("cash", [])
+        if not card and not cash:
+            return None, dict(_NOT_FOUND)
+
+        # 支払いラベルがあれば、その行（または次の行）のキーワードを優先
+        for label_start, label_end, _, _, _ in hits.get("payment", ()):
+            line_end = self._line_span(text, label_end)[1]
+            next_line_end = self._line_span(text, line_end + 1)[1] if line_end < len(text) else line_end
+            for start, end, is_card, _, word in sorted(card + cash):
+                if label_end <= start <= next_line_end:
+                    return is_card, {"matched_pattern": f"キーワード検出: {word}", "raw_match": text[label_start:end]}
+
+        # 従来どおりカードのキーワードがあればカード払い
+        start, end, is_card, _, word = (card or cash)[0]
+        return is_card, {"matched_pattern": f"キーワード検出: {word}", "raw_match": text[start:end]}
+
+    # ------ 公開API ------
+
+    def extract(self, ocr_text: str) -> Dict[str, Any]:
+        """OCRテキストから構造化データを抽出（ReceiptScanner.extract_data の結果）"""
+        text = unicodedata.normalize("NFKC", ocr_text or "")
+        hits = self._scan(text)
+
+        extracted: Dict[str, Any] = {
+            'total_amount': None,
+            'customer_name': None,
+            'employee_name': None,
+            'date': None,
+            'drink_count': None,
+            'champagne_type': None,
+            'champagne_price': None,
+            'is_card': None,
+            'raw_text': ocr_text,
+            'extraction_details': {}
+        }
+        details = extracted['extraction_details']
+        extracted['total_amount'], details['amount'] = self._amount(text, hits)
+        extracted['date'], details['date'] = self._date(text, hits)
+        extracted['customer_name'], details['customer'] = self._customer(text, hits)
+        extracted['employee_name'], details['employee'] = self._employee(text, hits)
+        extracted['drink_count'], details['drinks'] = self._drink_count(text, hits)
+        extracted['champagne_type'], extracted['champagne_price'], details['champagne'] = \
+            self._champagne(text, hits)
+        extracted['is_card'], details['payment'] = self._payment(text, hits)
+        return extracted
+
+
+# シングルトンインスタンス
+_extractor_instance = None
+
+def get_receipt_extractor() -> ReceiptExtractor:
+    """抽出エンジンのシングルトンインスタンスを取得"""
+    global _extractor_instance
+    if _extractor_instance is None:
+        _extractor_instance = ReceiptExtractor()
+    return _extractor_instance
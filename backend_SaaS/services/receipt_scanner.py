@@ -1,34 +1,21 @@
 # receipt_scanner.py - AI伝票読み取りサービス
 """
-Google Cloud Vision APIを使用した伝票OCR処理
+伝票OCR処理（OCRは services/ocr_backends.py のバックエンド。通常は Google Cloud Vision API）
 バー営業の伝票から金額、顧客名、日付などを自動抽出
 """
 
 import os
-import re
-import json
+import time
 import base64
+import binascii
 import hashlib
-from datetime import datetime, date
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from typing import Optional, Dict, Any, List, Tuple
-from io import BytesIO
 
-# 画像処理
-try:
-    from PIL import Image, ImageEnhance, ImageFilter
-    PIL_AVAILABLE = True
-except ImportError:
-    PIL_AVAILABLE = False
-    print("⚠️ Pillow未インストール: pip install Pillow")
-
-# Google Cloud Vision API
-try:
-    from google.cloud import vision
-    from google.oauth2 import service_account
-    VISION_AVAILABLE = True
-except ImportError:
-    VISION_AVAILABLE = False
-    print("⚠️ google-cloud-vision未インストール: pip install google-cloud-vision")
+from services.receipt_extraction import get_receipt_extractor
+from services.ocr_backends import OCRBackend, OCR_TIMEOUT, create_ocr_backend
+from services.image_preprocessing import PIL_AVAILABLE, preprocess_image as preprocess_image_in_pool
 
 # Cloudinary（画像保存用）
 try:
@@ -39,94 +26,65 @@ except ImportError:
     CLOUDINARY_AVAILABLE = False
     print("⚠️ cloudinary未インストール: pip install cloudinary")
 
+# 画像アップロード・OCRのタイムアウト（秒）
+UPLOAD_TIMEOUT = float(os.getenv("RECEIPT_UPLOAD_TIMEOUT", "15"))
+# アップロードとOCRを並行実行するスレッド数
+SCAN_STAGE_WORKERS = int(os.getenv("RECEIPT_SCAN_STAGE_WORKERS", "8"))
+# Base64デコードのチャンク長（4の倍数）
+BASE64_DECODE_CHUNK = 256 * 1024
+
+
+class _StageTask:
+    """
+    スレッドプールで実行する段階（アップロード・OCR）
+    タイムアウトは投入時ではなく実行開始から数える。キュー待ちも同じ秒数まで
+    （プールが埋まっていても、待ち時間は最長でキュー待ち + 実行の timeout 秒ずつ）
+    """
+    
+    def __init__(self, executor: ThreadPoolExecutor, func, *args):
+        self.started_at: Optional[float] = None
+        self._started = threading.Event()
+        self.future = executor.submit(self._run, func, args)
+    
+    def _run(self, func, args):
+        self.started_at = time.monotonic()
+        self._started.set()
+        return func(*args)
+    
+    def result(self, timeout: float):
+        """
+        実行開始から timeout 秒まで待つ（超えたら FutureTimeoutError）
+        timeout 秒以内に実行が始まらない場合も FutureTimeoutError（未着手なら取り消す）
+        """
+        if not self._started.wait(timeout):
+            self.future.cancel()
+            raise FutureTimeoutError()
+        # タイムアウトしても実行中の呼び出しは止められない（各処理は自身のタイムアウトで終わる）
+        return self.future.result(timeout=max(0.0, self.started_at + timeout - time.monotonic()))
+
 
 class ReceiptScanner:
     """
     伝票スキャンサービス
     - 画像の前処理（圧縮、コントラスト調整など）
-    - Google Cloud Vision APIでOCR処理
-    - 正規表現でデータ抽出（金額、日付、顧客名など）
+    - OCRバックエンド（Google Cloud Vision API など）でOCR処理
+    - 抽出エンジンでデータ抽出（金額、日付、顧客名など）
     - 構造化データの生成
     """
     
-    def __init__(self):
-        """初期化"""
-        self.vision_client = None
-        self._init_vision_api()
+    def __init__(self, ocr_backend: Optional[OCRBackend] = None):
+        """初期化（ocr_backend 未指定時は環境変数の設定から作成）"""
+        self.ocr_backend = ocr_backend or create_ocr_backend()
         self._init_cloudinary()
         
-        # 金額認識のパターン
-        self.amount_patterns = [
-            r'合計[:\s]*[¥￥]?\s*([0-9,]+)',
-            r'(?:お会計|会計|計|TOTAL|total)[:\s]*[¥￥]?\s*([0-9,]+)',
-            r'[¥￥]\s*([0-9,]+)\s*(?:円)?',
-            r'([0-9,]+)\s*円',
-            r'(?:売上|売り上げ)[:\s]*[¥￥]?\s*([0-9,]+)',
-        ]
-        
-        # 日付認識のパターン
-        self.date_patterns = [
-            r'(\d{4})[/\-年](\d{1,2})[/\-月](\d{1,2})',  # 2024/11/28, 2024年11月28日
-            r'(\d{1,2})[/\-月](\d{1,2})[日]?',  # 11/28, 11月28日
-            r'R?(\d{1,2})[/\.\-](\d{1,2})[/\.\-](\d{1,2})',  # R6.11.28
-        ]
-        
-        # 顧客名認識のパターン
-        self.customer_patterns = [
-            r'(?:お客様|顧客|名前|Name|name)[:\s]*([^\n\r]+)',
-            r'([^\n\r]+)\s*(?:様|さん|さま)',
-            r'(?:指名|担当|キャスト)[:\s]*([^\n\r]+)',
-        ]
-        
-        # ドリンク数認識のパターン
-        self.drink_patterns = [
-            r'(?:ドリンク|drink|drinks)[:\s]*(\d+)',
-            r'(\d+)\s*(?:杯|はい|ドリンク)',
-            r'(?:ドリンク|飲み物)[^\d]*(\d+)',
-        ]
-        
-        # シャンパン認識のパターン
-        self.champagne_patterns = [
-            r'(?:シャンパン|champagne|ボトル|bottle)[:\s]*([^\n\r¥￥0-9]+)',
-            r'(モエ|ドンペリ|ヴーヴクリコ|アルマンド|クリュッグ|ペリエ|ace)[^\n\r]*',
-        ]
-        
-        # 支払い方法認識のパターン
-        self.payment_patterns = [
-            r'(?:支払|決済|payment)[:\s]*(現金|カード|CASH|CARD|クレジット)',
-            r'(現金|カード|CASH|CARD|クレジット)',
-        ]
-    
-    def _init_vision_api(self):
-        """Google Cloud Vision APIを初期化"""
-        if not VISION_AVAILABLE:
-            print("⚠️ Vision API未設定（テストモードで動作）")
-            return
-        
-        try:
-            # 環境変数から認証情報を取得
-            credentials_base64 = os.getenv('GOOGLE_CREDENTIALS_BASE64')
-            credentials_file = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
-            
-            if credentials_base64:
-                # Base64エンコードされた認証情報
-                credentials_json = base64.b64decode(credentials_base64)
-                credentials_dict = json.loads(credentials_json)
-                credentials = service_account.Credentials.from_service_account_info(
-                    credentials_dict
-                )
-                self.vision_client = vision.ImageAnnotatorClient(credentials=credentials)
-                print("✅ Vision API初期化成功（Base64認証）")
-                
-            elif credentials_file and os.path.exists(credentials_file):
-                # ファイルから認証情報
-                self.vision_client = vision.ImageAnnotatorClient()
-                print("✅ Vision API初期化成功（ファイル認証）")
-            else:
-                print("⚠️ Vision API認証情報が設定されていません")
-                
-        except Exception as e:
-            print(f"❌ Vision API初期化エラー: {e}")
+        # アップロードとOCRを並行実行するスレッドプール
+        self._stage_executor = ThreadPoolExecutor(
+            max_workers=SCAN_STAGE_WORKERS, thread_name_prefix="receipt-scan-stage"
+        )
+        # 一括スキャン用（最大50枚の前処理・アップロードで1枚ずつのスキャンを待たせない）
+        self._batch_executor = ThreadPoolExecutor(
+            max_workers=SCAN_STAGE_WORKERS, thread_name_prefix="receipt-scan-batch"
+        )
     
     def _init_cloudinary(self):
         """Cloudinaryを初期化"""
@@ -154,46 +112,15 @@ class ReceiptScanner:
     
     def preprocess_image(self, image_data: bytes) -> bytes:
         """
-        画像の前処理
-        - サイズ最適化
-        - コントラスト強調
-        - ノイズ除去
+        画像の前処理（services/image_preprocessing.py・プロセスプールで実行）
+        - サイズ最適化（JPEGはデコード時に縮小）
+        - シャープネス・コントラスト・明度の調整
         """
         if not PIL_AVAILABLE:
             return image_data
         
         try:
-            # バイトデータから画像を読み込み
-            image = Image.open(BytesIO(image_data))
-            
-            # RGBに変換（透過画像対応）
-            if image.mode in ('RGBA', 'P'):
-                image = image.convert('RGB')
-            
-            # サイズ最適化（最大2048px）
-            max_size = 2048
-            if max(image.size) > max_size:
-                ratio = max_size / max(image.size)
-                new_size = (int(image.size[0] * ratio), int(image.size[1] * ratio))
-                image = image.resize(new_size, Image.Resampling.LANCZOS)
-            
-            # コントラスト強調
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(1.5)
-            
-            # シャープネス強調
-            enhancer = ImageEnhance.Sharpness(image)
-            image = enhancer.enhance(1.2)
-            
-            # 明度調整
-            enhancer = ImageEnhance.Brightness(image)
-            image = enhancer.enhance(1.1)
-            
-            # バイトデータに変換
-            output = BytesIO()
-            image.save(output, format='JPEG', quality=85)
-            return output.getvalue()
-            
+            return preprocess_image_in_pool(image_data)
         except Exception as e:
             print(f"⚠️ 画像前処理エラー: {e}")
             return image_data
@@ -216,7 +143,8 @@ class ReceiptScanner:
                 image_data,
                 folder="receipt_images",
                 public_id=filename or image_hash[:16],
-                resource_type="image"
+                resource_type="image",
+                timeout=UPLOAD_TIMEOUT
             )
             return result['secure_url'], image_hash
             
@@ -226,56 +154,11 @@ class ReceiptScanner:
     
     def perform_ocr(self, image_data: bytes) -> Dict[str, Any]:
         """
-        Google Cloud Vision APIでOCR実行
+        OCRバックエンドでOCR実行
         Returns: OCR結果の辞書
         """
-        if not self.vision_client:
-            # テストモード: サンプルテキスト返却
-            return {
-                'text': self._get_sample_ocr_text(),
-                'confidence': 0.85,
-                'is_test_mode': True
-            }
-        
         try:
-            # Vision API呼び出し
-            image = vision.Image(content=image_data)
-            response = self.vision_client.text_detection(image=image)
-            
-            if response.error.message:
-                return {
-                    'error': response.error.message,
-                    'text': '',
-                    'confidence': 0
-                }
-            
-            # テキスト抽出
-            texts = response.text_annotations
-            if texts:
-                full_text = texts[0].description
-                
-                # 信頼度計算（単語ごとの平均）
-                confidence = 0.0
-                if len(texts) > 1:
-                    confidence_sum = sum(
-                        getattr(t, 'confidence', 0.8) 
-                        for t in texts[1:]
-                    )
-                    confidence = confidence_sum / (len(texts) - 1)
-                
-                return {
-                    'text': full_text,
-                    'confidence': confidence,
-                    'word_count': len(texts) - 1,
-                    'raw_response': str(response)
-                }
-            
-            return {
-                'text': '',
-                'confidence': 0,
-                'message': 'テキストが検出されませんでした'
-            }
-            
+            return self.ocr_backend.recognize(image_data)
         except Exception as e:
             print(f"❌ OCRエラー: {e}")
             return {
@@ -284,206 +167,22 @@ class ReceiptScanner:
                 'confidence': 0
             }
     
-    def _get_sample_ocr_text(self) -> str:
-        """テストモード用サンプルテキスト"""
-        return """
-        伝票 No.1234
-        2024年11月28日
-        
-        お客様名: 田中様
-        担当: 花子
-        
-        ドリンク 8杯
-        シャンパン: モエ
-        
-        合計: ¥35,000
-        
-        支払: カード
-        
-        ありがとうございました
+    def perform_ocr_batch(self, images: List[bytes]) -> List[Dict[str, Any]]:
+        """
+        複数画像をまとめてOCR実行（Vision は batch_annotate_images）
+        Returns: 入力と同じ順序のOCR結果（perform_ocr と同じ形式）
         """
+        try:
+            return self.ocr_backend.recognize_batch(images)
+        except Exception as e:
+            print(f"❌ OCRエラー（{len(images)}件）: {e}")
+            return [{'error': str(e), 'text': '', 'confidence': 0} for _ in images]
     
     def extract_data(self, ocr_text: str) -> Dict[str, Any]:
         """
-        OCRテキストから構造化データを抽出
+        OCRテキストから構造化データを抽出（services/receipt_extraction.py）
         """
-        extracted = {
-            'total_amount': None,
-            'customer_name': None,
-            'employee_name': None,
-            'date': None,
-            'drink_count': None,
-            'champagne_type': None,
-            'champagne_price': None,
-            'is_card': None,
-            'raw_text': ocr_text,
-            'extraction_details': {}
-        }
-        
-        # 金額抽出
-        extracted['total_amount'], details = self._extract_amount(ocr_text)
-        extracted['extraction_details']['amount'] = details
-        
-        # 日付抽出
-        extracted['date'], details = self._extract_date(ocr_text)
-        extracted['extraction_details']['date'] = details
-        
-        # 顧客名抽出
-        extracted['customer_name'], details = self._extract_customer_name(ocr_text)
-        extracted['extraction_details']['customer'] = details
-        
-        # ドリンク数抽出
-        extracted['drink_count'], details = self._extract_drink_count(ocr_text)
-        extracted['extraction_details']['drinks'] = details
-        
-        # シャンパン抽出
-        extracted['champagne_type'], details = self._extract_champagne(ocr_text)
-        extracted['extraction_details']['champagne'] = details
-        
-        # 支払い方法抽出
-        extracted['is_card'], details = self._extract_payment_method(ocr_text)
-        extracted['extraction_details']['payment'] = details
-        
-        return extracted
-    
-    def _extract_amount(self, text: str) -> Tuple[Optional[int], Dict]:
-        """金額を抽出"""
-        details = {'matched_pattern': None, 'raw_match': None}
-        
-        for pattern in self.amount_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                amount_str = match.group(1).replace(',', '')
-                try:
-                    amount = int(amount_str)
-                    details['matched_pattern'] = pattern
-                    details['raw_match'] = match.group(0)
-                    return amount, details
-                except ValueError:
-                    continue
-        
-        return None, details
-    
-    def _extract_date(self, text: str) -> Tuple[Optional[str], Dict]:
-        """日付を抽出"""
-        details = {'matched_pattern': None, 'raw_match': None}
-        today = date.today()
-        
-        for pattern in self.date_patterns:
-            match = re.search(pattern, text)
-            if match:
-                groups = match.groups()
-                details['matched_pattern'] = pattern
-                details['raw_match'] = match.group(0)
-                
-                try:
-                    if len(groups) == 3:
-                        year, month, day = int(groups[0]), int(groups[1]), int(groups[2])
-                        # 2桁年の場合は2000年代として処理
-                        if year < 100:
-                            year = 2000 + year
-                    else:
-                        # 年なしの場合は今年
-                        year = today.year
-                        month, day = int(groups[0]), int(groups[1])
-                    
-                    # 日付検証
-                    result_date = date(year, month, day)
-                    return result_date.isoformat(), details
-                    
-                except (ValueError, IndexError):
-                    continue
-        
-        # 見つからない場合は今日の日付
-        return today.isoformat(), details
-    
-    def _extract_customer_name(self, text: str) -> Tuple[Optional[str], Dict]:
-        """顧客名を抽出"""
-        details = {'matched_pattern': None, 'raw_match': None}
-        
-        for pattern in self.customer_patterns:
-            match = re.search(pattern, text)
-            if match:
-                name = match.group(1).strip()
-                # 短すぎる名前は除外
-                if len(name) >= 1 and len(name) <= 20:
-                    details['matched_pattern'] = pattern
-                    details['raw_match'] = match.group(0)
-                    # 「様」「さん」を正規化
-                    name = re.sub(r'(様|さん|さま)$', '', name).strip()
-                    if name:
-                        return name + '様', details
-        
-        return None, details
-    
-    def _extract_drink_count(self, text: str) -> Tuple[Optional[int], Dict]:
-        """ドリンク数を抽出"""
-        details = {'matched_pattern': None, 'raw_match': None}
-        
-        for pattern in self.drink_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                try:
-                    count = int(match.group(1))
-                    if 0 < count < 100:  # 妥当な範囲
-                        details['matched_pattern'] = pattern
-                        details['raw_match'] = match.group(0)
-                        return count, details
-                except ValueError:
-                    continue
-        
-        return None, details
-    
-    def _extract_champagne(self, text: str) -> Tuple[Optional[str], Dict]:
-        """シャンパン情報を抽出"""
-        details = {'matched_pattern': None, 'raw_match': None}
-        
-        # 有名シャンパンブランドのリスト
-        champagne_brands = [
-            'モエ', 'ドンペリ', 'ヴーヴクリコ', 'アルマンド', 'クリュッグ',
-            'ペリエジュエ', 'ベルエポック', 'ACE', 'エース', 'アンジェロ',
-            'ドンペリニヨン', 'モエ・エ・シャンドン', 'Dom Perignon',
-        ]
-        
-        text_lower = text.lower()
-        for brand in champagne_brands:
-            if brand.lower() in text_lower:
-                details['matched_pattern'] = f'ブランド検出: {brand}'
-                return brand, details
-        
-        # パターンマッチング
-        for pattern in self.champagne_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                champagne = match.group(1).strip() if match.lastindex else match.group(0).strip()
-                if len(champagne) <= 30:
-                    details['matched_pattern'] = pattern
-                    details['raw_match'] = match.group(0)
-                    return champagne, details
-        
-        return None, details
-    
-    def _extract_payment_method(self, text: str) -> Tuple[Optional[bool], Dict]:
-        """支払い方法を抽出（True=カード, False=現金）"""
-        details = {'matched_pattern': None, 'raw_match': None}
-        
-        text_lower = text.lower()
-        
-        # カード払いのキーワード
-        card_keywords = ['カード', 'card', 'クレジット', 'credit', 'visa', 'master']
-        for keyword in card_keywords:
-            if keyword in text_lower:
-                details['matched_pattern'] = f'キーワード検出: {keyword}'
-                return True, details
-        
-        # 現金払いのキーワード
-        cash_keywords = ['現金', 'cash', 'キャッシュ']
-        for keyword in cash_keywords:
-            if keyword in text_lower:
-                details['matched_pattern'] = f'キーワード検出: {keyword}'
-                return False, details
-        
-        return None, details
+        return get_receipt_extractor().extract(ocr_text)
     
     def calculate_confidence(self, extracted_data: Dict, ocr_result: Dict) -> float:
         """
@@ -525,6 +224,23 @@ class ReceiptScanner:
         
         return min(score, 1.0)
     
+    @staticmethod
+    def decode_image(image_data_base64: str) -> bytes:
+        """
+        Base64（data:image/jpeg;base64,... 形式もOK）をバイト列に変換
+        大きな画像はチャンクごとにデコード（1回のデコードでGILを長時間保持しない）
+        """
+        # data:image/jpeg;base64,... 形式ならカンマ以降（文字列全体をコピーしない）
+        start = image_data_base64.find(',') + 1
+        if len(image_data_base64) - start <= BASE64_DECODE_CHUNK or any(
+            c in image_data_base64 for c in ('\n', '\r', ' ')
+        ):
+            return base64.b64decode(image_data_base64[start:])
+        return b"".join(
+            binascii.a2b_base64(image_data_base64[i:i + BASE64_DECODE_CHUNK])
+            for i in range(start, len(image_data_base64), BASE64_DECODE_CHUNK)
+        )
+    
     def scan_receipt(self, image_data_base64: str) -> Dict[str, Any]:
         """
         メイン処理: 伝票画像をスキャンして構造化データを返す
@@ -545,51 +261,104 @@ class ReceiptScanner:
             }
         """
         try:
-            # Base64デコード
-            if ',' in image_data_base64:
-                # data:image/jpeg;base64,... 形式
-                image_data_base64 = image_data_base64.split(',')[1]
-            
-            image_data = base64.b64decode(image_data_base64)
-            
+            image_data = self.decode_image(image_data_base64)
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+        return self.scan_image(image_data)
+    
+    def scan_image(self, image_data: bytes) -> Dict[str, Any]:
+        """デコード済みの画像バイト列をスキャン（戻り値は scan_receipt と同じ）"""
+        try:
             # 画像の前処理
             processed_image = self.preprocess_image(image_data)
             
-            # 画像アップロード
-            image_url, image_hash = self.upload_image(processed_image)
-            
-            # OCR実行
-            ocr_result = self.perform_ocr(processed_image)
+            # 画像アップロードとOCRを並行実行（所要時間は合計ではなく遅い方）
+            image_hash = hashlib.sha256(processed_image).hexdigest()
+            upload_task = _StageTask(self._stage_executor, self.upload_image, processed_image)
+            ocr_task = _StageTask(self._stage_executor, self.perform_ocr, processed_image)
             
-            if 'error' in ocr_result and not ocr_result.get('text'):
-                return {
-                    'success': False,
-                    'error': ocr_result['error'],
-                    'image_url': image_url,
-                    'image_hash': image_hash
-                }
+            try:
+                ocr_result = ocr_task.result(OCR_TIMEOUT)
+            except FutureTimeoutError:
+                ocr_result = {'error': 'OCR処理がタイムアウトしました', 'text': '', 'confidence': 0}
             
-            # データ抽出
-            extracted_data = self.extract_data(ocr_result['text'])
+            # アップロードの失敗・タイムアウトではOCR結果を捨てない（image_url は None）
+            image_url = None
+            try:
+                image_url, _ = upload_task.result(UPLOAD_TIMEOUT)
+            except FutureTimeoutError:
+                print("⚠️ 画像アップロードがタイムアウトしました")
+            except Exception as e:
+                print(f"❌ 画像アップロードエラー: {e}")
             
-            # 信頼度計算
-            confidence = self.calculate_confidence(extracted_data, ocr_result)
-            
-            return {
-                'success': True,
-                'image_url': image_url,
-                'image_hash': image_hash,
-                'extracted_data': extracted_data,
-                'confidence_score': confidence,
-                'ocr_text': ocr_result['text'],
-                'is_test_mode': ocr_result.get('is_test_mode', False)
-            }
+            return self._build_result(ocr_result, image_url, image_hash)
             
         except Exception as e:
             return {
                 'success': False,
                 'error': str(e)
             }
+    
+    def scan_images(self, images: List[bytes]) -> List[Dict[str, Any]]:
+        """
+        複数画像をまとめてスキャン（戻り値は入力と同じ順序の scan_image の結果）
+        - 前処理・アップロードは一括スキャン用のスレッドプールで並列実行
+        - OCRは batch_annotate_images でまとめて実行
+        - 前処理できない画像は元の画像のままOCRする（preprocess_image と同じ）
+        """
+        processed = list(self._batch_executor.map(self.preprocess_image, images))
+        upload_tasks = [
+            _StageTask(self._batch_executor, self.upload_image, image_data) for image_data in processed
+        ]
+        ocr_results = self.perform_ocr_batch(processed)
+        
+        results = []
+        for i, image_data in enumerate(processed):
+            image_url = None
+            try:
+                image_url, _ = upload_tasks[i].result(UPLOAD_TIMEOUT)
+            except FutureTimeoutError:
+                print("⚠️ 画像アップロードがタイムアウトしました")
+            except Exception as e:
+                print(f"❌ 画像アップロードエラー: {e}")
+            try:
+                results.append(self._build_result(
+                    ocr_results[i], image_url, hashlib.sha256(image_data).hexdigest()
+                ))
+            except Exception as e:
+                results.append({'success': False, 'error': str(e)})
+        return results
+    
+    def _build_result(self, ocr_result: Dict[str, Any], image_url: Optional[str],
+                      image_hash: str) -> Dict[str, Any]:
+        """OCR結果からデータを抽出してスキャン結果を作成"""
+        if 'error' in ocr_result and not ocr_result.get('text'):
+            return {
+                'success': False,
+                'error': ocr_result['error'],
+                'image_url': image_url,
+                'image_hash': image_hash
+            }
+        
+        # データ抽出
+        extracted_data = self.extract_data(ocr_result['text'])
+        
+        # 信頼度計算
+        confidence = self.calculate_confidence(extracted_data, ocr_result)
+        
+        return {
+            'success': True,
+            'image_url': image_url,
+            'image_hash': image_hash,
+            'extracted_data': extracted_data,
+            'confidence_score': confidence,
+            'ocr_text': ocr_result['text'],
+            'raw_response': ocr_result.get('raw_response'),
+            'is_test_mode': ocr_result.get('is_test_mode', False)
+        }
 
 
 # シングルトンインスタンス
@@ -0,0 +1,210 @@
+# receipt_totals.py - 伝票から日報合計値への反映
+"""
+伝票（Receipt）の内容を日報（DailyReport）の合計値に反映する
+- 伝票の追加・更新・削除ごとに UPDATE ... SET total_sales = total_sales + :delta で差分反映
+  （日報の伝票件数に関係なく1回の書き込みで済む）
+- 伝票が1件も無かった日報に最初の伝票を追加した場合は、手入力値を伝票の合計で置き換える
+- 変更分は目標進捗スナップショットにも反映
+- check_report_totals で全伝票からの再集計値と突き合わせて補正（定期ジョブ・CLI）
+- コミットは呼び出し側（unit_of_work）で行う
+"""
+
+import os
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+from database_saas import DailyReport, Receipt
+from services.goal_progress import (
+    report_metrics, record_daily_report_changed, record_daily_report_deltas
+)
+
+
+# 整合性チェックの実行間隔（秒）
+REPORT_TOTALS_CHECK_INTERVAL = int(os.getenv("REPORT_TOTALS_CHECK_INTERVAL", "21600"))
+
+# 伝票から集計する日報カラム
+TOTAL_COLUMNS = ("total_sales", "card_sales", "drink_count", "champagne_price")
+
+
+def receipt_values(receipt) -> Dict[str, int]:
+    """伝票1件が日報合計に寄与する値（更新前の値の保存にも使う）"""
+    amount = getattr(receipt, "amount", 0) or 0
+    return {
+        "total_sales": amount,
+        "card_sales": amount if getattr(receipt, "is_card", False) else 0,
+        "drink_count": getattr(receipt, "drink_count", 0) or 0,
+        "champagne_price": getattr(receipt, "champagne_price", 0) or 0,
+        "champagne_type": getattr(receipt, "champagne_type", "") or "",
+    }
+
+
+def _split_types(value: Optional[str]) -> list:
+    return [t.strip() for t in (value or "").split(",") if t.strip()]
+
+
+def _apply_deltas(db: Session, report: DailyReport, deltas: Dict[str, int]):
+    """日報の合計値をアトミックに加減算し、スナップショットへも反映"""
+    deltas = {column: deltas.get(column, 0) for column in TOTAL_COLUMNS}
+    if not any(deltas.values()):
+        return
+    db.query(DailyReport).filter(DailyReport.id == report.id).update(
+        {
+            getattr(DailyReport, column): func.coalesce(getattr(DailyReport, column), 0) + delta
+            for column, delta in deltas.items() if delta
+        },
+        synchronize_session=False
+    )
+    # メモリ上の日報は次回アクセス時に再読み込み
+    db.expire(report, list(TOTAL_COLUMNS))
+    record_daily_report_deltas(db, report, deltas)
+
+
+def _set_champagne_types(db: Session, report: DailyReport, types: Iterable[str]):
+    value = ", ".join(dict.fromkeys(t for t in types if t))
+    db.query(DailyReport).filter(DailyReport.id == report.id).update(
+        {DailyReport.champagne_type: value}, synchronize_session=False
+    )
+    db.expire(report, ["champagne_type"])
+
+
+def _remove_champagne_type(db: Session, report: DailyReport, champagne_type: str):
+    """他の伝票で使われていないシャンパン種類を日報から外す"""
+    if not champagne_type:
+        return
+    still_used = db.query(Receipt.id).filter(
+        Receipt.daily_report_id == report.id,
+        Receipt.champagne_type == champagne_type
+    ).first()
+    if not still_used:
+        types = _split_types(report.champagne_type)
+        if champagne_type in types:
+            _set_champagne_types(db, report, [t for t in types if t != champagne_type])
+
+
+def receipts_added(db: Session, report: DailyReport, receipts: list):
+    """伝票追加を日報合計に反映（伝票は flush 済みであること）"""
+    if not receipts:
+        return
+    values = [receipt_values(r) for r in receipts]
+    added = {column: sum(v[column] for v in values) for column in TOTAL_COLUMNS}
+    new_types = [v["champagne_type"] for v in values]
+
+    # この日報の最初の伝票なら、手入力値を伝票の合計で置き換える
+    had_receipts = db.query(Receipt.id).filter(
+        Receipt.daily_report_id == report.id,
+        Receipt.id.notin_([r.id for r in receipts])
+    ).first()
+    if had_receipts:
+        current_types = _split_types(report.champagne_type)
+        deltas = added
+    else:
+        current_types = []
+        deltas = {column: added[column] - (getattr(report, column) or 0) for column in TOTAL_COLUMNS}
+
+    if any(t and t not in current_types for t in new_types) or not had_receipts:
+        _set_champagne_types(db, report, current_types + new_types)
+    _apply_deltas(db, report, deltas)
+
+
+def receipt_updated(db: Session, report: DailyReport, receipt: Receipt, before: Dict[str, int]):
+    """伝票更新を日報合計に反映（before は更新前の receipt_values）"""
+    db.flush()
+    after = receipt_values(receipt)
+    _apply_deltas(db, report, {column: after[column] - before[column] for column in TOTAL_COLUMNS})
+    if after["champagne_type"] != before["champagne_type"]:
+        if after["champagne_type"] and after["champagne_type"] not in _split_types(report.champagne_type):
+            _set_champagne_types(db, report, _split_types(report.champagne_type) + [after["champagne_type"]])
+        _remove_champagne_type(db, report, before["champagne_type"])
+
+
+def receipt_removed(db: Session, report: DailyReport, receipt: Receipt):
+    """伝票削除を日報合計に反映（伝票の delete は flush 済みであること）"""
+    values = receipt_values(receipt)
+    _apply_deltas(db, report, {column: -values[column] for column in TOTAL_COLUMNS})
+    _remove_champagne_type(db, report, values["champagne_type"])
+
+
+def recalculate_report_totals(db: Session, daily_report: DailyReport):
+    """日報の合計値を全伝票から再集計（整合性チェック・補正用）"""
+    before = report_metrics(daily_report)
+
+    # 追加・変更した伝票を集計に含める
+    db.flush()
+
+    # 関連する伝票を取得
+    receipts = db.query(
+        Receipt.amount, Receipt.is_card, Receipt.drink_count,
+        Receipt.champagne_price, Receipt.champagne_type
+    ).filter(
+        Receipt.daily_report_id == daily_report.id
+    ).all()
+
+    # 集計
+    total_sales = sum(r.amount or 0 for r in receipts)
+    card_sales = sum(r.amount or 0 for r in receipts if r.is_card)
+    drink_count = sum(r.drink_count or 0 for r in receipts)
+    champagne_price = sum(r.champagne_price or 0 for r in receipts)
+    champagne_types = [r.champagne_type for r in receipts if r.champagne_type]
+
+    # 更新
+    daily_report.total_sales = total_sales
+    daily_report.card_sales = card_sales
+    daily_report.drink_count = drink_count
+    daily_report.champagne_price = champagne_price
+    daily_report.champagne_type = ", ".join(dict.fromkeys(champagne_types))
+
+    # 目標進捗スナップショットへ差分を反映
+    record_daily_report_changed(db, daily_report, before)
+
+
+def check_report_totals(db: Session, store_id: Optional[int] = None, fix: bool = True) -> int:
+    """
+    伝票のある日報について、合計値を伝票の再集計値と突き合わせる
+    Returns: 不一致だった日報数（fix=True の場合は補正してコミット）
+    """
+    sums = db.query(
+        Receipt.daily_report_id,
+        func.coalesce(func.sum(Receipt.amount), 0),
+        func.coalesce(func.sum(case((Receipt.is_card == True, Receipt.amount), else_=0)), 0),
+        func.coalesce(func.sum(Receipt.drink_count), 0),
+        func.coalesce(func.sum(Receipt.champagne_price), 0),
+    ).group_by(Receipt.daily_report_id)
+    if store_id is not None:
+        sums = sums.join(DailyReport, DailyReport.id == Receipt.daily_report_id).filter(
+            DailyReport.store_id == store_id
+        )
+    expected = {row[0]: tuple(row[1:]) for row in sums.all()}
+    if not expected:
+        return 0
+
+    actual = db.query(
+        DailyReport.id, DailyReport.total_sales, DailyReport.card_sales,
+        DailyReport.drink_count, DailyReport.champagne_price
+    ).filter(DailyReport.id.in_(expected.keys())).all()
+
+    mismatched = [
+        row[0] for row in actual
+        if tuple(v or 0 for v in row[1:]) != expected[row[0]]
+    ]
+    if mismatched:
+        print(f"⚠️ 日報合計の不一致: {len(mismatched)}件 (ID: {mismatched[:20]})")
+        if fix:
+            for report in db.query(DailyReport).filter(DailyReport.id.in_(mismatched)).all():
+                recalculate_report_totals(db, report)
+            db.commit()
+    return len(mismatched)
+
+
+if __name__ == "__main__":
+    import argparse
+    from services.periodic_jobs import run_job_once
+
+    parser = argparse.ArgumentParser(description="日報合計値の整合性チェック")
+    parser.add_argument("--store-id", type=int, default=None)
+    parser.add_argument("--dry-run", action="store_true", help="補正せずに件数のみ表示")
+    args = parser.parse_args()
+
+    count = run_job_once(lambda db: check_report_totals(db, args.store_id, fix=not args.dry_run))
+    print(f"日報合計の不一致: {count}件" + ("" if args.dry_run else "（補正済み）"))
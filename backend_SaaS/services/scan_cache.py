@@ -0,0 +1,81 @@
+# scan_cache.py - 伝票スキャンの重複検出・OCR結果キャッシュ
+"""
+同じ写真の再スキャン（入力ミス後の撮り直しなど）で、画像アップロードとOCRを省略する
+- 判定キーは (store_id, 元画像のSHA-256)。前処理前のバイト列をハッシュするため判定は軽い
+- 処理済み（COMPLETED）の画像があれば、URL・OCR結果を新しいスキャン画像にコピーして即完了
+- 同じ画像が処理待ち・処理中なら、そのスキャン画像をそのまま返す（ジョブを二重投入しない）
+- ヒット率はプロセス内で集計（get_scan_cache_stats）
+"""
+
+import hashlib
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from database_saas import ReceiptImage, ProcessingStatus
+from services.ocr_payloads import copy_ocr_payload
+
+
+_stats_lock = threading.Lock()
+_stats = {"lookups": 0, "hits": 0, "in_flight_hits": 0}
+
+
+def image_content_hash(image_data: bytes) -> str:
+    """元画像（デコード直後・前処理前）のハッシュ"""
+    return hashlib.sha256(image_data).hexdigest()
+
+
+def _count(key: str):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def find_cached_scan(db: Session, store_id: int, image_hash: str) -> Optional[ReceiptImage]:
+    """
+    同じ店舗の同じ画像のスキャンを探す（失敗したものは除く）
+    Returns: 処理済み、または処理待ち・処理中のスキャン画像
+    """
+    _count("lookups")
+    cached = db.query(ReceiptImage).filter(
+        ReceiptImage.store_id == store_id,
+        ReceiptImage.image_hash == image_hash,
+        ReceiptImage.processing_status.in_([
+            ProcessingStatus.COMPLETED, ProcessingStatus.PENDING, ProcessingStatus.PROCESSING
+        ])
+    ).order_by(ReceiptImage.id.desc()).first()
+    if cached is None:
+        return None
+    _count("hits" if cached.processing_status == ProcessingStatus.COMPLETED else "in_flight_hits")
+    return cached
+
+
+def copy_cached_scan(cached: ReceiptImage, employee_id: int,
+                     daily_report_id: Optional[int]) -> ReceiptImage:
+    """処理済みのスキャン結果から新しいスキャン画像を作成（コミットは呼び出し側）"""
+    now = datetime.utcnow()
+    return ReceiptImage(
+        store_id=cached.store_id,
+        employee_id=employee_id,
+        daily_report_id=daily_report_id,
+        image_url=cached.image_url,
+        image_hash=cached.image_hash,
+        file_size=cached.file_size,
+        mime_type=cached.mime_type,
+        ocr_extracted_data=cached.ocr_extracted_data,
+        ocr_payload=copy_ocr_payload(cached.ocr_payload),
+        processing_status=ProcessingStatus.COMPLETED,
+        confidence_score=cached.confidence_score,
+        uploaded_at=now,
+        processed_at=now
+    )
+
+
+def get_scan_cache_stats() -> Dict[str, float]:
+    """キャッシュのヒット率（プロセス起動からの累計）"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["lookups"]
+    stats["hit_rate"] = round((stats["hits"] + stats["in_flight_hits"]) / lookups, 4) if lookups else 0.0
+    return stats
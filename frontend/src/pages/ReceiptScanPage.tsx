@@ -45,6 +45,7 @@ interface ExtractedData {
 interface ScanResult {
   success: boolean;
   receipt_image_id?: number;
+  processing_status?: 'pending' | 'processing' | 'completed' | 'failed';
   image_url?: string;
   extracted_data?: ExtractedData;
   confidence_score?: number;
@@ -180,7 +181,24 @@ const ReceiptScanPage: React.FC<ReceiptScanPageProps> = ({
         })
       });
 
-      const result: ScanResult = await response.json();
+      let result: ScanResult = await response.json();
+      if (!response.ok && !result.error) {
+        result = { success: false, error: (result as any).detail };
+      }
+
+      // OCRはサーバー側で非同期処理されるため、完了までポーリング
+      for (let attempt = 0; result.success && result.receipt_image_id &&
+           result.processing_status !== 'completed' && attempt < 60; attempt++) {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        const pollResponse = await fetch(
+          `${API_BASE_URL}/api/receipts/scan/${result.receipt_image_id}`,
+          { headers: { 'Authorization': `Bearer ${token}` } }
+        );
+        result = await pollResponse.json();
+      }
+      if (result.success && result.processing_status !== 'completed') {
+        result = { success: false, error: '読み取りがタイムアウトしました' };
+      }
       
       if (result.success) {
         setScanResult(result);